@@ -141,3 +141,24 @@ class RecordAdmin(MainAppAdmin):
 @admin.register(Media)
 class MediaAdmin(MainAppAdmin):
     list_display = ['id', 'record', 'file']
+
+
+@admin.register(UploadJob)
+class UploadJobAdmin(MainAppAdmin):
+    list_display = ['id', 'dataset', 'file_name', 'status', 'rows_processed', 'error_count', 'created']
+    list_filter = ['status', 'dataset']
+    readonly_fields = ['created', 'started', 'heartbeat', 'finished']
+
+
+@admin.register(ChunkedUpload)
+class ChunkedUploadAdmin(MainAppAdmin):
+    list_display = ['id', 'kind', 'file_name', 'user', 'status', 'created']
+    list_filter = ['kind', 'status']
+    readonly_fields = ['created', 'finalized']
+
+
+@admin.register(DataIndex)
+class DataIndexAdmin(MainAppAdmin):
+    list_display = ['id', 'dataset', 'field_name', 'field_type', 'status', 'created', 'finished']
+    list_filter = ['status', 'dataset']
+    readonly_fields = ['created', 'started', 'finished']
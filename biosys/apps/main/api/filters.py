@@ -5,8 +5,10 @@ from django.contrib.auth import get_user_model
 from django_filters import rest_framework as filters, constants
 from django.utils import six
 from rest_framework.exceptions import APIException
+from rest_framework.filters import OrderingFilter
 
 from main import models
+from main.utils_misc import filter_indexed_json_fields, order_by_json_fields
 
 logger = logging.getLogger(__name__)
 
@@ -21,6 +23,39 @@ class FilterException(APIException):
     default_code = 'filter_error'
 
 
+def decode_json_value(value):
+    """
+    Decode the json string of a filter value. Single quotes are accepted.
+    :raise ValueError: if the value is not a valid json string
+    """
+    if isinstance(value, six.string_types):
+        # replace single quote by double quote
+        value = value.replace('\'', '\"')
+        value = json.loads(value)
+    return value
+
+
+def filter_indexed_data(qs, dataset, value):
+    """
+    Give the database a way to use the data indexes of the dataset for a data__contains filter.
+    See main.models.DataIndex.
+    :param qs: the record queryset, already filtered with data__contains
+    :param dataset: the dataset of the records
+    :param value: the data__contains filter value
+    """
+    if dataset is None or value in constants.EMPTY_VALUES:
+        return qs
+    indexed_fields = models.DataIndex.get_indexed_fields(dataset)
+    if not indexed_fields:
+        return qs
+    try:
+        value = decode_json_value(value)
+    except ValueError:
+        # the JSONFilter reports the error
+        return qs
+    return filter_indexed_json_fields(qs, 'data', indexed_fields, value)
+
+
 class JSONFilter(filters.CharFilter):
     """
     A filter that json decode the lookup value before passing it to the queryset filter.
@@ -32,10 +67,7 @@ class JSONFilter(filters.CharFilter):
             return qs
         # value should be a valid json string
         try:
-            if isinstance(value, six.string_types):
-                # replace single quote by double quote
-                value = value.replace('\'', '\"')
-                value = json.loads(value)
+            value = decode_json_value(value)
             qs = super(JSONFilter, self).filter(qs, value)
         except Exception as e:
             message = "Error while filtering {field}__{lookup} with value: '{value}'. {e}".format(
@@ -170,6 +202,27 @@ class RecordFilterSet(filters.FilterSet):
         }
 
 
+class RecordOrderingFilter(OrderingFilter):
+    """
+    The ordering of the records of a dataset by data fields, cast according to their schema type, by the source info
+    (file_name, row) and by the model fields. Several comma separated keys are accepted, the record id is the tiebreak.
+    ex: ?ordering=Species,-When
+    Without a dataset it's the default DRF ordering.
+    """
+    source_info_fields = [('file_name', 'string'), ('row', 'integer')]
+
+    def filter_queryset(self, request, queryset, view):
+        dataset = getattr(view, 'dataset', None)
+        ordering_param = request.query_params.get(self.ordering_param)
+        if dataset is None or not ordering_param:
+            return super(RecordOrderingFilter, self).filter_queryset(request, queryset, view)
+        fields = dict((name, ('source_info', field_type)) for name, field_type in self.source_info_fields)
+        # a data field hides the source info with the same name
+        fields.update((field.name, ('data', field.type)) for field in dataset.schema.fields)
+        model_fields = [name for name, label in self.get_valid_fields(queryset, view, {'request': request})]
+        return order_by_json_fields(queryset, fields, ordering_param, model_fields)
+
+
 class MediaFilterSet(filters.FilterSet):
     class Meta:
         model = models.Media
@@ -8,6 +8,7 @@ from django.core.exceptions import ValidationError
 from django.core.validators import RegexValidator
 from django.utils import timezone
 from django.conf import settings
+from django.db import models
 
 from rest_framework import serializers, fields, validators
 from rest_framework_gis import serializers as serializers_gis
@@ -15,9 +16,11 @@ from drf_extra_fields.fields import Base64ImageField
 
 from main.api.validators import get_record_validator_for_dataset
 from main.constants import MODEL_SRID
-from main.models import Program, Project, Site, Dataset, Record, Media, DatasetMedia, ProjectMedia
+from main.api.uploaders import FileReader
+from main.models import Program, Project, Site, Dataset, Record, Media, DatasetMedia, ProjectMedia, UploadJob, \
+    ChunkedUpload, DatasetGraph
 from main.utils_auth import is_admin
-from main.utils_species import get_key_for_value
+from main.utils_data_package import SiteGeometryResolver
 
 User = get_user_model()
 
@@ -148,6 +151,8 @@ class SiteSerializer(serializers.ModelSerializer):
 class DatasetSerializer(serializers.ModelSerializer):
     record_count = serializers.IntegerField(required=False, read_only=True)
     extent = serializers.ListField(required=False, read_only=True)
+    # the status of the indexes of the fields flagged as indexed in the schema. See DataIndex.
+    data_indexes = serializers.SerializerMethodField()
 
     class DataPackageValidator:
         def __init__(self):
@@ -170,6 +175,17 @@ class DatasetSerializer(serializers.ModelSerializer):
         ]
     )
 
+    def get_data_indexes(self, instance):
+        return [
+            {
+                'field_name': index.field_name,
+                'field_type': index.field_type,
+                'status': index.status,
+                'error_message': index.error_message
+            }
+            for index in instance.data_indexes.all()
+        ]
+
     def update(self, instance, validated_data):
         has_data = Record.objects.filter(dataset=instance).count() > 0
         if has_data:
@@ -226,6 +242,18 @@ class SchemaValidator:
             self.dataset = ctx['dataset']
 
 
+class RecordListSerializer(serializers.ListSerializer):
+    """
+    Resolve the parent and children of all the records of a list at once (see DatasetGraph.resolve_records).
+    """
+
+    def to_representation(self, data):
+        records = list(data.all() if isinstance(data, models.Manager) else data)
+        if 'parent' in self.child.fields or 'children' in self.child.fields:
+            self.child.record_relations.update(DatasetGraph.resolve_records(records))
+        return super(RecordListSerializer, self).to_representation(records)
+
+
 class RecordSerializer(serializers.ModelSerializer):
     parent = serializers.SerializerMethodField()
     children = serializers.SerializerMethodField()
@@ -238,9 +266,13 @@ class RecordSerializer(serializers.ModelSerializer):
         self.strict_schema_validation = ctx.get('strict', False)
         # species naming service
         self.species_naming_facade_class = ctx.get('species_naming_facade_class')
-        # the next object will hold a cached version of the 'species_name' -> name_id obtained
+        # the next object will hold a cached SpeciesIndex (species_name <-> name_id) obtained
         # from the species_naming_facade above.
-        self.species_name_id_mapping_cached = None
+        self.species_index_cached = None
+        # project.pk -> SiteGeometryResolver. The site geometries are looked up once per request.
+        self.site_geometry_resolvers = {}
+        # record.pk -> (parent, children). See get_record_relations
+        self.record_relations = {}
 
         # dynamic fields
         request = ctx.get('request')
@@ -283,8 +315,11 @@ class RecordSerializer(serializers.ModelSerializer):
         return dataset.schema.cast_record_observation_date(data)
 
     @staticmethod
-    def get_geometry(dataset, data):
-        return dataset.schema.cast_geometry(data, default_srid=dataset.project.datum or MODEL_SRID)
+    def get_geometry(dataset, data, site_geometry_resolver=None):
+        schema = dataset.schema
+        if site_geometry_resolver is not None:
+            schema.site_geometry_resolver = site_geometry_resolver
+        return schema.cast_geometry(data, default_srid=dataset.project.datum or MODEL_SRID)
 
     @staticmethod
     def set_date(instance, validated_data, commit=True):
@@ -302,8 +337,9 @@ class RecordSerializer(serializers.ModelSerializer):
         return instance
 
     @staticmethod
-    def set_geometry(instance, validated_data, commit=True):
-        geom = RecordSerializer.get_geometry(instance.dataset, validated_data['data'])
+    def set_geometry(instance, validated_data, commit=True, site_geometry_resolver=None):
+        geom = RecordSerializer.get_geometry(instance.dataset, validated_data['data'],
+                                             site_geometry_resolver=site_geometry_resolver)
         if geom:
             instance.geometry = geom
             if commit:
@@ -312,9 +348,15 @@ class RecordSerializer(serializers.ModelSerializer):
 
     def set_date_and_geometry(self, instance, validated_data, commit=True):
         self.set_date(instance, validated_data, commit=commit)
-        self.set_geometry(instance, validated_data, commit=commit)
+        self.set_geometry(instance, validated_data, commit=commit,
+                          site_geometry_resolver=self.get_site_geometry_resolver(instance.dataset.project))
         return instance
 
+    def get_site_geometry_resolver(self, project):
+        if project.pk not in self.site_geometry_resolvers:
+            self.site_geometry_resolvers[project.pk] = SiteGeometryResolver(project)
+        return self.site_geometry_resolvers[project.pk]
+
     def set_species_name_and_id(self, instance, validated_data, commit=True):
         dataset = instance.dataset
         schema = dataset.schema
@@ -322,15 +364,15 @@ class RecordSerializer(serializers.ModelSerializer):
         # either a species name or a nameId
         species_name = schema.cast_species_name(schema_data)
         name_id = schema.cast_species_name_id(schema_data)
-        species_mapping = self.get_species_name_id_mapping()
-        if species_mapping:
+        species_index = self.get_species_index()
+        if species_index:
             # name id takes precedence
             if name_id and name_id != -1:
-                species_name = get_key_for_value(species_mapping, int(name_id), None)
+                species_name = species_index.get_species_name(name_id)
                 if not species_name:
                     raise Exception("Cannot find a species with nameId={}".format(name_id))
             elif species_name:
-                name_id = int(species_mapping.get(species_name, -1))
+                species_name, name_id = species_index.get_species(species_name, (species_name, -1))
             else:
                 raise Exception('Missing Species Name or Species Name Id')
         else:
@@ -342,14 +384,14 @@ class RecordSerializer(serializers.ModelSerializer):
             instance.save()
         return instance
 
-    def get_species_name_id_mapping(self):
+    def get_species_index(self):
         if all([
-            self.species_name_id_mapping_cached is None,
+            self.species_index_cached is None,
             self.species_naming_facade_class is not None,
-            callable(getattr(self.species_naming_facade_class, 'name_id_by_species_name'))
+            callable(getattr(self.species_naming_facade_class, 'get_species_index', None))
         ]):
-            self.species_name_id_mapping_cached = self.species_naming_facade_class().name_id_by_species_name()
-        return self.species_name_id_mapping_cached
+            self.species_index_cached = self.species_naming_facade_class().get_species_index()
+        return self.species_index_cached
 
     def set_fields_from_data(self, instance, validated_data):
         try:
@@ -362,21 +404,28 @@ class RecordSerializer(serializers.ModelSerializer):
         except Exception as e:
             raise serializers.ValidationError(e)
 
+    def get_record_relations(self, record):
+        """
+        The parent and children of the record. Resolved for the whole list by the RecordListSerializer.
+        :return: (parent, children)
+        """
+        if record.pk not in self.record_relations:
+            self.record_relations.update(DatasetGraph.resolve_records([record]))
+        return self.record_relations.get(record.pk, (None, None))
+
     def get_parent(self, record):
         """
         Return the FIRST parent record.id or None
         """
-        parents = record.parents
         # currently client support only one parent
-        return parents[0].id if parents else None
+        return self.get_record_relations(record)[0]
 
     def get_children(self, record):
         """
         :param record:
         :return: an array of children record ids, or None
         """
-        children = record.children
-        return [rec.id for rec in children] if children is not None else None
+        return self.get_record_relations(record)[1]
 
     def validate_data(self, data):
         """
@@ -388,7 +437,9 @@ class RecordSerializer(serializers.ModelSerializer):
         schema_validator = SchemaValidator(strict=self.strict_schema_validation)
         schema_validator.dataset = self.dataset
         if self.dataset and self.dataset.type == Dataset.TYPE_SPECIES_OBSERVATION:
-            schema_validator.kwargs['species_name_id_mapping'] = self.get_species_name_id_mapping()
+            schema_validator.kwargs['species_index'] = self.get_species_index()
+        if self.dataset:
+            schema_validator.kwargs['site_geometry_resolver'] = self.get_site_geometry_resolver(self.dataset.project)
         schema_validator(data)
         return data
 
@@ -411,6 +462,50 @@ class RecordSerializer(serializers.ModelSerializer):
     class Meta:
         model = Record
         fields = '__all__'
+        list_serializer_class = RecordListSerializer
+
+
+class UploadJobSerializer(serializers.ModelSerializer):
+    is_finished = serializers.BooleanField(read_only=True)
+    has_error = serializers.BooleanField(read_only=True)
+
+    class Meta:
+        model = UploadJob
+        fields = ('id', 'dataset', 'user', 'file_name', 'options', 'status', 'is_finished', 'has_error',
+                  'rows_processed', 'error_count', 'result_truncated', 'error_message', 'created', 'started',
+                  'heartbeat', 'finished')
+        read_only_fields = fields
+
+
+class ChunkedUploadSerializer(serializers.ModelSerializer):
+    chunk_count = serializers.IntegerField(read_only=True)
+    received_chunks = serializers.ListField(child=serializers.IntegerField(), read_only=True)
+    missing_chunks = serializers.ListField(child=serializers.IntegerField(), read_only=True)
+    received_ranges = serializers.ListField(child=serializers.ListField(), read_only=True)
+
+    def validate(self, attrs):
+        kind = attrs.get('kind')
+        if kind == ChunkedUpload.KIND_RECORDS and not attrs.get('dataset'):
+            raise serializers.ValidationError({'dataset': 'A dataset is required for a records upload.'})
+        if kind == ChunkedUpload.KIND_SITES and not attrs.get('project'):
+            raise serializers.ValidationError({'project': 'A project is required for a sites upload.'})
+        if attrs.get('content_type') not in FileReader.SUPPORTED_TYPES:
+            raise serializers.ValidationError({'content_type': "Wrong file type {}. Should be one of: {}".format(
+                attrs.get('content_type'), FileReader.SUPPORTED_TYPES)})
+        if attrs.get('total_size', 0) <= 0:
+            raise serializers.ValidationError({'total_size': 'The file size must be greater than 0.'})
+        chunk_size = attrs.get('chunk_size', 0)
+        if chunk_size <= 0 or chunk_size > settings.CHUNKED_UPLOAD_MAX_CHUNK_SIZE:
+            raise serializers.ValidationError({'chunk_size': 'The chunk size must be between 1 and {} bytes.'.format(
+                settings.CHUNKED_UPLOAD_MAX_CHUNK_SIZE)})
+        return attrs
+
+    class Meta:
+        model = ChunkedUpload
+        fields = ('id', 'user', 'kind', 'dataset', 'project', 'file_name', 'content_type', 'total_size',
+                  'chunk_size', 'options', 'status', 'chunk_count', 'received_chunks', 'missing_chunks',
+                  'received_ranges', 'created', 'finalized')
+        read_only_fields = ('user', 'status', 'created', 'finalized')
 
 
 class Base64ProjectMediaSerializer(serializers.ModelSerializer):
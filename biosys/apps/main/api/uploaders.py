@@ -1,20 +1,29 @@
 import codecs
+import collections
 import datetime
+import hashlib
+import json
+import logging
+import multiprocessing
+import os
 from os import path
 
 import datapackage
 from django.conf import settings
+from django.contrib.postgres.fields.jsonb import KeyTextTransform
+from django.db import connections, transaction
+from django.db.models import Max
 from django.utils import six, timezone
 from django.utils.text import slugify
 from openpyxl import load_workbook
 
-from main.api.validators import get_record_validator_for_dataset
+from main.api.validators import get_record_validator_for_dataset, GenericRecordValidator
 from main.constants import MODEL_SRID
-from main.models import Site, Dataset
-from main.utils_data_package import GeometryParser, ObservationSchema, SpeciesObservationSchema, BiosysSchema, \
-    SpeciesNameParser
+from main.models import Site, Dataset, UploadJob, SpeciesSummary, RecordLink
+from main.utils_data_package import GeometryParser, ObservationSchema, BiosysSchema, \
+    SpeciesNameParser, SiteGeometryResolver
 from main.utils_misc import get_value
-from main.utils_species import HerbieFacade, get_key_for_value
+from main.utils_species import HerbieFacade, SpeciesIndex
 
 # TODO: remove when python3
 if six.PY2:
@@ -22,27 +31,60 @@ if six.PY2:
 else:
     import csv
 
+logger = logging.getLogger(__name__)
 
-def xlsx_to_csv(file_):
 
+class XLSXDictReader(object):
+    """
+    A csv.DictReader like reader for xlsx file.
+    The rows are read straight from the openpyxl read-only (streaming) worksheet, the whole sheet is never loaded in
+    memory. Values are returned as strings, like the csv reader would do, dates being formatted with
+    settings.DATE_FORMAT.
+    Only the first sheet is read.
+    """
+
+    def __init__(self, file_):
+        self.workbook = load_workbook(filename=file_, read_only=True)
+        self.rows = iter([])
+        self.fieldnames = []
+        # use the first sheet
+        if len(self.workbook.worksheets) > 0:
+            self.rows = iter(self.workbook.worksheets[0].rows)
+            headers = next(self.rows, [])
+            self.fieldnames = [self._format(cell) for cell in headers]
+
+    @staticmethod
     def _format(cell_):
         result = cell_.value
+        if result is None:
+            return ''
         if isinstance(result, datetime.datetime):
             result = result.strftime(settings.DATE_FORMAT)
-        return result
+        return six.text_type(result)
 
-    output = six.StringIO()
-    writer = csv.writer(output)
-    wb = load_workbook(filename=file_, read_only=True)
-    # use the first sheet
-    if len(wb.worksheets) > 0:
-        ws = wb.worksheets[0]
-        for row in ws.rows:
-            r = [_format(cell) for cell in row]
-            writer.writerow(r)
-    # rewind
-    output.seek(0)
-    return output
+    def __iter__(self):
+        # the empty rows are only yielded when followed by a non-empty row: the trailing empty rows of a sheet (often
+        # just formatted cells) are ignored and the row numbers of the other rows are unchanged.
+        empty_rows = []
+        for cells in self.rows:
+            values = [self._format(cell) for cell in cells]
+            row = dict(zip(self.fieldnames, values))
+            # same as csv.DictReader: missing values are set to None
+            for field_name in self.fieldnames[len(values):]:
+                row.setdefault(field_name, None)
+            if not any(values):
+                empty_rows.append(row)
+                continue
+            for empty_row in empty_rows:
+                yield empty_row
+            empty_rows = []
+            yield row
+
+    def close(self):
+        # the read-only workbook keeps the zip archive open.
+        archive = getattr(self.workbook, '_archive', None)
+        if archive is not None:
+            archive.close()
 
 
 # TODO: investigate the use frictionless tabulator.Stream as a xlsx/csv reader instead of this class
@@ -91,6 +133,7 @@ class FileReader(object):
 
     def __init__(self, file_):
         self.file = file_
+        self.closed = False
         if hasattr(file_, 'name'):
             self.file_name = file_.name
         file_format = self.get_uploaded_file_format(self.file)
@@ -98,8 +141,7 @@ class FileReader(object):
             msg = "Wrong file type {}. Should be one of: {}".format(file_.content_type, self.SUPPORTED_TYPES)
             raise Exception(msg)
         if file_format == self.XLSX_FORMAT:
-            self.file = xlsx_to_csv(file_)
-            self.reader = csv.DictReader(self.file)
+            self.reader = XLSXDictReader(self.file)
         else:
             if six.PY3:
                 self.reader = csv.DictReader(codecs.iterdecode(self.file, 'utf-8'))
@@ -112,6 +154,9 @@ class FileReader(object):
             self.reader.unicode_fieldnames = [f.strip() for f in self.reader.unicode_fieldnames]
 
     def __iter__(self):
+        # the file is closed once read, reading it again yields no rows.
+        if self.closed:
+            return
         for row in self.reader:
             # remove 'blank' column
             for column in list(row.keys()):
@@ -121,7 +166,10 @@ class FileReader(object):
         self.close()
 
     def close(self):
+        if isinstance(self.reader, XLSXDictReader):
+            self.reader.close()
         self.file.close()
+        self.closed = True
 
 
 class SiteUploader(FileReader):
@@ -225,9 +273,87 @@ class SiteUploader(FileReader):
         return attributes
 
 
+# The RecordCreator used by the validation process pool workers.
+# It is set in the parent process just before the pool is forked, the workers get their own copy.
+_pool_creator = None
+# The database connections inherited from the parent process. A reference is kept so they are never closed or
+# garbage collected by a worker (that would close the parent connection).
+_pool_inherited_connections = []
+
+
+def _init_pool_worker():
+    for conn in connections.all():
+        if conn.connection is not None:
+            _pool_inherited_connections.append(conn.connection)
+            conn.connection = None
+
+
+def _prepare_rows(rows):
+    return [_pool_creator.prepare_row(row) for row in rows]
+
+
+def _get_fork_context():
+    """
+    :return: a multiprocessing fork context or None if fork is not available on this platform.
+    """
+    if six.PY2:
+        return multiprocessing if hasattr(os, 'fork') else None
+    try:
+        return multiprocessing.get_context('fork')
+    except ValueError:
+        return None
+
+
+def get_record_content_hash(data):
+    """
+    :param data: the record data
+    :return: a hash of the record data that doesn't depend on the order of the keys.
+    """
+    return hashlib.sha1(json.dumps(data, sort_keys=True).encode('utf-8')).hexdigest()
+
+
+def get_primary_key_text(value):
+    """
+    :return: the value as it is returned by the postgres json ->> operator: text for a string, json for a number or a
+    boolean and None for null.
+    """
+    if value is None or isinstance(value, six.string_types):
+        return value
+    return json.dumps(value)
+
+
 class RecordCreator:
+    # Number of rows sent to a worker process at once when the records are not saved in batches.
+    PROCESS_CHUNK_SIZE = 200
+    # Number of rows matched against the existing records at once in upsert mode (if no batch size is given).
+    UPSERT_CHUNK_SIZE = 500
+    # Number of records deleted at once by the delete_missing option.
+    DELETE_CHUNK_SIZE = 1000
+    # Values of the upsert_action attribute set on the records in upsert mode.
+    ACTION_CREATED = 'created'
+    ACTION_UPDATED = 'updated'
+    ACTION_UNCHANGED = 'unchanged'
+
     def __init__(self, dataset, data_generator,
-                 commit=True, create_site=False, validator=None, species_facade_class=HerbieFacade):
+                 commit=True, create_site=False, validator=None, species_facade_class=HerbieFacade,
+                 batch_size=None, processes=None, upsert=False, delete_missing=False, species_match_threshold=None):
+        """
+        :param batch_size: if set (and commit is True) the valid records are saved in chunks of batch_size
+        with a bulk insert instead of one insert per row.
+        :param processes: if greater than 1 the validation and casting of the rows are done in a pool of
+        forked processes. The records are still created and saved in row order by the calling process.
+        Meant for the upload jobs and management commands, not for a web request process. The pool is not used
+        inside a transaction: the workers have their own connections and wouldn't see the uncommitted rows
+        (e.g. the sites created for the previous chunks).
+        :param upsert: if True (and commit is True) the rows are matched to the existing records of the dataset with
+        the schema primaryKey. An existing record is updated only if its data changed and a new record is created
+        for an unknown key. The dataset schema must declare a primaryKey. Implies the batched mode.
+        :param delete_missing: with upsert, delete the records of the dataset whose key is not in the file, once the
+        whole file has been processed. Nothing is deleted if a row failed or if the file has no key.
+        :param species_match_threshold: species observation only. The species names not found in the species list are
+        fuzzy matched (see species_matches). If set (0 to 1), the best suggestion of a name is accepted if its score is
+        at least the threshold: the record gets the suggested species name and name id and the row a warning.
+        """
         self.dataset = dataset
         self.generator = data_generator
         self.create_site = create_site
@@ -235,36 +361,414 @@ class RecordCreator:
         self.schema = dataset.schema
         self.record_model = dataset.record_model
         self.validator = validator if validator else get_record_validator_for_dataset(dataset)
+        self.is_observation = dataset.type in [Dataset.TYPE_OBSERVATION, Dataset.TYPE_SPECIES_OBSERVATION]
+        self.is_species_observation = dataset.type == Dataset.TYPE_SPECIES_OBSERVATION
+        self.default_srid = dataset.project.datum or MODEL_SRID
         # if species. First load species list from herbie. Should raise an exception if problem.
-        self.species_id_by_name = {}
-        if dataset.type == Dataset.TYPE_SPECIES_OBSERVATION:
-            self.species_id_by_name = species_facade_class().name_id_by_species_name()
+        self.species_index = SpeciesIndex()
+        if self.is_species_observation:
+            self.species_index = species_facade_class().get_species_index()
+        self.species_match_threshold = species_match_threshold
+        # {species name: match} of the unmatched species names of the upload. See _match_species
+        self.species_matches = collections.OrderedDict()
         # Schema foreign key for site.
         self.site_fk = self.schema.get_fk_for_model('Site')
         self.commit = commit
+        self.batch_size = batch_size
+        self.processes = processes
+        self.upsert = upsert
+        self.delete_missing = upsert and delete_missing
+        self.primary_key_fields = self.schema.primary_key if upsert else []
+        if upsert and not self.primary_key_fields:
+            raise ValueError("The dataset '{}' has no primaryKey declared in its schema.".format(dataset))
+        # {primary key: row} of the rows processed so far (upsert mode)
+        self.seen_keys = {}
+        self.created_count = 0
+        self.updated_count = 0
+        self.unchanged_count = 0
+        self.deleted_count = 0
         self.file_name = self.generator.file_name if hasattr(self.generator, 'file_name') else None
         # Trick: use GeometryParser to get the site code
         self.geo_parser = GeometryParser(self.schema)
+        # {code: site} of the project, see sites_by_code
+        self._sites_by_code = None
+        # sites to be created with the next chunk of records (batched mode)
+        self._pending_sites = []
+        # the site geometries are resolved once for the whole upload, by the schema and the validator.
+        self.site_geometry_resolver = None
+        if self.is_observation:
+            self.site_geometry_resolver = SiteGeometryResolver(dataset.project)
+            if self.geo_parser.is_valid() and self.geo_parser.is_site_code:
+                self.site_geometry_resolver.add_sites(self.sites_by_code.values())
+            self.schema.site_geometry_resolver = self.site_geometry_resolver
+            if isinstance(self.validator.schema, ObservationSchema):
+                self.validator.schema.site_geometry_resolver = self.site_geometry_resolver
+
+    @property
+    def is_batched(self):
+        return self.commit and (self.upsert or (bool(self.batch_size) and self.batch_size > 1))
+
+    @property
+    def chunk_size(self):
+        """
+        The number of records saved at once in batched mode.
+        """
+        if self.batch_size and self.batch_size > 1:
+            return self.batch_size
+        return self.UPSERT_CHUNK_SIZE
+
+    @property
+    def is_parallel(self):
+        return bool(self.processes) and self.processes > 1
 
     def __iter__(self):
+        if self.is_batched:
+            for result in self._iter_batched():
+                yield result
+        else:
+            counter = 0
+            for prepared in self._iter_prepared_rows():
+                counter += 1
+                yield self._build_record(prepared, counter)
+
+    def _iter_batched(self):
+        """
+        Same as the standard iteration but the records are saved in chunks.
+        The (record, validator_result) tuples of a chunk are yielded, in row order, after the chunk has been saved.
+        """
+        save_chunk = self._upsert_chunk if self.upsert else self._save_chunk
+        chunk = []
         counter = 0
-        for data in self.generator:
+        has_errors = False
+        for prepared in self._iter_prepared_rows():
             counter += 1
-            yield self._create_record(data, counter)
+            chunk.append(self._build_record(prepared, counter, commit=False))
+            if len(chunk) >= self.chunk_size:
+                for result in save_chunk(self._match_species(chunk)):
+                    has_errors = has_errors or result[1].has_errors
+                    yield result
+                chunk = []
+        if chunk:
+            for result in save_chunk(self._match_species(chunk)):
+                has_errors = has_errors or result[1].has_errors
+                yield result
+        # a file without keys or with failed rows doesn't say which records are missing.
+        if self.delete_missing and self.seen_keys and not has_errors:
+            self._delete_missing_records()
+
+    def _iter_prepared_rows(self):
+        """
+        :return: a generator of prepared rows (see prepare_row) in the order of the data generator.
+        """
+        if self.is_parallel:
+            context = _get_fork_context()
+            if context is None:
+                logger.warning("Multi-process validation not available on this platform. "
+                               "Rows are validated serially.")
+            elif transaction.get_connection().in_atomic_block:
+                logger.warning("Multi-process validation not available inside a transaction. "
+                               "Rows are validated serially.")
+            else:
+                for prepared in self._iter_prepared_rows_parallel(context):
+                    yield prepared
+                return
+        for data in self.generator:
+            yield self.prepare_row(data)
+
+    def _iter_prepared_rows_parallel(self, context):
+        """
+        Fan out the preparation of chunks of rows to a pool of forked processes and yield the results in row order.
+        The number of chunks in flight is bounded so the whole file is never loaded in memory.
+        """
+        global _pool_creator
+        _pool_creator = self
+        try:
+            pool = context.Pool(processes=self.processes, initializer=_init_pool_worker)
+        finally:
+            _pool_creator = None
+        chunk_size = self.chunk_size if self.is_batched else self.PROCESS_CHUNK_SIZE
+        max_pending = self.processes * 2
+        pending = collections.deque()
+        try:
+            chunk = []
+            for data in self.generator:
+                chunk.append(data)
+                if len(chunk) >= chunk_size:
+                    pending.append(pool.apply_async(_prepare_rows, (chunk,)))
+                    chunk = []
+                    if len(pending) >= max_pending:
+                        for prepared in pending.popleft().get():
+                            yield prepared
+            if chunk:
+                pending.append(pool.apply_async(_prepare_rows, (chunk,)))
+            while pending:
+                for prepared in pending.popleft().get():
+                    yield prepared
+            pool.close()
+        except BaseException:
+            pool.terminate()
+            raise
+        finally:
+            pool.join()
+
+    def _save_chunk(self, chunk):
+        """
+        Bulk insert the valid records of the chunk in a single transaction, after the bulk insert of the sites
+        queued for creation.
+        If the bulk insert fails the chunk is saved record by record so that the error can be reported on the
+        faulty rows only.
+        :param chunk: a list of (record, validator_result)
+        :return: the chunk
+        """
+        records = [record for record, validator_result in chunk
+                   if record is not None and validator_result.is_valid]
+        if not records:
+            return chunk
+        if self._pending_sites:
+            self._create_pending_sites()
+            for record in records:
+                if record.site is not None:
+                    # the site pk has been set by the bulk insert.
+                    record.site_id = record.site.pk
+        try:
+            with transaction.atomic():
+                self.record_model.objects.bulk_create(records)
+                # bulk_create doesn't send the post_save signals
+                SpeciesSummary.record_changes(added=[SpeciesSummary.get_entry(record) for record in records])
+                self.record_model.update_search_vectors(self.dataset, [record.pk for record in records])
+                RecordLink.add_links(self.dataset, [record.pk for record in records])
+        except Exception as e:
+            logger.warning("Bulk insert of {} records failed. Saving one by one. {}".format(len(records), e))
+            for record, validator_result in chunk:
+                if record is not None and validator_result.is_valid:
+                    record.pk = None
+                    try:
+                        with transaction.atomic():
+                            record.save()
+                    except Exception as e:
+                        validator_result.add_column_error('unknown', str(e))
+        return chunk
 
-    def _create_record(self, row, counter):
+    def _upsert_chunk(self, chunk):
         """
+        Match the valid records of the chunk to the existing records with the same primary key.
+        The unchanged records are left untouched, the changed ones are updated in bulk and the new ones are bulk
+        inserted (see _save_chunk).
+        Every valid record gets an upsert_action attribute set to one of the ACTION_* values.
+        :param chunk: a list of (record, validator_result)
+        :return: the chunk
+        """
+        records = [record for record, validator_result in chunk
+                   if record is not None and validator_result.is_valid]
+        if not records:
+            return chunk
+        if self._pending_sites:
+            self._create_pending_sites()
+            for record in records:
+                if record.site is not None:
+                    record.site_id = record.site.pk
+        existing_by_key = self._get_existing_records(records)
+        new_chunk = []
+        changed_chunk = []
+        for record, validator_result in chunk:
+            if record is None or not validator_result.is_valid:
+                continue
+            existing = existing_by_key.get(self.get_primary_key(record.data))
+            if existing is None:
+                record.upsert_action = self.ACTION_CREATED
+                new_chunk.append((record, validator_result))
+            else:
+                existing_pk, existing_data, record._species_summary_entry = existing
+                record.pk = existing_pk
+                if get_record_content_hash(existing_data) == get_record_content_hash(record.data):
+                    record.upsert_action = self.ACTION_UNCHANGED
+                    self.unchanged_count += 1
+                else:
+                    record.upsert_action = self.ACTION_UPDATED
+                    changed_chunk.append((record, validator_result))
+        if changed_chunk:
+            self._update_chunk(changed_chunk)
+        if new_chunk:
+            self._save_chunk(new_chunk)
+            self.created_count += len([r for r, validator_result in new_chunk if r.pk is not None])
+        return chunk
+
+    def _get_existing_records(self, records):
+        """
+        :return: {primary key: (pk, data, species summary entry)} of the records of the dataset that have the same
+        primary key as one of the given records.
+        """
+        key_fields = self.primary_key_fields
+        keys = set([self.get_primary_key(record.data) for record in records])
+        aliases = ['_pk_{}'.format(i) for i in range(len(key_fields))]
+        queryset = self.dataset.record_queryset.annotate(**{
+            alias: KeyTextTransform(field, 'data') for alias, field in zip(aliases, key_fields)
+        }).filter(**{
+            aliases[0] + '__in': set([key[0] for key in keys if key[0] is not None])
+        })
+        result = {}
+        for values in queryset.values_list('pk', 'data', 'dataset_id', 'species_name', 'name_id', 'datetime', *aliases):
+            key = tuple(values[6:])
+            if key in keys:
+                entry = values[2:6] if values[3] else None
+                result[key] = (values[0], values[1], entry)
+        return result
+
+    def _update_chunk(self, chunk):
+        """
+        Update the records of the chunk with a single UPDATE ... FROM (VALUES ...) statement.
+        If it fails the records are saved one by one so that the error can be reported on the faulty rows only.
+        :param chunk: a list of (record, validator_result) where every record has its pk set.
+        """
+        records = [record for record, validator_result in chunk]
+        try:
+            with transaction.atomic():
+                self._bulk_update_records(records)
+                SpeciesSummary.record_changes(
+                    added=[SpeciesSummary.get_entry(record) for record in records],
+                    removed=[record._species_summary_entry for record in records]
+                )
+                RecordLink.update_links(self.dataset, [record.pk for record in records])
+            self.updated_count += len(records)
+        except Exception as e:
+            logger.warning("Bulk update of {} records failed. Saving one by one. {}".format(len(records), e))
+            for record, validator_result in chunk:
+                try:
+                    with transaction.atomic():
+                        record.save(update_fields=[
+                            'data', 'site', 'datetime', 'geometry', 'species_name', 'name_id', 'source_info',
+                            'last_modified'
+                        ])
+                    self.updated_count += 1
+                except Exception as e:
+                    validator_result.add_column_error('unknown', str(e))
+
+    def _bulk_update_records(self, records):
+        # Django 1.11 has no bulk_update.
+        sql = """
+        UPDATE {table} SET
+            data = v.data, site_id = v.site_id, datetime = v.datetime, geometry = v.geometry,
+            species_name = v.species_name, name_id = v.name_id, source_info = v.source_info, last_modified = now(),
+            search_vector = biosys_search_vector(v.data, v.source_info, %s::text[])
+        FROM (VALUES {values}) AS v(id, data, site_id, datetime, geometry, species_name, name_id, source_info)
+        WHERE {table}.id = v.id
+        """.format(
+            table=self.record_model._meta.db_table,
+            values=', '.join(
+                ['(%s::integer, %s::jsonb, %s::integer, %s::timestamptz, '
+                 'ST_Transform(ST_GeomFromEWKT(%s), {srid}), %s::varchar, %s::integer, %s::jsonb)'.format(
+                     srid=MODEL_SRID)] * len(records)
+            )
+        )
+        params = [self.schema.field_names]
+        for record in records:
+            params += [
+                record.pk,
+                json.dumps(record.data),
+                record.site.pk if record.site is not None else None,
+                record.datetime,
+                record.geometry.ewkt if record.geometry is not None else None,
+                record.species_name,
+                record.name_id,
+                json.dumps(record.source_info) if record.source_info is not None else None
+            ]
+        with connections[self.record_model.objects.db].cursor() as cursor:
+            cursor.execute(sql, params)
+
+    def _delete_missing_records(self):
+        """
+        Delete the records of the dataset whose primary key hasn't been seen in the file.
+        The keys are compared in SQL (as jsonb arrays of the ->> texts, see get_primary_key): only the ids of the records
+        to delete are fetched.
+        """
+        key_expression = 'jsonb_build_array({})'.format(', '.join(['data->>%s'] * len(self.primary_key_fields)))
+        queryset = self.dataset.record_queryset.extra(
+            where=[key_expression + ' <> ALL(%s::jsonb[])'],
+            params=list(self.primary_key_fields) + [[json.dumps(list(key)) for key in self.seen_keys]]
+        )
+        to_delete = list(queryset.values_list('pk', flat=True).iterator())
+        for i in range(0, len(to_delete), self.DELETE_CHUNK_SIZE):
+            with SpeciesSummary.batch():
+                self.record_model.objects.filter(pk__in=to_delete[i:i + self.DELETE_CHUNK_SIZE]).delete()
+        self.deleted_count = len(to_delete)
+
+    def get_primary_key(self, row):
+        """
+        :param row: a casted row or a record data
+        :return: the tuple of the primary key values as text (see get_primary_key_text).
+        """
+        return tuple([get_primary_key_text(row.get(field)) for field in self.primary_key_fields])
+
+    def _check_primary_key(self, row, validator_result, counter):
+        """
+        Keep track of the primary key of the row and report an error if the same key has already been seen.
+        The key of an invalid row is kept too: its existing record must not be deleted by the delete_missing option.
+        """
+        key = self.get_primary_key(row)
+        if all([value in [None, ''] for value in key]):
+            return
+        row_id = counter + 1  # add one to match excel/csv row id
+        if key in self.seen_keys:
+            message = "Duplicate primary key value {} (already at row {})".format(
+                ', '.join([value or '' for value in key]), self.seen_keys[key])
+            validator_result.add_column_error(self.primary_key_fields[0], message)
+        else:
+            self.seen_keys[key] = row_id
+
+    def prepare_row(self, row):
+        """
+        The CPU bound part of the record creation: validation and casting of the row values.
+        It doesn't touch the database except for the site geometry lookup and can be run in a worker process.
         :param row: a {column(string): value(string)} dictionary
-        :return: record, RecordValidatorResult
+        :return: a dictionary with the casted row, the RecordValidatorResult and the casted observation date,
+        geometry and species name/name id (if applicable). 'error' holds the message of any casting error.
         """
         validator_result = self.validator.validate(row)
-        record = None
         # The row values comes as string but we want to save numeric field as json number not string to allow a
         # correct ordering. The next call will cast the numeric field into python int or float.
         row = self.schema.cast_numbers(row)
+        prepared = {
+            'row': row,
+            'validator_result': validator_result,
+            'error': None
+        }
+        if validator_result.is_valid and self.is_observation:
+            try:
+                prepared['observation_date'] = self.schema.cast_record_observation_date(row)
+                prepared['geometry'] = self.schema.cast_geometry(row, default_srid=self.default_srid)
+                if self.is_species_observation:
+                    # either a species name or a nameId
+                    prepared['species_name'] = self.schema.cast_species_name(row)
+                    prepared['name_id'] = self.schema.cast_species_name_id(row)
+            except Exception as e:
+                prepared['error'] = str(e)
+        return prepared
+
+    def _create_record(self, row, counter, commit=None):
+        """
+        :param row: a {column(string): value(string)} dictionary
+        :param commit: override the creator commit option. Used by the batched mode to postpone the save.
+        :return: record, RecordValidatorResult
+        """
+        return self._build_record(self.prepare_row(row), counter, commit=commit)
+
+    def _build_record(self, prepared, counter, commit=None):
+        """
+        :param prepared: a prepared row. See prepare_row
+        :param commit: override the creator commit option. Used by the batched mode to postpone the save.
+        :return: record, RecordValidatorResult
+        """
+        commit = self.commit if commit is None else commit
+        row = prepared['row']
+        validator_result = prepared['validator_result']
+        record = None
+        if self.upsert:
+            self._check_primary_key(row, validator_result, counter)
         try:
+            if prepared['error']:
+                raise Exception(prepared['error'])
             if validator_result.is_valid:
-                site = self._get_or_create_site(row)
+                site = self._get_or_create_site(row, commit=commit)
                 record = self.record_model(
                     site=site,
                     dataset=self.dataset,
@@ -275,8 +779,8 @@ class RecordCreator:
                     }
                 )
                 # specific fields
-                if self.dataset.type == Dataset.TYPE_OBSERVATION or self.dataset.type == Dataset.TYPE_SPECIES_OBSERVATION:
-                    observation_date = self.schema.cast_record_observation_date(row)
+                if self.is_observation:
+                    observation_date = prepared['observation_date']
                     if observation_date:
                         # convert to datetime with timezone awareness
                         if isinstance(observation_date, datetime.date):
@@ -285,26 +789,27 @@ class RecordCreator:
                         record.datetime = timezone.make_aware(observation_date, tz)
 
                     # geometry
-                    geometry = self.schema.cast_geometry(row, default_srid=self.dataset.project.datum or MODEL_SRID)
-                    record.geometry = geometry
-                    if self.dataset.type == Dataset.TYPE_SPECIES_OBSERVATION:
+                    record.geometry = prepared['geometry']
+                    if self.is_species_observation:
                         # species stuff. Lookup for species match in herbie.
-                        # either a species name or a nameId
-                        species_name = self.schema.cast_species_name(row)
-                        name_id = self.schema.cast_species_name_id(row)
+                        species_name = prepared['species_name']
+                        name_id = prepared['name_id']
                         # name id takes precedence
                         if name_id:
-                            species_name = get_key_for_value(self.species_id_by_name, int(name_id), None)
+                            species_name = self.species_index.get_species_name(name_id)
                             if not species_name:
                                 column_name = self.schema.species_name_parser.name_id_field.name
                                 message = "Cannot find a species with nameId={}".format(name_id)
                                 validator_result.add_column_error(column_name, message)
                                 return record, validator_result
                         elif species_name:
-                            name_id = int(self.species_id_by_name.get(species_name, -1))
+                            species_name, name_id = self.species_index.get_species(species_name, (species_name, -1))
                         record.species_name = species_name
                         record.name_id = name_id
-                if self.commit:
+                        if not self.is_batched:
+                            # the batched mode matches the whole chunk before the save
+                            self._match_species([(record, validator_result)])
+                if commit:
                     record.save()
         except Exception as e:
             # catch all errors
@@ -312,19 +817,648 @@ class RecordCreator:
             validator_result.add_column_error('unknown', message)
         return record, validator_result
 
-    def _get_or_create_site(self, row):
+    def _match_species(self, chunk):
+        """
+        Fuzzy match the species names of the chunk that are not in the species list (name_id = -1).
+        The names not seen before in the upload are matched in one batch, every distinct name only once.
+        :param chunk: a list of (record, validator_result)
+        :return: the chunk
+        """
+        if not self.is_species_observation:
+            return chunk
+        unmatched = [(record, validator_result) for record, validator_result in chunk
+                     if record is not None and validator_result.is_valid and record.name_id == -1 and
+                     record.species_name]
+        if not unmatched:
+            return chunk
+        new_names = [record.species_name for record, validator_result in unmatched
+                     if record.species_name not in self.species_matches]
+        for species_name, suggestions in six.iteritems(self.species_index.matcher.match(new_names)):
+            accepted = None
+            if suggestions and self.species_match_threshold is not None and \
+                    suggestions[0]['score'] >= self.species_match_threshold:
+                accepted = suggestions[0]
+            self.species_matches[species_name] = {
+                'speciesName': species_name,
+                'rowCount': 0,
+                'suggestions': suggestions,
+                'accepted': accepted
+            }
+        parser = self.schema.species_name_parser
+        column_name = (parser.species_name_field or parser.genus_field).name
+        for record, validator_result in unmatched:
+            match = self.species_matches[record.species_name]
+            match['rowCount'] += 1
+            accepted = match['accepted']
+            if accepted:
+                message = "Species name '{}' not found. Matched to '{}' (score {})".format(
+                    record.species_name, accepted['speciesName'], accepted['score'])
+                validator_result.add_column_warning(column_name, message)
+                record.species_name = accepted['speciesName']
+                record.name_id = accepted['nameId']
+        return chunk
+
+    def get_species_matches(self):
+        """
+        :return: the list of the species names not found in the species list with the number of rows, the
+        suggestions and the accepted suggestion (or None). See _match_species
+        """
+        return list(self.species_matches.values())
+
+    def _get_or_create_site(self, row, commit=True):
+        """
+        Resolve the site of the row from the project sites index.
+        If the site doesn't exist and the create_site option is set, the site is created or, if commit is False,
+        queued for a bulk creation (see _create_pending_sites).
+        Without the creator commit option (dry run) the record gets the site that would be created, never saved.
+        """
         site = None
         if self.geo_parser.is_valid() and self.geo_parser.is_site_code:
             site_code = self.geo_parser.get_site_code(row)
-            kwargs = {
-                "project": self.dataset.project,
-                "code": site_code
-            }
-            site = Site.objects.filter(**kwargs).first()
+            if not site_code:
+                return None
+            sites_by_code = self.sites_by_code
+            site = sites_by_code.get(site_code)
             if site is None and self.create_site:
-                site = Site.objects.create(**kwargs)
+                site = Site(project=self.dataset.project, code=site_code)
+                if commit:
+                    site.save()
+                elif self.commit:
+                    self._pending_sites.append(site)
+                sites_by_code[site_code] = site
         return site
 
+    @property
+    def sites_by_code(self):
+        """
+        The {code: site} index of the project sites. Loaded once.
+        """
+        if self._sites_by_code is None:
+            self._sites_by_code = {site.code: site for site in Site.objects.filter(project=self.dataset.project)}
+        return self._sites_by_code
+
+    def _create_pending_sites(self):
+        """
+        Bulk insert the sites queued by _get_or_create_site.
+        If the bulk insert fails (e.g. a site with the same code has been created in the meantime) the sites are
+        fetched or created one by one.
+        """
+        if not self._pending_sites:
+            return
+        sites = self._pending_sites
+        self._pending_sites = []
+        try:
+            with transaction.atomic():
+                Site.objects.bulk_create(sites)
+        except Exception as e:
+            logger.warning("Bulk insert of {} sites failed. Saving one by one. {}".format(len(sites), e))
+            for site in sites:
+                site.pk = None
+                existing = Site.objects.filter(project=site.project, code=site.code).first()
+                if existing is not None:
+                    site.pk = existing.pk
+                else:
+                    site.save()
+
+
+def iter_upload_results(creator):
+    """
+    Run the record creator and yield one result by row.
+    :param creator: a RecordCreator
+    :return: a generator of {'row': row, 'recordId': id (if no errors), 'warnings': ..., 'errors': ...}
+    """
+    row = 1  # starts at 1 to match excel row id
+    for record, validator_result in creator:
+        row += 1
+        result = {
+            'row': row
+        }
+        if not validator_result.has_errors:
+            result['recordId'] = record.id
+            if hasattr(record, 'upsert_action'):
+                result['action'] = record.upsert_action
+        result.update(validator_result.to_dict())
+        yield result
+
+
+class UploadResultSummary(object):
+    """
+    Aggregate the row results of an upload (see iter_upload_results) into a compact report:
+    the totals and, for the errors and the warnings, the count by (column, message) with the first example rows.
+    """
+    # number of example rows kept for every (column, message)
+    MAX_EXAMPLE_ROWS = 10
+
+    def __init__(self, max_example_rows=None):
+        self.max_example_rows = max_example_rows if max_example_rows is not None else self.MAX_EXAMPLE_ROWS
+        self.row_count = 0
+        self.record_count = 0
+        self.error_row_count = 0
+        self.warning_row_count = 0
+        # upsert mode: {action: number of records}
+        self.action_counts = collections.OrderedDict()
+        # (column, message) -> {'count': n, 'rows': [rows]}
+        self.errors = collections.OrderedDict()
+        self.warnings = collections.OrderedDict()
+
+    @property
+    def has_error(self):
+        return self.error_row_count > 0
+
+    def add(self, result):
+        self.row_count += 1
+        if result.get('recordId') is not None:
+            self.record_count += 1
+        if result.get('action'):
+            self.action_counts[result['action']] = self.action_counts.get(result['action'], 0) + 1
+        if result.get('errors'):
+            self.error_row_count += 1
+            self._add_messages(self.errors, result['errors'], result.get('row'))
+        if result.get('warnings'):
+            self.warning_row_count += 1
+            self._add_messages(self.warnings, result['warnings'], result.get('row'))
+
+    def add_all(self, results):
+        for result in results:
+            self.add(result)
+        return self
+
+    def _add_messages(self, groups, messages, row):
+        for column, message in messages.items():
+            group = groups.setdefault((column, message), {'count': 0, 'rows': []})
+            group['count'] += 1
+            if len(group['rows']) < self.max_example_rows:
+                group['rows'].append(row)
+
+    @staticmethod
+    def _groups_to_list(groups):
+        result = [
+            {
+                'column': column,
+                'message': message,
+                'count': group['count'],
+                'rows': group['rows']
+            } for (column, message), group in groups.items()
+        ]
+        # most frequent first. The sort is stable, ties are kept in order of appearance.
+        return sorted(result, key=lambda g: -g['count'])
+
+    def to_dict(self):
+        result = {
+            'rowCount': self.row_count,
+            'recordCount': self.record_count,
+            'errorRowCount': self.error_row_count,
+            'warningRowCount': self.warning_row_count,
+            'errors': self._groups_to_list(self.errors),
+            'warnings': self._groups_to_list(self.warnings)
+        }
+        if self.action_counts:
+            result.update({
+                'createdCount': self.action_counts.get(RecordCreator.ACTION_CREATED, 0),
+                'updatedCount': self.action_counts.get(RecordCreator.ACTION_UPDATED, 0),
+                'unchangedCount': self.action_counts.get(RecordCreator.ACTION_UNCHANGED, 0)
+            })
+        return result
+
+
+class _LinesReader(object):
+    """
+    A read only file like object over an iterator of strings. Used to stream the COPY data.
+    """
+
+    def __init__(self, lines):
+        self.lines = iter(lines)
+        self.buffer = ''
+
+    def read(self, size=-1):
+        while size < 0 or len(self.buffer) < size:
+            try:
+                self.buffer += next(self.lines)
+            except StopIteration:
+                break
+        if size < 0:
+            result, self.buffer = self.buffer, ''
+        else:
+            result, self.buffer = self.buffer[:size], self.buffer[size:]
+        return result
+
+
+def to_copy_text(value):
+    """
+    Format a value for the postgres COPY text format.
+    """
+    if value is None:
+        return '\\N'
+    if isinstance(value, bool):
+        return 'true' if value else 'false'
+    if isinstance(value, (datetime.date, datetime.datetime)):
+        return value.isoformat()
+    if not isinstance(value, six.string_types):
+        value = six.text_type(value)
+    return value.replace('\\', '\\\\').replace('\t', '\\t').replace('\n', '\\n').replace('\r', '\\r')
+
+
+class RecordCopyLoader(object):
+    """
+    Bulk load the records of a file into a dataset through a staging table filled with COPY.
+    The rows are validated and casted in python, then the site, geometry, datetime and species columns are built in
+    SQL, set-based, and the records are moved into the record table with a single INSERT ... SELECT.
+    Much faster than the RecordCreator for large files but all or nothing: everything is done in one transaction and
+    no record id is returned. Meant for trusted bulk loads, e.g. historical back-capture (see the load_records
+    command).
+    """
+    STAGING_TABLE = 'record_staging'
+    SPECIES_TABLE = 'record_staging_species'
+    STAGING_COLUMNS = [
+        'row_number', 'data', 'source_info', 'warnings', 'site_code', 'x', 'y', 'srid', 'observation_date',
+        'species_name', 'species_key', 'name_id'
+    ]
+    # kind of errors found in SQL
+    ERROR_GEOMETRY = 'geometry'
+    ERROR_SPECIES = 'species'
+
+    def __init__(self, dataset, data_generator, create_site=False, strict=False,
+                 species_facade_class=HerbieFacade):
+        self.dataset = dataset
+        self.generator = data_generator
+        self.create_site = create_site
+        self.schema = dataset.schema
+        self.record_model = dataset.record_model
+        # only the schema validation is done by the validator, the observation casting is done by the loader.
+        self.validator = GenericRecordValidator(dataset, schema_error_as_warning=not strict)
+        self.is_observation = dataset.type in [Dataset.TYPE_OBSERVATION, Dataset.TYPE_SPECIES_OBSERVATION]
+        self.is_species_observation = dataset.type == Dataset.TYPE_SPECIES_OBSERVATION
+        self.default_srid = dataset.project.datum or MODEL_SRID
+        self.timezone = dataset.project.timezone or timezone.get_current_timezone()
+        self.species_index = SpeciesIndex()
+        if self.is_species_observation:
+            self.species_index = species_facade_class().get_species_index()
+        self.file_name = self.generator.file_name if hasattr(self.generator, 'file_name') else None
+        self.geo_parser = GeometryParser(self.schema)
+        self.has_site_code = self.geo_parser.is_valid() and self.geo_parser.is_site_code
+        # a schema error on these fields is always an error (see ObservationValidator)
+        self.strict_fields = []
+        if self.is_observation:
+            self.strict_fields += [f.name for f in self.schema.geometry_parser.get_active_fields()]
+            self.strict_fields += [f.name for f in self.schema.date_parser.get_active_fields()]
+        if self.is_species_observation:
+            self.strict_fields += [f.name for f in self.schema.species_name_parser.get_active_fields()]
+        self.summary = UploadResultSummary()
+
+    def load(self):
+        """
+        :return: an UploadResultSummary
+        """
+        connection = connections[self.record_model.objects.db]
+        with transaction.atomic(using=connection.alias), connection.cursor() as cursor:
+            self._create_staging_tables(cursor)
+            cursor.copy_expert(
+                'COPY {} ({}) FROM STDIN'.format(self.STAGING_TABLE, ', '.join(self.STAGING_COLUMNS)),
+                _LinesReader(self._iter_copy_lines())
+            )
+            if self.has_site_code:
+                self._resolve_sites(cursor)
+            if self.is_observation:
+                self._build_geometries(cursor)
+            if self.is_species_observation:
+                self._resolve_species(cursor)
+            self._report_staging_results(cursor)
+            self.summary.record_count = self._insert_records(cursor)
+            if self.is_species_observation:
+                self._update_species_summary(cursor)
+            if self.summary.record_count:
+                # the new records only add links, the existing ones are kept.
+                RecordLink.add_links(self.dataset)
+        return self.summary
+
+    def _create_staging_tables(self, cursor):
+        cursor.execute("""
+        CREATE TEMPORARY TABLE {} (
+            row_number integer PRIMARY KEY,
+            data jsonb NOT NULL,
+            source_info jsonb,
+            warnings jsonb,
+            site_code text,
+            x double precision,
+            y double precision,
+            srid integer,
+            observation_date timestamp,
+            species_name text,
+            species_key text,
+            name_id integer,
+            site_id integer,
+            geometry geometry,
+            error text,
+            error_kind text
+        ) ON COMMIT DROP
+        """.format(self.STAGING_TABLE))
+        if self.is_species_observation:
+            cursor.execute(
+                "CREATE TEMPORARY TABLE {} (position integer, name text, key text, name_id integer) "
+                "ON COMMIT DROP".format(self.SPECIES_TABLE))
+            # the position in the species index breaks the ties the same way as the SpeciesIndex lookups.
+            cursor.copy_expert(
+                'COPY {} (position, name, key, name_id) FROM STDIN'.format(self.SPECIES_TABLE),
+                _LinesReader(
+                    '{}\t{}\t{}\t{}\n'.format(
+                        position, to_copy_text(name), to_copy_text(SpeciesIndex.normalise(name)),
+                        to_copy_text(name_id))
+                    for position, (name, name_id) in enumerate(self.species_index.items())
+                )
+            )
+            cursor.execute("CREATE INDEX ON {} (name_id)".format(self.SPECIES_TABLE))
+            cursor.execute("CREATE INDEX ON {} (key)".format(self.SPECIES_TABLE))
+
+    def _iter_copy_lines(self):
+        """
+        Validate and cast the rows. The invalid rows are reported in the summary, the others are yielded as COPY lines.
+        """
+        row_number = 1  # starts at 1 to match excel row id
+        for row in self.generator:
+            row_number += 1
+            values, validator_result = self._cast_row(row, row_number)
+            if values is None:
+                self.summary.add({
+                    'row': row_number,
+                    'errors': validator_result.errors,
+                    'warnings': validator_result.warnings
+                })
+            else:
+                yield '\t'.join([to_copy_text(value) for value in values]) + '\n'
+        self.summary.row_count = row_number - 1
+
+    def _cast_row(self, row, row_number):
+        """
+        :return: (the staging values of the row or None if the row is not valid, RecordValidatorResult)
+        """
+        validator_result = self.validator.validate(row)
+        for field_name in self.strict_fields:
+            if field_name in validator_result.warnings:
+                validator_result.add_column_error(field_name, validator_result.warnings.pop(field_name))
+        if validator_result.has_errors:
+            return None, validator_result
+        row = self.schema.cast_numbers(row)
+        site_code = self.geo_parser.get_site_code(row) if self.has_site_code else None
+        x, y, srid, observation_date, species_name, name_id = (None,) * 6
+        if self.is_observation:
+            try:
+                observation_date = self.schema.cast_record_observation_date(row)
+                if observation_date:
+                    if not isinstance(observation_date, datetime.datetime):
+                        observation_date = datetime.datetime.combine(observation_date, datetime.time.min)
+                    elif timezone.is_aware(observation_date):
+                        observation_date = timezone.make_naive(observation_date, self.timezone)
+            except Exception as e:
+                validator_result.add_column_error(self.schema.observation_date_field.name, str(e))
+            try:
+                coordinates = self.schema.geometry_parser.cast_coordinates(row, default_srid=self.default_srid)
+                if coordinates is not None:
+                    x, y, srid = coordinates
+            except Exception as e:
+                for field in self.schema.geometry_parser.get_active_fields():
+                    validator_result.add_column_error(field.name, str(e))
+        if self.is_species_observation:
+            try:
+                species_name = self.schema.cast_species_name(row)
+                name_id = self.schema.cast_species_name_id(row)
+            except Exception as e:
+                validator_result.add_column_error('unknown', str(e))
+        if validator_result.has_errors:
+            return None, validator_result
+        source_info = {
+            'file_name': self.file_name,
+            'row': row_number
+        }
+        warnings = validator_result.warnings or None
+        return [
+            row_number,
+            json.dumps(row),
+            json.dumps(source_info),
+            json.dumps(warnings) if warnings else None,
+            site_code or None,
+            x,
+            y,
+            srid,
+            observation_date,
+            species_name or None,
+            SpeciesIndex.normalise(species_name) if species_name else None,
+            int(name_id) if name_id else None
+        ], validator_result
+
+    def _resolve_sites(self, cursor):
+        project_id = self.dataset.project_id
+        if self.create_site:
+            cursor.execute("""
+            INSERT INTO {site_table} (project_id, code, name)
+            SELECT DISTINCT %s, s.site_code, ''
+            FROM {staging} s
+            WHERE s.site_code IS NOT NULL AND NOT EXISTS (
+                SELECT 1 FROM {site_table} site WHERE site.project_id = %s AND site.code = s.site_code
+            )
+            """.format(site_table=Site._meta.db_table, staging=self.STAGING_TABLE), [project_id, project_id])
+        cursor.execute("""
+        UPDATE {staging} s SET site_id = site.id
+        FROM {site_table} site
+        WHERE site.project_id = %s AND site.code = s.site_code
+        """.format(site_table=Site._meta.db_table, staging=self.STAGING_TABLE), [project_id])
+
+    def _build_geometries(self, cursor):
+        """
+        Same rules as GeometryParser.cast_geometry: coordinates first then the site geometry.
+        """
+        staging = self.STAGING_TABLE
+        cursor.execute("""
+        UPDATE {staging} SET geometry = ST_Transform(ST_SetSRID(ST_MakePoint(x, y), srid), %s)
+        WHERE x IS NOT NULL AND y IS NOT NULL
+        """.format(staging=staging), [MODEL_SRID])
+        cursor.execute("""
+        UPDATE {staging} s SET geometry = site.geometry
+        FROM {site_table} site
+        WHERE s.geometry IS NULL AND site.id = s.site_id
+        """.format(staging=staging, site_table=Site._meta.db_table))
+        cursor.execute("""
+        UPDATE {staging} SET
+            error_kind = %s,
+            error = CASE
+                WHEN site_code IS NOT NULL AND site_id IS NULL THEN 'The site ' || site_code || ' does not exist'
+                WHEN site_id IS NOT NULL THEN 'The site ' || site_code || ' has no geometry'
+                ELSE 'No Latitude/Longitude Easting/Northing or Site Code found!'
+            END
+        WHERE geometry IS NULL
+        """.format(staging=staging), [self.ERROR_GEOMETRY])
+
+    def _resolve_species(self, cursor):
+        """
+        Same rules as the RecordCreator: the name id takes precedence over the species name.
+        Same results as the SpeciesIndex lookups when several names share a name id or a normalised name: the exact
+        name first, then the first one in the index. A found species name is replaced by the name of the species list.
+        """
+        staging = self.STAGING_TABLE
+        species = self.SPECIES_TABLE
+        cursor.execute("""
+        UPDATE {staging} s SET species_name = (
+            SELECT sp.name FROM {species} sp WHERE sp.name_id = s.name_id ORDER BY sp.position LIMIT 1
+        )
+        WHERE s.name_id IS NOT NULL AND EXISTS (SELECT 1 FROM {species} sp WHERE sp.name_id = s.name_id)
+        """.format(staging=staging, species=species))
+        cursor.execute("""
+        UPDATE {staging} s SET error_kind = %s, error = 'Cannot find a species with nameId=' || s.name_id
+        WHERE s.error IS NULL AND s.name_id IS NOT NULL AND NOT EXISTS (
+            SELECT 1 FROM {species} sp WHERE sp.name_id = s.name_id
+        )
+        """.format(staging=staging, species=species), [self.ERROR_SPECIES])
+        cursor.execute("""
+        UPDATE {staging} s SET (name_id, species_name) = (
+            SELECT sp.name_id, sp.name FROM {species} sp WHERE sp.key = s.species_key
+            ORDER BY (sp.name = s.species_name) DESC, sp.position LIMIT 1
+        )
+        WHERE s.name_id IS NULL AND s.species_name IS NOT NULL AND EXISTS (
+            SELECT 1 FROM {species} sp WHERE sp.key = s.species_key
+        )
+        """.format(staging=staging, species=species))
+        cursor.execute("""
+        UPDATE {staging} s SET name_id = -1 WHERE s.name_id IS NULL AND s.species_name IS NOT NULL
+        """.format(staging=staging))
+
+    def _get_error_columns(self, error_kind):
+        if error_kind == self.ERROR_GEOMETRY:
+            return [f.name for f in self.schema.geometry_parser.get_active_fields()]
+        if error_kind == self.ERROR_SPECIES:
+            return [self.schema.species_name_parser.name_id_field.name]
+        return ['unknown']
+
+    def _report_staging_results(self, cursor):
+        """
+        Add the rows with an error found in SQL or a warning to the summary.
+        """
+        cursor.execute("""
+        SELECT row_number, warnings, error, error_kind FROM {staging}
+        WHERE error IS NOT NULL OR warnings IS NOT NULL
+        ORDER BY row_number
+        """.format(staging=self.STAGING_TABLE))
+        row_count = self.summary.row_count
+        for row_number, warnings, error, error_kind in cursor:
+            result = {
+                'row': row_number,
+                'errors': {column: error for column in self._get_error_columns(error_kind)} if error else {},
+                'warnings': warnings or {}
+            }
+            self.summary.add(result)
+        # the summary counts the rows it's given but it has already been set to the number of rows of the file.
+        self.summary.row_count = row_count
+
+    def _insert_records(self, cursor):
+        """
+        :return: the number of records created
+        """
+        cursor.execute("""
+        INSERT INTO {record_table} (
+            dataset_id, site_id, data, source_info, datetime, geometry, species_name, name_id, validated, locked,
+            created, last_modified, search_vector
+        )
+        SELECT
+            %s, site_id, data, source_info, observation_date AT TIME ZONE %s, geometry, species_name,
+            COALESCE(name_id, -1), false, false, now(), now(), biosys_search_vector(data, source_info, %s::text[])
+        FROM {staging}
+        WHERE error IS NULL
+        ORDER BY row_number
+        """.format(record_table=self.record_model._meta.db_table, staging=self.STAGING_TABLE),
+                       [self.dataset.pk, six.text_type(self.timezone), self.schema.field_names])
+        return cursor.rowcount
+
+    def _update_species_summary(self, cursor):
+        cursor.execute("""
+        SELECT %s, species_name, COALESCE(name_id, -1), count(*),
+            min(observation_date AT TIME ZONE %s), max(observation_date AT TIME ZONE %s)
+        FROM {staging}
+        WHERE error IS NULL AND species_name IS NOT NULL AND species_name <> ''
+        GROUP BY species_name, COALESCE(name_id, -1)
+        """.format(staging=self.STAGING_TABLE),
+                       [self.dataset.pk, six.text_type(self.timezone), six.text_type(self.timezone)])
+        SpeciesSummary.add_aggregates([tuple(row) for row in cursor])
+
+
+class UploadJobRunner(object):
+    """
+    Process an UploadJob: create the records from the job file and keep track of the progress.
+    """
+    # how often (number of rows) the progress is saved
+    PROGRESS_INTERVAL = 100
+
+    def __init__(self, job, species_facade_class=HerbieFacade, batch_size=None, processes=None, max_results=None):
+        self.job = job
+        self.species_facade_class = species_facade_class
+        self.batch_size = batch_size if batch_size is not None else settings.RECORD_UPLOAD_BATCH_SIZE
+        self.processes = processes if processes is not None else settings.RECORD_UPLOAD_PROCESSES
+        self.max_results = max_results if max_results is not None else settings.UPLOAD_JOB_MAX_RESULTS
+
+    def run(self):
+        job = self.job
+        if job.status != UploadJob.STATUS_RUNNING:
+            job.status = UploadJob.STATUS_RUNNING
+            job.started = job.heartbeat = timezone.now()
+            job.save(update_fields=['status', 'started', 'heartbeat'])
+        # the row results are kept up to max_results, the summary covers all the rows.
+        results = []
+        summary = UploadResultSummary()
+        job.result_truncated = False
+        job.rows_processed = 0
+        job.error_count = 0
+        try:
+            dataset = job.dataset
+            options = job.options or {}
+            # delete_previous: the records of the dataset before the job are only deleted once the file has been
+            # processed, a failed job (bad file, dead worker) keeps them.
+            previous_max_id = None
+            if options.get('delete_previous') and not options.get('upsert'):
+                previous_max_id = dataset.record_queryset.aggregate(max_id=Max('id'))['max_id']
+            file_ = job.file
+            file_.open('rb')
+            # FileReader expects an uploaded file with a content type
+            file_.content_type = job.content_type
+            generator = FileReader(file_)
+            generator.file_name = job.file_name or generator.file_name
+            validator = get_record_validator_for_dataset(dataset)
+            validator.schema_error_as_warning = not options.get('strict', False)
+            creator = RecordCreator(dataset, generator,
+                                    validator=validator, create_site=options.get('create_site', False), commit=True,
+                                    species_facade_class=self.species_facade_class,
+                                    batch_size=self.batch_size,
+                                    processes=self.processes,
+                                    upsert=options.get('upsert', False),
+                                    delete_missing=options.get('delete_missing', False),
+                                    species_match_threshold=options.get('species_match_threshold'))
+            for result in iter_upload_results(creator):
+                summary.add(result)
+                if len(results) < self.max_results:
+                    results.append(result)
+                else:
+                    job.result_truncated = True
+                job.rows_processed += 1
+                if result.get('errors'):
+                    job.error_count += 1
+                if job.rows_processed % self.PROGRESS_INTERVAL == 0:
+                    job.heartbeat = timezone.now()
+                    job.save(update_fields=['rows_processed', 'error_count', 'heartbeat'])
+            if previous_max_id is not None:
+                with SpeciesSummary.batch():
+                    dataset.record_queryset.filter(id__lte=previous_max_id).delete()
+            job.status = UploadJob.STATUS_SUCCESS
+        except Exception as e:
+            logger.exception("Error while processing the upload job {}".format(job.pk))
+            job.status = UploadJob.STATUS_FAILED
+            job.error_message = str(e)
+        finally:
+            try:
+                job.file.close()
+            except Exception:
+                pass
+        job.result = results
+        job.summary = summary.to_dict()
+        job.finished = timezone.now()
+        job.save()
+        return job
+
 
 class DataPackageBuilder:
 
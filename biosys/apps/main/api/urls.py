@@ -17,6 +17,8 @@ router.register(r'records?', api_views.RecordViewSet, 'record')
 router.register(r'media', api_views.MediaViewSet, 'media')
 router.register(r'project-media', api_views.ProjectMediaViewSet, 'project-media')
 router.register(r'dataset-media', api_views.DatasetMediaViewSet, 'dataset-media')
+router.register(r'upload-jobs', api_views.UploadJobViewSet, 'upload-job')
+router.register(r'chunked-uploads', api_views.ChunkedUploadViewSet, 'chunked-upload')
 
 
 url_patterns = [
@@ -30,6 +32,7 @@ url_patterns = [
         name='dataset-upload'),
     url(r'statistics/?', api_views.StatisticsView.as_view(), name="statistics"),
     url(r'whoami/?', api_views.WhoamiView.as_view(), name="whoami"),
+    url(r'species/match/?', api_views.SpeciesMatchView.as_view(), name="species-match"),
     url(r'species/?', api_views.SpeciesView.as_view(), name="species"),
     url(r'logout/?', api_views.LogoutView.as_view(), name="logout"),
     # utils
@@ -1,5 +1,6 @@
 from main.constants import MODEL_SRID
 from main.models import Dataset
+from main.utils_data_package import SiteGeometryResolver
 
 
 def get_record_validator_for_dataset(dataset, **kwargs):
@@ -74,9 +75,10 @@ class GenericRecordValidator(object):
         """
         data = dict(data)
         result = RecordValidatorResult()
+        compiled_validator = self.schema.compiled_validator
         for field_name, value in data.items():
             try:
-                schema_error_msg = self.schema.field_validation_error(field_name, value)
+                schema_error_msg = compiled_validator.field_validation_error(field_name, value)
             except Exception as e:
                 schema_error_msg = str(e)
             if schema_error_msg:
@@ -85,7 +87,7 @@ class GenericRecordValidator(object):
                 else:
                     result.add_column_error(field_name, schema_error_msg)
         # check for missing required fields
-        for field in self.schema.required_fields:
+        for field in compiled_validator.required_fields:
             if field.name not in data:
                 msg = "The field '{}' is missing".format(field.name)
                 if self.schema_error_as_warning:
@@ -104,6 +106,9 @@ class ObservationValidator(GenericRecordValidator):
         self.site_col = self.schema.site_code_field.name if self.schema.site_code_field else None
         self.geometry_parser = self.schema.geometry_parser
         self.date_parser = self.schema.date_parser
+        # the site geometry lookups are scoped to the project and cached. The resolver can be shared with the caller.
+        self.schema.site_geometry_resolver = kwargs.get('site_geometry_resolver') or SiteGeometryResolver(
+            dataset.project)
 
     def validate(self, data):
         result = super(ObservationValidator, self).validate(data)
@@ -150,9 +155,10 @@ class ObservationValidator(GenericRecordValidator):
 
 class SpeciesObservationValidator(ObservationValidator):
     def __init__(self, dataset, schema_error_as_warning=True, **kwargs):
-        super(SpeciesObservationValidator, self).__init__(dataset, schema_error_as_warning)
+        super(SpeciesObservationValidator, self).__init__(dataset, schema_error_as_warning, **kwargs)
         self.parser = self.schema.species_name_parser
-        self.species_name_id_mapping = kwargs.get('species_name_id_mapping')
+        # a SpeciesIndex
+        self.species_index = kwargs.get('species_index')
 
     def validate(self, data, schema_error_as_warning=True):
         result = super(SpeciesObservationValidator, self).validate(data)
@@ -171,8 +177,8 @@ class SpeciesObservationValidator(ObservationValidator):
         result = RecordValidatorResult()
         if self.parser.has_name_id:
             name_id = self.parser.cast_species_name_id(data)
-            if name_id and self.species_name_id_mapping is not None:
-                if name_id not in self.species_name_id_mapping.values():
+            if name_id and self.species_index is not None:
+                if not self.species_index.has_name_id(name_id):
                     message = "Cannot find a species with nameId={}".format(name_id)
                     result.add_column_error(self.parser.name_id_field.name, message)
         return result
@@ -1,19 +1,27 @@
 from __future__ import absolute_import, unicode_literals, print_function, division
 
 import datetime
+import io
 import logging
 from collections import OrderedDict
 from os import path
 
 from django.contrib.auth import get_user_model, logout
+from django.core.files import File
 from django.core.files.uploadhandler import TemporaryFileUploadHandler
-from django.db.models import Q
+from django.contrib.postgres.aggregates import ArrayAgg
+from django.db.models import Q, Sum, Min, Max
 from django.shortcuts import get_object_or_404
 from django.conf import settings
+from django.utils import six
+from django_filters.rest_framework import DjangoFilterBackend
 from dry_rest_permissions.generics import DRYPermissions
-from rest_framework import viewsets, generics, status
+from rest_framework import viewsets, generics, mixins, status
+from rest_framework.decorators import action
+from rest_framework.exceptions import PermissionDenied, ValidationError
 from rest_framework.parsers import MultiPartParser, FormParser, FileUploadParser, JSONParser
 from rest_framework.permissions import IsAuthenticated, BasePermission, SAFE_METHODS
+from rest_framework.renderers import BaseRenderer, JSONRenderer
 from rest_framework.views import APIView, Response
 from rest_framework.settings import import_from_string
 
@@ -21,14 +29,15 @@ from main import models, constants
 from main.api import serializers
 from main.api import filters
 from main.api.helpers import to_bool
-from main.api.uploaders import SiteUploader, FileReader, RecordCreator, DataPackageBuilder
+from main.api.uploaders import SiteUploader, FileReader, RecordCreator, DataPackageBuilder, iter_upload_results, \
+    UploadResultSummary
 from main.api.validators import get_record_validator_for_dataset
-from main.models import Project, Site, Dataset, Record
+from main.models import Project, Site, Dataset, Record, UploadJob, SpeciesSummary
 from main.utils_auth import is_admin, can_create_user
 from main.api.exporters import DefaultExporter
-from main.utils_http import WorkbookResponse, CSVFileResponse
-from main.utils_species import NoSpeciesFacade
-from main.utils_misc import search_json_fields, order_by_json_field
+from main.utils_http import WorkbookResponse, CSVFileResponse, NDJSONStreamingResponse, NDJSON_CONTENT_TYPE
+from main.utils_species import get_species_facade_class
+from main.utils_misc import search_json_fields, search_records
 
 
 logger = logging.getLogger(__name__)
@@ -159,11 +168,20 @@ class ProjectSitesUploadView(APIView):
 
     def post(self, request, *args, **kwargs):
         file_obj = request.data['file']
+        return self.upload_sites(self.project, file_obj)
+
+    @staticmethod
+    def upload_sites(project, file_obj):
+        """
+        Create the sites of the project from the file. Also used by the chunked upload once the file is assembled.
+        :param file_obj: a django file with a content_type
+        :return: the response
+        """
         if file_obj.content_type not in SiteUploader.SUPPORTED_TYPES:
             msg = "Wrong file type {}. Should be one of: {}".format(file_obj.content_type, SiteUploader.SUPPORTED_TYPES)
             return Response(msg, status=status.HTTP_501_NOT_IMPLEMENTED)
 
-        uploader = SiteUploader(file_obj, self.project)
+        uploader = SiteUploader(file_obj, project)
         data = {}
         # return an item by parsed row
         # {1: { site: pk|None, error: msg|None}, 2:...., 3:... }
@@ -215,7 +233,7 @@ class DatasetViewSet(viewsets.ModelViewSet):
     permission_classes = (IsAuthenticated, DRYPermissions)
     serializer_class = serializers.DatasetSerializer
     filter_class = filters.DatasetFilterSet
-    queryset = models.Dataset.objects.all().distinct()
+    queryset = models.Dataset.objects.all().distinct().prefetch_related('data_indexes')
 
 
 class DatasetRecordsPermission(BasePermission):
@@ -227,20 +245,30 @@ class DatasetRecordsPermission(BasePermission):
             or (hasattr(view, 'dataset') and view.dataset and (view.dataset.is_custodian(user) or view.dataset.is_data_engineer(user)))
 
 
+# the record search modes: 'contains' (default) searches the term within every field value, 'fulltext' searches the
+# words in the record search vectors and orders the records by rank.
+SEARCH_MODE_CONTAINS = 'contains'
+SEARCH_MODE_FULLTEXT = 'fulltext'
+SEARCH_MODES = [SEARCH_MODE_CONTAINS, SEARCH_MODE_FULLTEXT]
+
+
+def get_search_mode(request):
+    search_mode = request.query_params.get('search_mode', SEARCH_MODE_CONTAINS)
+    if search_mode not in SEARCH_MODES:
+        raise ValidationError("search_mode must be one of {}".format(SEARCH_MODES))
+    return search_mode
+
+
 class SpeciesMixin(object):
-    species_facade_class = NoSpeciesFacade
-    if settings.SPECIES_FACADE_CLASS:
-        try:
-            species_facade_class = import_from_string(settings.SPECIES_FACADE_CLASS, 'SPECIES_FACADE_CLASS')
-        except Exception as e:
-            msg = "Error while importing the species facade class {}".format(settings.SPECIES_FACADE_CLASS)
-            logger.exception(msg)
+    species_facade_class = get_species_facade_class()
 
 
 class DatasetRecordsView(generics.ListAPIView, generics.DestroyAPIView, SpeciesMixin):
     permission_classes = (IsAuthenticated, DatasetRecordsPermission)
     # TODO: the filters don't appear in the swagger
     filter_class = filters.RecordFilterSet
+    # the ordering by data fields is done by the RecordOrderingFilter
+    filter_backends = (DjangoFilterBackend, filters.RecordOrderingFilter)
 
     def __init__(self, **kwargs):
         super(DatasetRecordsView, self).__init__(**kwargs)
@@ -281,17 +309,18 @@ class DatasetRecordsView(generics.ListAPIView, generics.DestroyAPIView, SpeciesM
 
             search_param = self.request.query_params.get('search')
             if search_param is not None:
-                field_info = {
-                    'data': self.dataset.schema.field_names,
-                    'source_info': ['file_name', 'row']
-                }
+                if get_search_mode(self.request) == SEARCH_MODE_FULLTEXT:
+                    queryset = search_records(queryset, search_param)
+                else:
+                    field_info = {
+                        'data': self.dataset.schema.field_names,
+                        'source_info': ['file_name', 'row']
+                    }
 
-                queryset = search_json_fields(queryset, field_info, search_param)
+                    queryset = search_json_fields(queryset, field_info, search_param)
 
-            ordering_param = self.request.query_params.get('ordering')
-            if ordering_param is not None:
-                queryset = order_by_json_field(queryset, 'data', self.dataset.schema.field_names, ordering_param)
-                queryset = order_by_json_field(queryset, 'source_info', ['file_name', 'row'], ordering_param)
+            queryset = filters.filter_indexed_data(queryset, self.dataset,
+                                                   self.request.query_params.get('data__contains'))
 
             return queryset
         else:
@@ -317,7 +346,8 @@ class DatasetRecordsView(generics.ListAPIView, generics.DestroyAPIView, SpeciesM
             qs = Record.objects.filter(dataset=self.dataset)
         else:
             return Response("A list of record ids must be provided or 'all'", status=status.HTTP_400_BAD_REQUEST)
-        qs.delete()
+        with SpeciesSummary.batch():
+            qs.delete()
         return Response(status=status.HTTP_204_NO_CONTENT)
 
 
@@ -327,6 +357,7 @@ class RecordViewSet(viewsets.ModelViewSet, SpeciesMixin):
     queryset = models.Record.objects.all()
     serializer_class = serializers.RecordSerializer
     filter_class = filters.RecordFilterSet
+    filter_backends = (DjangoFilterBackend, filters.RecordOrderingFilter)
 
     def __init__(self, **kwargs):
         super(RecordViewSet, self).__init__(**kwargs)
@@ -351,17 +382,18 @@ class RecordViewSet(viewsets.ModelViewSet, SpeciesMixin):
             # add some specific json field queries (postgres)
             search_param = self.request.query_params.get('search')
             if search_param is not None:
-                field_info = {
-                    'data': self.dataset.schema.field_names,
-                    'source_info': ['file_name', 'row']
-                }
+                if get_search_mode(self.request) == SEARCH_MODE_FULLTEXT:
+                    queryset = search_records(queryset, search_param)
+                else:
+                    field_info = {
+                        'data': self.dataset.schema.field_names,
+                        'source_info': ['file_name', 'row']
+                    }
 
-                queryset = search_json_fields(queryset, field_info, search_param)
+                    queryset = search_json_fields(queryset, field_info, search_param)
 
-            ordering_param = self.request.query_params.get('ordering')
-            if ordering_param is not None:
-                queryset = order_by_json_field(queryset, 'data', self.dataset.schema.field_names, ordering_param)
-                queryset = order_by_json_field(queryset, 'source_info', ['file_name', 'row'], ordering_param)
+            queryset = filters.filter_indexed_data(queryset, self.dataset,
+                                                   self.request.query_params.get('data__contains'))
 
         return queryset
 
@@ -515,12 +547,36 @@ class WhoamiView(APIView):
         return Response(data)
 
 
+class NDJSONRenderer(BaseRenderer):
+    """
+    Newline delimited json. Used to stream the upload results, see DatasetUploadRecordsView.
+    A non streamed response (e.g. an error) is rendered as a single line.
+    """
+    media_type = NDJSON_CONTENT_TYPE
+    format = 'ndjson'
+    charset = None
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        return JSONRenderer().render(data, accepted_media_type, renderer_context) + b'\n'
+
+
 class DatasetUploadRecordsView(APIView, SpeciesMixin):
     """
     Upload file for records (xlsx, csv)
+    With an 'Accept: application/x-ndjson' header (or ?format=ndjson) the row results are streamed, one json per
+    line, as soon as they are processed. The last line gives the outcome of the whole upload:
+    {"status": "success"|"error"|"failed", "statusCode": 200|400|500, "rowCount": n, "errorCount": n}
+    With report=summary the response is an UploadResultSummary instead of one result per row.
+    With upsert=true (dataset with a primaryKey only) the rows are matched to the existing records by key: unchanged
+    records are skipped, changed ones updated and the others created. delete_missing=true also deletes the records
+    whose key is not in the file, unless a row failed or the file has no key (deletedCount 0).
+    Species observation: the species names not found in the species list are fuzzy matched. The suggestions are
+    returned in speciesMatches (summary report and last ndjson line). With species_match_threshold=0..1 the best
+    suggestion of a name is accepted if its score is at least the threshold.
     """
     permission_classes = (IsAuthenticated, DatasetRecordsPermission)
     parser_classes = (FormParser, MultiPartParser)
+    renderer_classes = (JSONRenderer, NDJSONRenderer)
 
     def dispatch(self, request, *args, **kwargs):
         """
@@ -533,53 +589,317 @@ class DatasetUploadRecordsView(APIView, SpeciesMixin):
 
     def post(self, request, *args, **kwargs):
         file_obj = request.data['file']
-        create_site = 'create_site' in request.data and to_bool(request.data['create_site'])
-        delete_previous = 'delete_previous' in request.data and to_bool(request.data['delete_previous'])
-        strict = 'strict' in request.data and to_bool(request.data['strict'])
+        options = self.get_upload_options(request.data)
+        return self.upload_records(request, self.dataset, file_obj, options, self.species_facade_class)
+
+    @staticmethod
+    def get_upload_options(data):
+        options = {
+            name: name in data and to_bool(data[name])
+            for name in ['create_site', 'delete_previous', 'strict', 'async', 'upsert', 'delete_missing']
+        }
+        options['report'] = data.get('report')
+        options['species_match_threshold'] = data.get('species_match_threshold')
+        return options
+
+    @staticmethod
+    def upload_records(request, dataset, file_obj, options, species_facade_class, on_success=None):
+        """
+        Create the records of the dataset from the file. Also used by the chunked upload once the file is assembled.
+        :param file_obj: a django file with a content_type
+        :param options: see get_upload_options
+        :param on_success: a function called once the file has been processed without error (or queued in async mode).
+        With the NDJSON streaming, it is called at the end of the stream.
+        :return: the response
+        """
+        create_site = bool(options.get('create_site'))
+        delete_previous = bool(options.get('delete_previous'))
+        strict = bool(options.get('strict'))
+        run_async = bool(options.get('async'))
+        upsert = bool(options.get('upsert'))
+        delete_missing = bool(options.get('delete_missing'))
+        species_match_threshold = options.get('species_match_threshold')
+        summary = options.get('report') == 'summary'
 
         if file_obj.content_type not in FileReader.SUPPORTED_TYPES:
             msg = "Wrong file type {}. Should be one of: {}".format(file_obj.content_type, SiteUploader.SUPPORTED_TYPES)
             return Response(msg, status=status.HTTP_501_NOT_IMPLEMENTED)
 
+        if upsert and not dataset.has_primary_key:
+            msg = "The upsert option requires a primaryKey declared in the dataset schema."
+            return Response(msg, status=status.HTTP_400_BAD_REQUEST)
+        if upsert and delete_previous:
+            msg = "The upsert and delete_previous options can't be used together. Use delete_missing instead."
+            return Response(msg, status=status.HTTP_400_BAD_REQUEST)
+        if delete_missing and not upsert:
+            msg = "The delete_missing option can only be used with the upsert option."
+            return Response(msg, status=status.HTTP_400_BAD_REQUEST)
+        if species_match_threshold not in [None, '']:
+            try:
+                species_match_threshold = float(species_match_threshold)
+            except (TypeError, ValueError):
+                species_match_threshold = -1
+            if not 0 <= species_match_threshold <= 1:
+                msg = "The species_match_threshold option must be a number between 0 and 1."
+                return Response(msg, status=status.HTTP_400_BAD_REQUEST)
+        else:
+            species_match_threshold = None
+
+        if run_async:
+            # the file is processed in the background by the process_upload_jobs command.
+            job = UploadJob.objects.create(
+                dataset=dataset,
+                user=request.user,
+                file=file_obj,
+                file_name=file_obj.name,
+                content_type=file_obj.content_type,
+                options={
+                    'create_site': create_site,
+                    'delete_previous': delete_previous,
+                    'strict': strict,
+                    'upsert': upsert,
+                    'delete_missing': delete_missing,
+                    'species_match_threshold': species_match_threshold
+                }
+            )
+            if on_success is not None:
+                on_success()
+            serializer = serializers.UploadJobSerializer(job, context={'request': request})
+            return Response(serializer.data, status=status.HTTP_202_ACCEPTED)
+
         if delete_previous:
-            self.dataset.record_queryset.delete()
+            with SpeciesSummary.batch():
+                dataset.record_queryset.delete()
         generator = FileReader(file_obj)
-        validator = get_record_validator_for_dataset(self.dataset)
+        validator = get_record_validator_for_dataset(dataset)
         validator.schema_error_as_warning = not strict
-        creator = RecordCreator(self.dataset, generator,
+        creator = RecordCreator(dataset, generator,
                                 validator=validator, create_site=create_site, commit=True,
-                                species_facade_class=self.species_facade_class)
+                                species_facade_class=species_facade_class,
+                                batch_size=settings.RECORD_UPLOAD_BATCH_SIZE,
+                                upsert=upsert,
+                                delete_missing=delete_missing,
+                                species_match_threshold=species_match_threshold)
+        if summary:
+            report = UploadResultSummary().add_all(iter_upload_results(creator))
+            status_code = status.HTTP_200_OK if not report.has_error else status.HTTP_400_BAD_REQUEST
+            data = report.to_dict()
+            if creator.delete_missing:
+                data['deletedCount'] = creator.deleted_count
+            if creator.species_matches:
+                data['speciesMatches'] = creator.get_species_matches()
+            if not report.has_error and on_success is not None:
+                on_success()
+            return Response(data, status=status_code)
+        if request.accepted_renderer.format == NDJSONRenderer.format:
+            return NDJSONStreamingResponse(DatasetUploadRecordsView.stream_results(creator, on_success=on_success))
         data = []
         has_error = False
-        row = 1  # starts at 1 to match excel row id
-        for record, validator_result in creator:
-            row += 1
-            result = {
-                'row': row
-            }
-            if validator_result.has_errors:
+        for result in iter_upload_results(creator):
+            if result.get('errors'):
                 has_error = True
-            else:
-                result['recordId'] = record.id
-            result.update(validator_result.to_dict())
             data.append(result)
+        if not has_error and on_success is not None:
+            on_success()
         status_code = status.HTTP_200_OK if not has_error else status.HTTP_400_BAD_REQUEST
         return Response(data, status=status_code)
 
+    @staticmethod
+    def stream_results(creator, on_success=None):
+        """
+        Yield the row results then a final status line.
+        """
+        row_count = 0
+        error_count = 0
+        final = {}
+        try:
+            for result in iter_upload_results(creator):
+                row_count += 1
+                if result.get('errors'):
+                    error_count += 1
+                yield result
+            if error_count:
+                final['status'] = 'error'
+                final['statusCode'] = status.HTTP_400_BAD_REQUEST
+            else:
+                final['status'] = 'success'
+                final['statusCode'] = status.HTTP_200_OK
+                if on_success is not None:
+                    on_success()
+        except Exception as e:
+            # the response has already started, the error can only be reported in the stream.
+            logger.exception("Error while streaming the upload results")
+            final['status'] = 'failed'
+            final['statusCode'] = status.HTTP_500_INTERNAL_SERVER_ERROR
+            final['errorMessage'] = str(e)
+        final['rowCount'] = row_count
+        final['errorCount'] = error_count
+        if creator.upsert:
+            final.update({
+                'createdCount': creator.created_count,
+                'updatedCount': creator.updated_count,
+                'unchangedCount': creator.unchanged_count,
+                'deletedCount': creator.deleted_count
+            })
+        if creator.species_matches:
+            final['speciesMatches'] = creator.get_species_matches()
+        yield final
+
+
+class UploadJobViewSet(viewsets.ReadOnlyModelViewSet):
+    """
+    Progress and results of the background records uploads.
+    """
+    permission_classes = (IsAuthenticated, DRYPermissions)
+    queryset = models.UploadJob.objects.all()
+    serializer_class = serializers.UploadJobSerializer
+    filter_fields = ('id', 'dataset', 'status')
+
+    def get_queryset(self):
+        queryset = super(UploadJobViewSet, self).get_queryset()
+        user = self.request.user
+        if not is_admin(user):
+            queryset = queryset.filter(
+                Q(user=user) |
+                Q(dataset__project__custodians=user) |
+                Q(dataset__project__program__data_engineers=user)
+            ).distinct()
+        return queryset
+
+    @action(detail=True)
+    def results(self, request, *args, **kwargs):
+        """
+        The row results of a finished job. Same format as the synchronous upload response.
+        Only the first settings.UPLOAD_JOB_MAX_RESULTS rows are kept (see the job result_truncated).
+        Use ?report=summary for the aggregated report of all the rows.
+        """
+        job = self.get_object()
+        if not job.is_finished:
+            return Response("The upload job is not finished. Status: {}".format(job.status),
+                            status=status.HTTP_409_CONFLICT)
+        if request.query_params.get('report') == 'summary':
+            return Response(job.summary or UploadResultSummary().add_all(job.result or []).to_dict())
+        return Response(job.result or [])
+
+
+class ChunkedUploadViewSet(mixins.CreateModelMixin, mixins.RetrieveModelMixin, mixins.DestroyModelMixin,
+                           mixins.ListModelMixin, viewsets.GenericViewSet, SpeciesMixin):
+    """
+    Resumable upload of a records or sites file, in chunks:
+    - POST {kind: 'records'|'sites', dataset|project, file_name, content_type, total_size, chunk_size, options}
+    - PUT the raw bytes of every chunk to chunks/<number>/ (starting at 0), in any order and as many times as needed.
+    - GET the upload to know the received and missing chunks.
+    - POST finalize/ to process the file. The response is the same as the standard records or sites upload.
+    """
+    permission_classes = (IsAuthenticated, DRYPermissions)
+    queryset = models.ChunkedUpload.objects.all()
+    serializer_class = serializers.ChunkedUploadSerializer
+    renderer_classes = (JSONRenderer, NDJSONRenderer)
+
+    def get_queryset(self):
+        queryset = super(ChunkedUploadViewSet, self).get_queryset()
+        user = self.request.user
+        if not is_admin(user):
+            queryset = queryset.filter(user=user)
+        return queryset
+
+    def perform_create(self, serializer):
+        user = self.request.user
+        dataset = serializer.validated_data.get('dataset')
+        project = serializer.validated_data.get('project')
+        if serializer.validated_data.get('kind') == models.ChunkedUpload.KIND_RECORDS:
+            allowed = is_admin(user) or dataset.is_custodian(user) or dataset.is_data_engineer(user)
+        else:
+            allowed = is_admin(user) or project.is_custodian(user)
+        if not allowed:
+            raise PermissionDenied()
+        serializer.save(user=user)
+
+    @action(detail=True, methods=['put'], url_path=r'chunks/(?P<number>\d+)')
+    def chunk(self, request, number=None, *args, **kwargs):
+        upload = self.get_object()
+        if not upload.is_open:
+            return Response("The upload is already finalized.", status=status.HTTP_409_CONFLICT)
+        # the body is streamed to disk, never parsed.
+        stream = request.stream or io.BytesIO()
+        try:
+            upload.write_chunk(int(number), stream)
+        except ValueError as e:
+            return Response(str(e), status=status.HTTP_400_BAD_REQUEST)
+        serializer = self.get_serializer(upload)
+        return Response(serializer.data)
+
+    @action(detail=True, methods=['post'])
+    def finalize(self, request, *args, **kwargs):
+        upload = self.get_object()
+        if not upload.is_open:
+            return Response("The upload is already finalized.", status=status.HTTP_409_CONFLICT)
+        missing = upload.missing_chunks
+        if missing:
+            return Response("Missing chunks: {}".format(missing), status=status.HTTP_400_BAD_REQUEST)
+        # the assembled file is a temporary file, deleted when closed by the file reader.
+        file_obj = File(upload.assemble(), name=upload.file_name)
+        file_obj.content_type = upload.content_type
+        # the upload stays open until the file has been processed without error, so that a faulty chunk can be sent
+        # again and the upload finalized again.
+        if upload.kind == models.ChunkedUpload.KIND_SITES:
+            response = ProjectSitesUploadView.upload_sites(upload.project, file_obj)
+            if response.status_code < status.HTTP_400_BAD_REQUEST:
+                upload.mark_finalized()
+            return response
+        options = DatasetUploadRecordsView.get_upload_options(upload.options or {})
+        return DatasetUploadRecordsView.upload_records(request, upload.dataset, file_obj, options,
+                                                       self.species_facade_class, on_success=upload.mark_finalized)
+
+
+class SpeciesView(generics.GenericAPIView):
+    """
+    The species of the records, read from the species summary table (see SpeciesSummary).
+    Filters: search (species name contains), strict=true (only the species found in the species list), project and
+    dataset ids.
+    Paging with limit and offset.
+    With details=true every (species name, name id) comes with its record count, first and last observation dates and
+    dataset ids.
+    """
 
-class SpeciesView(APIView, SpeciesMixin):
     def get(self, request, *args, **kwargs):
         """
         Get a list of all species name present in the system
-        :return: a list of species name.
+        :return: a list of species name or, with details, of species.
         """
-        qs = Record.objects.exclude(species_name__isnull=True)
-        qs = self.filter_queryset(qs)
-        # we output just the species name
-        data = qs \
-            .distinct('species_name') \
-            .order_by('species_name') \
-            .values_list('species_name', flat=True)
+        for name in ['project', 'dataset']:
+            value = self.request.query_params.get(name)
+            if value is not None and not value.isdigit():
+                return Response("{} must be an id.".format(name), status=status.HTTP_400_BAD_REQUEST)
+        details = to_bool(self.request.query_params.get('details', False))
+        qs = self.filter_queryset(SpeciesSummary.objects.all())
+        if details:
+            qs = qs.values('species_name', 'name_id').annotate(
+                record_count=Sum('record_count'),
+                first_observation=Min('first_observation'),
+                last_observation=Max('last_observation'),
+                dataset_ids=ArrayAgg('dataset_id')
+            ).order_by('species_name', 'name_id')
+        else:
+            # we output just the species name
+            qs = qs.order_by('species_name').values_list('species_name', flat=True).distinct()
+        page = self.paginate_queryset(qs)
+        data = page if page is not None else qs
+        if details:
+            data = [
+                {
+                    'speciesName': species['species_name'],
+                    'nameId': species['name_id'],
+                    'recordCount': species['record_count'],
+                    'firstObservation': species['first_observation'],
+                    'lastObservation': species['last_observation'],
+                    'datasetIds': sorted(species['dataset_ids'])
+                } for species in data
+            ]
+        else:
+            data = list(data)
+        if page is not None:
+            return self.get_paginated_response(data)
         return Response(data=data)
 
     def filter_queryset(self, queryset):
@@ -592,9 +912,42 @@ class SpeciesView(APIView, SpeciesMixin):
         strict = to_bool(self.request.query_params.get('strict', False))
         if strict:
             query &= ~Q(name_id=-1)
+        project = self.request.query_params.get('project')
+        if project:
+            query &= Q(dataset__project=project)
+        dataset = self.request.query_params.get('dataset')
+        if dataset:
+            query &= Q(dataset=dataset)
         return queryset.filter(query)
 
 
+class SpeciesMatchView(APIView, SpeciesMixin):
+    permission_classes = (IsAuthenticated,)
+
+    def post(self, request, *args, **kwargs):
+        """
+        Fuzzy match a batch of species names against the species list.
+        POST {"names": [species names], "limit": max suggestions by name, "minScore": 0..1}
+        :return: [{"speciesName": name, "suggestions": [{"speciesName", "nameId", "score"}]}] one by distinct name.
+        """
+        names = request.data.get('names')
+        if not isinstance(names, list) or not all([isinstance(name, six.string_types) for name in names]):
+            return Response("names must be a list of species names.", status=status.HTTP_400_BAD_REQUEST)
+        try:
+            limit = int(request.data['limit']) if request.data.get('limit') is not None else None
+            min_score = float(request.data['minScore']) if request.data.get('minScore') is not None else None
+        except (TypeError, ValueError) as e:
+            return Response(str(e), status=status.HTTP_400_BAD_REQUEST)
+        matcher = self.species_facade_class().get_species_index().matcher
+        data = [
+            {
+                'speciesName': name,
+                'suggestions': suggestions
+            } for name, suggestions in matcher.match(names, limit=limit, min_score=min_score).items()
+        ]
+        return Response(data)
+
+
 class LogoutView(APIView):
     def get(self, request, *args, **kwargs):
         """
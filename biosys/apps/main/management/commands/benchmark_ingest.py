@@ -0,0 +1,339 @@
+from __future__ import absolute_import, unicode_literals, print_function, division
+
+import datetime
+import json
+import os
+import platform
+import random
+import shutil
+import tempfile
+import time
+
+from django.conf import settings
+from django.contrib.gis.geos import Point
+from django.core.files import File
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import six, timezone
+from openpyxl import Workbook
+
+from main.api.uploaders import FileReader, RecordCreator
+from main.api.validators import get_record_validator_for_dataset
+from main.models import Program, Project, Site, Dataset
+from main.utils_species import SpeciesFacade
+
+try:
+    import resource
+except ImportError:
+    # not available on Windows
+    resource = None
+
+# TODO: remove when python3
+if six.PY2:
+    import unicodecsv as csv
+else:
+    import csv
+
+SPECIES_COUNT = 1000
+SITE_COUNT = 100
+
+
+class SyntheticSpeciesFacade(SpeciesFacade):
+    """
+    A species list that doesn't need Herbie.
+    """
+
+    def name_id_by_species_name(self):
+        return {'Species {}'.format(i): i for i in range(1, SPECIES_COUNT + 1)}
+
+
+def date_field(name='When'):
+    return {
+        'name': name,
+        'type': 'date',
+        'format': 'any',
+        'biosys': {'type': 'observationDate'},
+        'constraints': {'required': True}
+    }
+
+
+def number_field(name, biosys_type=None, required=True):
+    field = {
+        'name': name,
+        'type': 'number',
+        'constraints': {'required': required}
+    }
+    if biosys_type:
+        field['biosys'] = {'type': biosys_type}
+    return field
+
+
+def random_date():
+    return (datetime.date(2000, 1, 1) + datetime.timedelta(days=random.randint(0, 7000))).strftime('%d/%m/%Y')
+
+
+# The benchmark scenarios: the dataset type, the schema fields and a row generator (i -> list of values in the order
+# of the fields).
+SCENARIOS = {
+    'generic': {
+        'type': Dataset.TYPE_GENERIC,
+        'fields': [
+            {'name': 'Text', 'type': 'string', 'constraints': {'required': True}},
+            {'name': 'Count', 'type': 'integer'},
+            number_field('Value', required=False),
+            {'name': 'Flag', 'type': 'boolean'},
+            {'name': 'Date', 'type': 'date', 'format': 'any'},
+        ],
+        'row': lambda i: ['Text {}'.format(i), i, random.uniform(0, 1000), random.choice(['yes', 'no']),
+                          random_date()]
+    },
+    'observation-lat-long': {
+        'type': Dataset.TYPE_OBSERVATION,
+        'fields': [
+            {'name': 'What', 'type': 'string'},
+            date_field(),
+            number_field('Latitude', 'latitude'),
+            number_field('Longitude', 'longitude'),
+        ],
+        'row': lambda i: ['Observation {}'.format(i), random_date(), round(random.uniform(-35, -14), 6),
+                          round(random.uniform(113, 129), 6)]
+    },
+    'observation-easting-northing': {
+        'type': Dataset.TYPE_OBSERVATION,
+        'fields': [
+            {'name': 'What', 'type': 'string'},
+            date_field(),
+            number_field('Easting', 'easting'),
+            number_field('Northing', 'northing'),
+            {'name': 'Datum', 'type': 'string', 'biosys': {'type': 'datum'}},
+            {'name': 'Zone', 'type': 'integer', 'biosys': {'type': 'zone'}},
+        ],
+        'row': lambda i: ['Observation {}'.format(i), random_date(), round(random.uniform(300000, 500000), 2),
+                          round(random.uniform(6000000, 7000000), 2), 'GDA94', 50]
+    },
+    'observation-site-code': {
+        'type': Dataset.TYPE_OBSERVATION,
+        'fields': [
+            {'name': 'What', 'type': 'string'},
+            date_field(),
+            {'name': 'Site Code', 'type': 'string', 'biosys': {'type': 'siteCode'}, 'constraints': {'required': True}},
+        ],
+        'row': lambda i: ['Observation {}'.format(i), random_date(), 'BENCH{}'.format(i % SITE_COUNT)]
+    },
+    'species-observation': {
+        'type': Dataset.TYPE_SPECIES_OBSERVATION,
+        'fields': [
+            {'name': 'Species Name', 'type': 'string', 'biosys': {'type': 'speciesName'},
+             'constraints': {'required': True}},
+            date_field(),
+            number_field('Latitude', 'latitude'),
+            number_field('Longitude', 'longitude'),
+        ],
+        'row': lambda i: ['Species {}'.format(random.randint(1, SPECIES_COUNT)), random_date(),
+                          round(random.uniform(-35, -14), 6), round(random.uniform(113, 129), 6)]
+    },
+}
+
+FORMATS = ['csv', 'xlsx']
+
+
+def get_peak_rss_kb(children=False):
+    """
+    Note: the peak is the peak since the start of the process, not of the current scenario.
+    :param children: if True the peak of the largest terminated child process (see the processes option) instead of
+    this process.
+    :return: the peak resident set size in KB. None if not available.
+    """
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_CHILDREN if children else resource.RUSAGE_SELF).ru_maxrss
+    # bytes on macOS, KB on linux
+    return peak // 1024 if platform.system() == 'Darwin' else peak
+
+
+def write_file(directory, name, format_, headers, rows):
+    file_path = os.path.join(directory, '{}.{}'.format(name, format_))
+    if format_ == 'csv':
+        with open(file_path, 'w') as fp:
+            writer = csv.writer(fp)
+            writer.writerow(headers)
+            for row in rows:
+                writer.writerow(row)
+    else:
+        wb = Workbook(write_only=True)
+        ws = wb.create_sheet()
+        ws.append(headers)
+        for row in rows:
+            ws.append(row)
+        wb.save(file_path)
+    return file_path
+
+
+def open_file_reader(file_path, format_):
+    fp = open(file_path, 'rb')
+    file_ = File(fp, name=os.path.basename(file_path))
+    # FileReader expects an uploaded file with a content type
+    file_.content_type = FileReader.CSV_TYPES[0] if format_ == 'csv' else FileReader.XLSX_TYPES[0]
+    return FileReader(file_), fp
+
+
+class Command(BaseCommand):
+    help = "Benchmark the records ingest with synthetic files: rows/sec, time per stage " \
+           "(generate, read, validate, ingest) and peak RSS. " \
+           "The results are written as json. The benchmark data are deleted at the end."
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--rows',
+            type=int,
+            default=10000,
+            help="Number of rows of every file. Default 10000."
+        )
+        parser.add_argument(
+            '--scenario',
+            action='append',
+            choices=sorted(SCENARIOS.keys()),
+            help="Scenario to run. Can be repeated. Default all."
+        )
+        parser.add_argument(
+            '--format',
+            action='append',
+            choices=FORMATS,
+            help="File format. Can be repeated. Default csv and xlsx."
+        )
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=settings.RECORD_UPLOAD_BATCH_SIZE,
+            help="RecordCreator batch size. Default settings.RECORD_UPLOAD_BATCH_SIZE."
+        )
+        parser.add_argument(
+            '--processes',
+            type=int,
+            default=settings.RECORD_UPLOAD_PROCESSES,
+            help="RecordCreator processes. Default settings.RECORD_UPLOAD_PROCESSES."
+        )
+        parser.add_argument(
+            '--seed',
+            type=int,
+            default=0,
+            help="Random seed of the synthetic data. Default 0."
+        )
+        parser.add_argument(
+            '--output',
+            help="Path of the json result file. Default stdout."
+        )
+
+    def handle(self, *args, **options):
+        if options['rows'] < 1:
+            raise CommandError("--rows must be greater than 0")
+        random.seed(options['seed'])
+        scenarios = options['scenario'] or sorted(SCENARIOS.keys())
+        formats = options['format'] or FORMATS
+        directory = tempfile.mkdtemp(prefix='biosys-benchmark-')
+        program = Program.objects.create(name='Ingest benchmark {}'.format(timezone.now().isoformat()))
+        try:
+            project = Project.objects.create(name=program.name, code='BENCHMARK', program=program)
+            Site.objects.bulk_create([
+                Site(project=project, code='BENCH{}'.format(i), geometry=Point(115 + i / 100.0, -32.0))
+                for i in range(SITE_COUNT)
+            ])
+            results = []
+            for scenario in scenarios:
+                for format_ in formats:
+                    results.append(self.run_scenario(project, scenario, format_, directory, options))
+        finally:
+            # cascade to the project, datasets, records and sites.
+            program.delete()
+            shutil.rmtree(directory, ignore_errors=True)
+        output = {
+            'applicationVersion': settings.APPLICATION_VERSION_NO,
+            'date': timezone.now().isoformat(),
+            'python': platform.python_version(),
+            'rows': options['rows'],
+            'batchSize': options['batch_size'],
+            'processes': options['processes'],
+            'seed': options['seed'],
+            'results': results
+        }
+        content = json.dumps(output, indent=2)
+        if options['output']:
+            with open(options['output'], 'w') as fp:
+                fp.write(content)
+        else:
+            self.stdout.write(content)
+
+    def run_scenario(self, project, scenario, format_, directory, options):
+        definition = SCENARIOS[scenario]
+        rows_count = options['rows']
+        fields = definition['fields']
+        dataset = Dataset.objects.create(
+            project=project,
+            name='{} {}'.format(scenario, format_),
+            type=definition['type'],
+            data_package={
+                'name': 'benchmark',
+                'resources': [
+                    {
+                        'name': 'benchmark',
+                        'format': 'CSV',
+                        'title': 'benchmark',
+                        'bytes': 0,
+                        'mediatype': 'text/csv',
+                        'path': 'benchmark.csv',
+                        'schema': {'fields': fields}
+                    }
+                ]
+            }
+        )
+        stages = {}
+
+        start = time.time()
+        file_path = write_file(directory, '{}-{}'.format(scenario, format_), format_, [f['name'] for f in fields],
+                               (definition['row'](i) for i in range(rows_count)))
+        stages['generate'] = time.time() - start
+
+        start = time.time()
+        reader, fp = open_file_reader(file_path, format_)
+        with fp:
+            rows = list(reader)
+        stages['read'] = time.time() - start
+
+        validator = get_record_validator_for_dataset(dataset)
+        start = time.time()
+        for row in rows:
+            validator.validate(row)
+        stages['validate'] = time.time() - start
+        del rows
+
+        # the whole pipeline: FileReader -> validator -> RecordCreator
+        reader, fp = open_file_reader(file_path, format_)
+        error_count = 0
+        start = time.time()
+        with fp:
+            creator = RecordCreator(dataset, reader,
+                                    validator=get_record_validator_for_dataset(dataset),
+                                    create_site=False,
+                                    commit=True,
+                                    species_facade_class=SyntheticSpeciesFacade,
+                                    batch_size=options['batch_size'],
+                                    processes=options['processes'])
+            for record, validator_result in creator:
+                if validator_result.has_errors:
+                    error_count += 1
+        stages['ingest'] = time.time() - start
+
+        result = {
+            'scenario': scenario,
+            'format': format_,
+            'rows': rows_count,
+            'fileSize': os.path.getsize(file_path),
+            'recordCount': dataset.record_queryset.count(),
+            'errorCount': error_count,
+            'stages': stages,
+            'rowsPerSecond': rows_count / stages['ingest'] if stages['ingest'] else None,
+            'peakRssKb': get_peak_rss_kb(),
+            'peakChildRssKb': get_peak_rss_kb(children=True)
+        }
+        self.stderr.write("{scenario} {format}: {rate:.0f} rows/sec".format(
+            scenario=scenario, format=format_, rate=result['rowsPerSecond'] or 0))
+        return result
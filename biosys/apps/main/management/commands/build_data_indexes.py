@@ -0,0 +1,53 @@
+from __future__ import absolute_import, unicode_literals, print_function, division
+
+import logging
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import connections
+
+from main.models import Dataset, DataIndex
+
+logger = logging.getLogger(__name__)
+
+
+class Command(BaseCommand):
+    help = "Create and drop the record data indexes declared in the dataset schemas (biosys 'indexed' flag). " \
+           "The indexes are created concurrently, without locking the records."
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--sync',
+            action='store_true',
+            default=False,
+            help="Sync the data indexes of all the datasets with their schema first."
+        )
+        parser.add_argument(
+            '--sleep',
+            type=float,
+            default=5,
+            help="Seconds to wait before polling again when there's no index to build. Default 5."
+        )
+        parser.add_argument(
+            '--once',
+            action='store_true',
+            default=False,
+            help="Build the pending indexes and exit."
+        )
+
+    def handle(self, *args, **options):
+        if options['sync']:
+            for dataset in Dataset.objects.all():
+                DataIndex.sync(dataset)
+        while True:
+            try:
+                count = DataIndex.process_pending()
+                if count:
+                    self.stdout.write("{} data indexes processed.".format(count))
+            except Exception:
+                logger.exception("Error while building the data indexes")
+            if options['once']:
+                break
+            time.sleep(options['sleep'])
+            # don't keep a connection open while sleeping
+            connections.close_all()
@@ -0,0 +1,38 @@
+from __future__ import absolute_import, unicode_literals, print_function, division
+
+from django.core.management.base import BaseCommand
+
+from main.models import Dataset, Record
+
+
+class Command(BaseCommand):
+    help = "Build the full text search vectors of the records (search_mode=fulltext). The record writes keep them " \
+           "up to date, run it for the records created before the search vectors or after a change of the fields " \
+           "of a dataset schema when SEARCH_VECTOR_BACKGROUND_BUILD is off."
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--dataset',
+            type=int,
+            action='append',
+            dest='datasets',
+            help="Id of a dataset to build. Can be repeated. Default all the datasets."
+        )
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=10000,
+            help="Number of records updated per transaction. Default 10000."
+        )
+
+    def handle(self, *args, **options):
+        datasets = Dataset.objects.order_by('id')
+        if options['datasets']:
+            datasets = datasets.filter(id__in=options['datasets'])
+        batch_size = max(1, options['batch_size'])
+        total = 0
+        for dataset in datasets:
+            count = Record.rebuild_search_vectors(dataset, batch_size=batch_size)
+            total += count
+            self.stdout.write("{}: {} records.".format(dataset, count))
+        self.stdout.write("{} search vectors built.".format(total))
@@ -0,0 +1,78 @@
+from __future__ import absolute_import, unicode_literals, print_function, division
+
+import json
+from os import path
+
+from django.core.files import File
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+
+from main.api.uploaders import FileReader, RecordCopyLoader
+from main.models import Dataset, SpeciesSummary
+from main.utils_species import get_species_facade_class
+
+
+class Command(BaseCommand):
+    help = "Bulk load a records file (csv or xlsx) into a dataset using the postgres COPY staging path. " \
+           "For trusted bulk loads: the file is loaded in one transaction and a summary is printed as json."
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            'dataset_id',
+            type=int,
+            help="The id of the dataset."
+        )
+        parser.add_argument(
+            'file',
+            help="The path of the csv or xlsx file."
+        )
+        parser.add_argument(
+            '--create-site',
+            action='store_true',
+            default=False,
+            help="Create the sites that don't exist in the project."
+        )
+        parser.add_argument(
+            '--strict',
+            action='store_true',
+            default=False,
+            help="Reject the rows with a schema error instead of loading them with a warning."
+        )
+        parser.add_argument(
+            '--delete-previous',
+            action='store_true',
+            default=False,
+            help="Delete the records of the dataset before loading the file."
+        )
+
+    def handle(self, *args, **options):
+        try:
+            dataset = Dataset.objects.get(pk=options['dataset_id'])
+        except Dataset.DoesNotExist:
+            raise CommandError("Dataset {} not found".format(options['dataset_id']))
+        file_path = options['file']
+        extension = path.splitext(file_path)[1].lower()
+        if extension == '.csv':
+            content_type = FileReader.CSV_TYPES[0]
+        elif extension == '.xlsx':
+            content_type = FileReader.XLSX_TYPES[0]
+        else:
+            raise CommandError("Wrong file type {}. Should be a csv or a xlsx file.".format(file_path))
+        with open(file_path, 'rb') as fp:
+            file_ = File(fp, name=path.basename(file_path))
+            # FileReader expects an uploaded file with a content type
+            file_.content_type = content_type
+            loader = RecordCopyLoader(
+                dataset,
+                FileReader(file_),
+                create_site=options['create_site'],
+                strict=options['strict'],
+                species_facade_class=get_species_facade_class()
+            )
+            # the previous records are only deleted if the load succeeds.
+            with transaction.atomic():
+                if options['delete_previous']:
+                    with SpeciesSummary.batch():
+                        dataset.record_queryset.delete()
+                summary = loader.load()
+        self.stdout.write(json.dumps(summary.to_dict(), indent=2))
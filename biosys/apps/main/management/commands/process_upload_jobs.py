@@ -0,0 +1,99 @@
+from __future__ import absolute_import, unicode_literals, print_function, division
+
+import logging
+import multiprocessing
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db import connections
+
+from main.api.uploaders import UploadJobRunner
+from main.models import UploadJob
+from main.utils_species import get_species_facade_class
+
+logger = logging.getLogger(__name__)
+
+
+def process_pending_jobs(species_facade_class):
+    """
+    Process pending jobs until there's none left.
+    :return: the number of processed jobs
+    """
+    count = 0
+    job = UploadJob.claim_next()
+    while job is not None:
+        UploadJobRunner(job, species_facade_class=species_facade_class).run()
+        count += 1
+        job = UploadJob.claim_next()
+    return count
+
+
+def worker_loop(sleep, once, timeout):
+    species_facade_class = get_species_facade_class()
+    while True:
+        try:
+            # the jobs of a dead worker would stay running forever
+            failed = UploadJob.fail_stale(timeout)
+            if failed:
+                logger.warning("{} stale upload job(s) marked as failed".format(failed))
+            process_pending_jobs(species_facade_class)
+        except Exception:
+            logger.exception("Error while processing upload jobs")
+        if once:
+            break
+        time.sleep(sleep)
+        # don't keep a connection open while sleeping
+        connections.close_all()
+
+
+class Command(BaseCommand):
+    help = "Process the records file uploads submitted in asynchronous mode. " \
+           "Use --workers to run several worker processes on this machine."
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--workers',
+            type=int,
+            default=1,
+            help="Number of worker processes. Default 1."
+        )
+        parser.add_argument(
+            '--sleep',
+            type=float,
+            default=5,
+            help="Seconds to wait before polling again when there's no pending job. Default 5."
+        )
+        parser.add_argument(
+            '--timeout',
+            type=int,
+            default=settings.UPLOAD_JOB_TIMEOUT,
+            help="Seconds without progress after which a running job is marked as failed (its worker died). "
+                 "Default settings.UPLOAD_JOB_TIMEOUT."
+        )
+        parser.add_argument(
+            '--once',
+            action='store_true',
+            default=False,
+            help="Process the pending jobs and exit."
+        )
+
+    def handle(self, *args, **options):
+        workers = max(1, options['workers'])
+        sleep = options['sleep']
+        once = options['once']
+        timeout = options['timeout']
+        if workers == 1:
+            worker_loop(sleep, once, timeout)
+            return
+        # the database connections must not be shared with the child processes
+        connections.close_all()
+        processes = [
+            multiprocessing.Process(
+                target=worker_loop, args=(sleep, once, timeout), name='upload-worker-{}'.format(i))
+            for i in range(workers)
+        ]
+        for process in processes:
+            process.start()
+        for process in processes:
+            process.join()
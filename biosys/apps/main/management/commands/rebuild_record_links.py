@@ -0,0 +1,29 @@
+from __future__ import absolute_import, unicode_literals, print_function, division
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from main.models import Dataset, RecordLink
+
+
+class Command(BaseCommand):
+    help = "Rebuild the parent/child links of the records from the foreignKeys of the dataset schemas. The links are " \
+           "normally maintained by the record writes."
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--dataset',
+            type=int,
+            action='append',
+            dest='datasets',
+            help="Id of a dataset to rebuild. Can be repeated. Default all the datasets."
+        )
+
+    def handle(self, *args, **options):
+        datasets = Dataset.objects.order_by('id')
+        if options['datasets']:
+            datasets = datasets.filter(id__in=options['datasets'])
+        for dataset in datasets:
+            with transaction.atomic():
+                RecordLink.rebuild(dataset)
+        self.stdout.write("{} record links.".format(RecordLink.objects.count()))
@@ -0,0 +1,24 @@
+from __future__ import absolute_import, unicode_literals, print_function, division
+
+from django.core.management.base import BaseCommand
+
+from main.utils_species import CachedSpeciesFacade
+
+
+class Command(BaseCommand):
+    help = "Refresh the local copy of the species list used by the CachedSpeciesFacade."
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--if-stale',
+            action='store_true',
+            default=False,
+            help="Only refresh if the cache is empty or older than settings.SPECIES_CACHE_TTL."
+        )
+
+    def handle(self, *args, **options):
+        if options['if_stale'] and not CachedSpeciesFacade.is_stale(CachedSpeciesFacade.get_refreshed()):
+            self.stdout.write("The species cache is up to date.")
+            return
+        count = CachedSpeciesFacade.refresh()
+        self.stdout.write("{} species cached.".format(count))
@@ -0,0 +1,13 @@
+from __future__ import absolute_import, unicode_literals, print_function, division
+
+from django.core.management.base import BaseCommand
+
+from main.models import SpeciesSummary
+
+
+class Command(BaseCommand):
+    help = "Rebuild the species summary table from the records. The table is normally kept up to date incrementally."
+
+    def handle(self, *args, **options):
+        count = SpeciesSummary.rebuild()
+        self.stdout.write("{} species summaries.".format(count))
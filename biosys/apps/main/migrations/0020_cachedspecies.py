@@ -0,0 +1,27 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.11.13 on 2018-09-24 10:05
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('main', '0019_chunkedupload'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='CachedSpecies',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name_id', models.IntegerField(db_index=True)),
+                ('species_name', models.CharField(db_index=True, max_length=500)),
+                ('refreshed', models.DateTimeField(db_index=True)),
+            ],
+            options={
+                'verbose_name_plural': 'cached species',
+            },
+        ),
+    ]
@@ -0,0 +1,48 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.11.13 on 2018-09-27 14:32
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('main', '0020_cachedspecies'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SpeciesSummary',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('species_name', models.CharField(db_index=True, max_length=500)),
+                ('name_id', models.IntegerField(db_index=True)),
+                ('record_count', models.IntegerField(default=0)),
+                ('first_observation', models.DateTimeField(blank=True, null=True)),
+                ('last_observation', models.DateTimeField(blank=True, null=True)),
+                ('dataset', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='main.Dataset')),
+            ],
+            options={
+                'verbose_name_plural': 'species summaries',
+            },
+        ),
+        migrations.AlterUniqueTogether(
+            name='speciessummary',
+            unique_together=set([('dataset', 'species_name', 'name_id')]),
+        ),
+        # fill the summary from the existing records
+        migrations.RunSQL(
+            """
+            INSERT INTO main_speciessummary (
+                dataset_id, species_name, name_id, record_count, first_observation, last_observation
+            )
+            SELECT dataset_id, species_name, name_id, count(*), min(datetime), max(datetime)
+            FROM main_record
+            WHERE species_name IS NOT NULL AND species_name <> ''
+            GROUP BY dataset_id, species_name, name_id
+            """,
+            reverse_sql=migrations.RunSQL.noop
+        ),
+    ]
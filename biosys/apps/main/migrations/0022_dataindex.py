@@ -0,0 +1,47 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.11.13 on 2018-10-04 10:12
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('main', '0021_speciessummary'),
+    ]
+
+    operations = [
+        # the cast of the numeric data indexes: NULL instead of an error for an invalid number.
+        # Keep the regex in sync with main.utils_misc.NUMERIC_REGEX
+        migrations.RunSQL(
+            r"""
+            CREATE OR REPLACE FUNCTION biosys_to_numeric(value text) RETURNS numeric AS $$
+                SELECT CASE
+                    WHEN value ~ '^\s*[-+]?([0-9]+\.?[0-9]*|\.[0-9]+)([eE][-+]?[0-9]+)?\s*$' THEN value::numeric
+                    ELSE NULL
+                END
+            $$ LANGUAGE SQL IMMUTABLE STRICT
+            """,
+            reverse_sql="DROP FUNCTION IF EXISTS biosys_to_numeric(text)"
+        ),
+        migrations.CreateModel(
+            name='DataIndex',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('field_name', models.CharField(max_length=500)),
+                ('field_type', models.CharField(blank=True, max_length=50)),
+                ('index_name', models.CharField(max_length=63, unique=True)),
+                ('status', models.CharField(choices=[('pending', 'Pending'), ('building', 'Building'), ('ready', 'Ready'), ('failed', 'Failed'), ('obsolete', 'Obsolete'), ('dropping', 'Dropping')], default='pending', max_length=20)),
+                ('error_message', models.TextField(blank=True, null=True)),
+                ('created', models.DateTimeField(auto_now_add=True)),
+                ('started', models.DateTimeField(blank=True, null=True)),
+                ('finished', models.DateTimeField(blank=True, null=True)),
+                ('dataset', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='data_indexes', to='main.Dataset')),
+            ],
+            options={
+                'ordering': ['created', 'id'],
+            },
+        ),
+    ]
@@ -0,0 +1,49 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.11.13 on 2018-10-09 15:47
+from __future__ import unicode_literals
+
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('main', '0022_dataindex'),
+    ]
+
+    operations = [
+        # the cast of the date fields for the record ordering and the data indexes.
+        # The dates are parsed like main.utils_data_package.parse_datetime_day_first for the common formats:
+        # yyyy-mm-dd [hh:mm[:ss]] or dd/mm/yyyy [hh:mm[:ss]] (/, - or . separators). Any other value gives NULL.
+        # Note: the data indexes now include the record id and a typed date cast. Run `build_data_indexes --sync` to
+        # replace the existing ones.
+        migrations.RunSQL(
+            r"""
+            CREATE OR REPLACE FUNCTION biosys_to_timestamp(value text) RETURNS timestamp AS $$
+            DECLARE
+                parts text[];
+            BEGIN
+                parts := (SELECT regexp_matches(value,
+                    '^\s*([0-9]{4})-([0-9]{1,2})-([0-9]{1,2})(?:[T ]+([0-9]{1,2}):([0-9]{2})(?::([0-9]{2}(?:\.[0-9]+)?))?)?'));
+                IF parts IS NULL THEN
+                    parts := (SELECT regexp_matches(value,
+                        '^\s*([0-9]{1,2})[/.-]([0-9]{1,2})[/.-]([0-9]{4})(?:[T ]+([0-9]{1,2}):([0-9]{2})(?::([0-9]{2}(?:\.[0-9]+)?))?)?'));
+                    IF parts IS NULL THEN
+                        RETURN NULL;
+                    END IF;
+                    -- day first
+                    parts := ARRAY[parts[3], parts[2], parts[1], parts[4], parts[5], parts[6]];
+                END IF;
+                RETURN make_timestamp(
+                    parts[1]::int, parts[2]::int, parts[3]::int,
+                    coalesce(parts[4], '0')::int, coalesce(parts[5], '0')::int, coalesce(parts[6], '0')::double precision
+                );
+            EXCEPTION WHEN others THEN
+                -- invalid date (month 13...)
+                RETURN NULL;
+            END
+            $$ LANGUAGE plpgsql IMMUTABLE STRICT
+            """,
+            reverse_sql="DROP FUNCTION IF EXISTS biosys_to_timestamp(text)"
+        ),
+    ]
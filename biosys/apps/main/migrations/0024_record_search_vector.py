@@ -0,0 +1,43 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.11.13 on 2018-10-12 09:21
+from __future__ import unicode_literals
+
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('main', '0023_biosys_to_timestamp'),
+    ]
+
+    operations = [
+        # the full text search vector of a record: the values of the given data keys (the schema fields) and the
+        # source file name. Keep the text search configuration in sync with main.utils_misc.SEARCH_CONFIG
+        migrations.RunSQL(
+            """
+            CREATE OR REPLACE FUNCTION biosys_search_vector(data jsonb, source_info jsonb, keys text[])
+            RETURNS tsvector AS $$
+                SELECT to_tsvector('simple',
+                    coalesce(CASE WHEN jsonb_typeof(data) = 'object' THEN (
+                        SELECT string_agg(value, ' ') FROM jsonb_each_text(data) WHERE key = ANY(keys)
+                    ) END, '')
+                    || ' ' || coalesce(source_info->>'file_name', '')
+                )
+            $$ LANGUAGE SQL IMMUTABLE
+            """,
+            reverse_sql="DROP FUNCTION IF EXISTS biosys_search_vector(jsonb, jsonb, text[])"
+        ),
+        # not a model field: it's maintained by the record writes and only used in the search queries.
+        # The vectors of the existing records are built with the build_search_vectors command.
+        migrations.RunSQL(
+            """
+            ALTER TABLE main_record ADD COLUMN search_vector tsvector;
+            CREATE INDEX main_record_search_vector_gin ON main_record USING gin (search_vector);
+            """,
+            reverse_sql="""
+            DROP INDEX IF EXISTS main_record_search_vector_gin;
+            ALTER TABLE main_record DROP COLUMN IF EXISTS search_vector;
+            """
+        ),
+    ]
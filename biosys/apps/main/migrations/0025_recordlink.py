@@ -0,0 +1,106 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.11.13 on 2018-10-16 11:05
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+# the child values that never link to a parent (see main.models.RecordLink.EMPTY_VALUES)
+EMPTY_VALUES = ['null', '""', '0', 'false', '[]', '{}']
+
+
+def _as_list(value):
+    if isinstance(value, list):
+        return value
+    return [value] if value else []
+
+
+def _get_typed_expression(json_field_name, field_type):
+    # see main.utils_misc.json_field_expression
+    if field_type in ['integer', 'number']:
+        return 'biosys_to_numeric(' + json_field_name + '->>%s)'
+    if field_type in ['date', 'datetime']:
+        return 'biosys_to_timestamp(' + json_field_name + '->>%s)'
+    return '(' + json_field_name + '->>%s)'
+
+
+def _get_edges(datasets):
+    """
+    The foreign keys between the datasets of a project, like main.models.DatasetGraph at the time of this migration:
+    [(child dataset id, parent dataset id, parent_field, child_field, parent_field_type)]
+    """
+    schemas = []
+    for dataset in datasets:
+        data_package = dataset['data_package']
+        resources = data_package.get('resources', []) if isinstance(data_package, dict) else []
+        if resources:
+            schemas.append((dataset, resources[0].get('schema', {}), resources[0].get('name')))
+    edges = []
+    for child, child_schema, _ in schemas:
+        for parent, parent_schema, parent_resource_name in schemas:
+            names = [parent['name'], parent['code'], parent_resource_name]
+            foreign_key = next((fk for fk in child_schema.get('foreignKeys') or []
+                                if fk.get('reference', {}).get('resource') in names), None)
+            if foreign_key is None:
+                continue
+            parent_fields = _as_list(foreign_key.get('reference', {}).get('fields'))
+            child_fields = _as_list(foreign_key.get('fields'))
+            if parent_fields and child_fields:
+                parent_field = next(
+                    (f for f in parent_schema.get('fields', []) if f.get('name') == parent_fields[0]), None)
+                edges.append((child['id'], parent['id'], parent_fields[0], child_fields[0],
+                              parent_field.get('type') if parent_field else None))
+    return edges
+
+
+def fill_record_links(apps, schema_editor):
+    # the historical models and raw SQL only: the application models and their signals are not used.
+    Dataset = apps.get_model('main', 'Dataset')
+    datasets_by_project = {}
+    for dataset in Dataset.objects.order_by('name').values('id', 'project_id', 'name', 'code', 'data_package'):
+        datasets_by_project.setdefault(dataset['project_id'], []).append(dataset)
+    with schema_editor.connection.cursor() as cursor:
+        for datasets in datasets_by_project.values():
+            for child_dataset_id, parent_dataset_id, parent_field, child_field, parent_field_type in \
+                    _get_edges(datasets):
+                cursor.execute(
+                    """
+                    INSERT INTO main_recordlink (child_id, parent_id, fk_name)
+                    SELECT c.id, p.id, %s
+                    FROM main_record c JOIN main_record p
+                        ON p.dataset_id = %s AND {parent_expression} = {child_expression} AND p.data->%s = c.data->%s
+                    WHERE c.dataset_id = %s AND c.data->%s <> ALL(%s::jsonb[])
+                    ON CONFLICT DO NOTHING
+                    """.format(
+                        parent_expression=_get_typed_expression('p.data', parent_field_type),
+                        child_expression=_get_typed_expression('c.data', parent_field_type)
+                    ),
+                    [child_field, parent_dataset_id, parent_field, child_field, parent_field, child_field,
+                     child_dataset_id, child_field, EMPTY_VALUES]
+                )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('main', '0024_record_search_vector'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='RecordLink',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('fk_name', models.CharField(max_length=500)),
+                ('child', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='parent_links', to='main.Record')),
+                ('parent', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='child_links', to='main.Record')),
+            ],
+        ),
+        migrations.AlterUniqueTogether(
+            name='recordlink',
+            unique_together=set([('child', 'parent', 'fk_name')]),
+        ),
+        # link the existing records
+        migrations.RunPython(fill_record_links, reverse_code=migrations.RunPython.noop),
+    ]
@@ -0,0 +1,101 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.11.13 on 2018-10-22 10:05
+from __future__ import unicode_literals
+
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('main', '0026_uploadjob_heartbeat'),
+    ]
+
+    operations = [
+        # biosys_to_timestamp (see migration 0023) without the EXCEPTION block (a subtransaction per call): the value
+        # must match one of the formats and the date and time parts are checked before the cast. Any other value gives
+        # NULL.
+        # Same result as main.utils_data_package.parse_datetime_day_first for:
+        # - yyyy-mm-dd [hh:mm[:ss[.ffffff]]] and dd/mm/yyyy [hh:mm[:ss[.ffffff]]] (/, - or . separators). An unpadded
+        # yyyy-m-d is read day first (yyyy-d-m) like dateutil does. dd/mm is read mm/dd when only that is a valid date.
+        # - the time zone offsets of the datetimes (Z, +hh, +hhmm, +hh:mm): the value is converted to UTC.
+        # Not supported: the two-digit years. dateutil puts them within 50 years of the current year, a function of
+        # the current date can't be used by the data indexes (immutable functions only).
+        migrations.RunSQL(
+            r"""
+            CREATE OR REPLACE FUNCTION biosys_to_timestamp(value text) RETURNS timestamp AS $$
+            DECLARE
+                parts text[];
+                year_ int;
+                month_ int;
+                day_ int;
+                hour_ int;
+                minute_ int;
+                second_ double precision;
+                result timestamp;
+            BEGIN
+                parts := (SELECT regexp_matches(value,
+                    '^\s*([0-9]{4})-([0-9]{1,2})-([0-9]{1,2})'
+                    '(?:[T ]+([0-9]{1,2}):([0-9]{2})(?::([0-9]{2}(?:\.[0-9]+)?))?\s*(Z|([+-])([0-9]{2})(?::?([0-9]{2}))?)?)?\s*$'));
+                IF parts IS NOT NULL THEN
+                    year_ := parts[1]::int;
+                    IF (length(parts[2]) = 2 AND length(parts[3]) = 2) OR parts[3]::int > 12 THEN
+                        month_ := parts[2]::int;
+                        day_ := parts[3]::int;
+                    ELSE
+                        -- unpadded: day first
+                        day_ := parts[2]::int;
+                        month_ := parts[3]::int;
+                    END IF;
+                ELSE
+                    parts := (SELECT regexp_matches(value,
+                        '^\s*([0-9]{1,2})[/.-]([0-9]{1,2})[/.-]([0-9]{4})'
+                        '(?:[T ]+([0-9]{1,2}):([0-9]{2})(?::([0-9]{2}(?:\.[0-9]+)?))?\s*(Z|([+-])([0-9]{2})(?::?([0-9]{2}))?)?)?\s*$'));
+                    IF parts IS NULL THEN
+                        RETURN NULL;
+                    END IF;
+                    year_ := parts[3]::int;
+                    IF parts[1]::int > 12 OR parts[2]::int <= 12 THEN
+                        day_ := parts[1]::int;
+                        month_ := parts[2]::int;
+                    ELSE
+                        month_ := parts[1]::int;
+                        day_ := parts[2]::int;
+                    END IF;
+                END IF;
+                hour_ := coalesce(parts[4], '0')::int;
+                minute_ := coalesce(parts[5], '0')::int;
+                second_ := coalesce(parts[6], '0')::double precision;
+                IF year_ < 1 OR month_ < 1 OR month_ > 12 OR day_ < 1 OR hour_ > 23 OR minute_ > 59 OR second_ >= 60 OR
+                        day_ > extract(day FROM make_date(year_, month_, 1) + interval '1 month - 1 day') THEN
+                    RETURN NULL;
+                END IF;
+                result := make_timestamp(year_, month_, day_, hour_, minute_, second_);
+                IF parts[8] IS NOT NULL THEN
+                    -- to UTC
+                    result := result - (parts[8] || '1')::int * make_interval(
+                        hours => parts[9]::int, mins => coalesce(parts[10], '0')::int);
+                END IF;
+                RETURN result;
+            END
+            $$ LANGUAGE plpgsql IMMUTABLE STRICT
+            """,
+            reverse_sql=migrations.RunSQL.noop
+        ),
+        # the expression indexes on the function (data indexes) are built with the previous results.
+        migrations.RunSQL(
+            r"""
+            DO $$
+            DECLARE
+                index_name regclass;
+            BEGIN
+                FOR index_name IN SELECT indexrelid::regclass FROM pg_index
+                        WHERE pg_get_indexdef(indexrelid) LIKE '%biosys_to_timestamp(%' LOOP
+                    EXECUTE 'REINDEX INDEX ' || index_name;
+                END LOOP;
+            END
+            $$
+            """,
+            reverse_sql=migrations.RunSQL.noop
+        ),
+    ]
@@ -1,6 +1,15 @@
 from __future__ import absolute_import, unicode_literals, print_function, division
 
+import collections
+import datetime
+import hashlib
+import json
 import logging
+import os
+import shutil
+import tempfile
+import threading
+from contextlib import contextmanager
 from os import path
 
 from datapackage import validate as datapackage_validate
@@ -12,6 +21,10 @@ from django.contrib.gis.db import models
 from django.contrib.gis.db.models import Extent
 from django.contrib.postgres.fields import JSONField
 from django.core.exceptions import ValidationError
+from django.db import DatabaseError, connection, transaction
+from django.db.models.signals import post_delete, post_save, pre_delete, pre_save
+from django.dispatch import receiver
+from django.utils import timezone
 from django.utils.encoding import python_2_unicode_compatible
 from django.utils.text import Truncator
 from django.db.models.query_utils import Q
@@ -19,10 +32,15 @@ from timezone_field import TimeZoneField
 
 from main.constants import DATUM_CHOICES, MODEL_SRID
 from main.utils_auth import is_admin
-from main.utils_data_package import GenericSchema, ObservationSchema, SpeciesObservationSchema
+from main.utils_data_package import GenericSchema, ObservationSchema, SpeciesObservationSchema, SchemaCache, \
+    BiosysSchema, SiteGeometryResolver
+from main.utils_misc import json_field_expression
 
 logger = logging.getLogger(__name__)
 
+# the schema objects of the datasets, shared by the requests of the process. See Dataset.schema
+schema_cache = SchemaCache(max_size=settings.SCHEMA_CACHE_SIZE)
+
 
 @python_2_unicode_compatible
 class Program(models.Model):
@@ -368,7 +386,23 @@ class Dataset(models.Model):
 
     @property
     def schema(self):
-        return self.schema_class(self.schema_data)
+        # the schema objects are expensive to build, they are cached by dataset and schema descriptor.
+        schema = schema_cache.get(self.pk, self.schema_class, self.schema_data)
+        if isinstance(schema, ObservationSchema):
+            # the site codes are only looked up in the project of the dataset.
+            schema.site_geometry_resolver = self.site_geometry_resolver
+        return schema
+
+    @property
+    def site_geometry_resolver(self):
+        """
+        The site geometry resolver of the schemas of this dataset. Every access to the schema gives a new copy, the
+        resolver is kept for the lifetime of this instance so that a site is fetched once.
+        """
+        resolver = getattr(self, '_site_geometry_resolver', None)
+        if resolver is None or resolver.project != self.project_id:
+            resolver = self._site_geometry_resolver = SiteGeometryResolver(self.project_id)
+        return resolver
 
     @property
     def resource(self):
@@ -618,6 +652,23 @@ class Record(models.Model):
     def __str__(self):
         return "{0}: {1}".format(self.dataset.name, Truncator(self.data).chars(100))
 
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super(Record, cls).from_db(db, field_names, values)
+        # keep the species summary entry of the saved record so that an update can be applied as a change.
+        if all([name in field_names for name in ['dataset_id', 'species_name', 'name_id', 'datetime']]):
+            instance._species_summary_entry = SpeciesSummary.get_entry(instance)
+        # and its content, the search vector is only updated when it changes.
+        if all([name in field_names for name in ['data', 'source_info']]):
+            instance._saved_content = instance.get_content()
+        return instance
+
+    def get_content(self):
+        """
+        :return: the data and the source info of the record as a json text, to detect their changes.
+        """
+        return json.dumps([self.data, self.source_info], sort_keys=True)
+
     @property
     def data_with_id(self):
         return dict({'id': self.id}, **self.data)
@@ -629,14 +680,9 @@ class Record(models.Model):
         :return: a Record queryset or Record.objects.none()
         """
         if self.dataset.has_foreign_keys:
-            parent_dataset = self.dataset.get_parent_dataset
-            if parent_dataset:
-                parent_field, child_field = self.dataset.get_fk_lookup_fields_for_dataset(parent_dataset)
-                if parent_field and child_field:
-                    child_value = self.data[child_field]
-                    if child_value:
-                        query = Q(dataset=parent_dataset) & Q(data__contains={parent_field: child_value})
-                        return Record.objects.filter(query)
+            parent = DatasetGraph.get(self.dataset.project_id).parents.get(self.dataset_id)
+            if parent:
+                return Record.objects.filter(dataset_id=parent[0], child_links__child=self).distinct()
             return Record.objects.none()
         else:
             return None
@@ -649,22 +695,62 @@ class Record(models.Model):
         :return: a Record queryset or None if the dataset has no declared primaryKey
         """
         if self.dataset.has_primary_key:
-            children_datasets = self.dataset.get_children_datasets()
-            if children_datasets:
-                query = None
-                for ds in children_datasets:
-                    parent_field, child_field = ds.get_fk_lookup_fields_for_dataset(self.dataset)
-                    if parent_field and child_field:
-                        parent_value = self.data[parent_field]
-                        if parent_value:
-                            dataset_query = Q(dataset=ds, data__contains={child_field: parent_value})
-                            query = query | dataset_query if query else dataset_query
-                if query:
-                    return Record.objects.filter(query)
-            return Record.objects.none()
+            return Record.objects.filter(parent_links__parent=self).distinct()
         else:
             return None
 
+    @staticmethod
+    def update_search_vectors(dataset, record_ids=None):
+        """
+        Build the full text search vector of the records of the dataset from the values of its schema fields and the
+        source file name. The search_vector column (see migration 0024) is not a model field, it's only used by the
+        full text search (see main.utils_misc.search_records).
+        The uploads build the vectors of the records they write, see the RecordCreator and the RecordCopyLoader.
+        The vectors of a dataset are rebuilt in the background when its schema fields change, see
+        update_dataset_search_vectors.
+        :param dataset: the dataset of the records
+        :param record_ids: only update these records. All the records of the dataset if None.
+        :return: the number of updated records
+        """
+        sql = "UPDATE {table} SET search_vector = biosys_search_vector(data, source_info, %s::text[]) WHERE dataset_id = %s"
+        params = [dataset.schema.field_names, dataset.pk]
+        if record_ids is not None:
+            sql += " AND id = ANY(%s)"
+            params.append(list(record_ids))
+        with connection.cursor() as cursor:
+            cursor.execute(sql.format(table=Record._meta.db_table), params)
+            return cursor.rowcount
+
+    @staticmethod
+    def rebuild_search_vectors(dataset, batch_size=10000):
+        """
+        Update the search vectors of all the records of the dataset, batch_size records per transaction.
+        :return: the number of updated records
+        """
+        record_ids = list(Record.objects.filter(dataset=dataset).order_by('id').values_list('id', flat=True))
+        count = 0
+        for i in range(0, len(record_ids), batch_size):
+            with transaction.atomic():
+                count += Record.update_search_vectors(dataset, record_ids[i:i + batch_size])
+        return count
+
+    @staticmethod
+    def rebuild_search_vectors_in_background(dataset_id):
+        def process():
+            try:
+                dataset = Dataset.objects.filter(pk=dataset_id).first()
+                if dataset is not None:
+                    Record.rebuild_search_vectors(dataset)
+            except Exception:
+                logger.exception("Error while building the search vectors of the dataset {}".format(dataset_id))
+            finally:
+                connection.close()
+
+        thread = threading.Thread(target=process, name='search-vector-builder')
+        thread.daemon = True
+        thread.start()
+        return thread
+
     def is_custodian(self, user):
         return self.dataset.is_custodian(user)
 
@@ -728,6 +814,234 @@ class Record(models.Model):
         ordering = ['id']
 
 
+class DatasetGraph(object):
+    """
+    The foreign key relationships between the datasets of a project: the parent of every dataset and its children,
+    with the (parent_field, child_field) of the foreign key.
+    Same rules as Dataset.get_parent_dataset, get_children_datasets and get_fk_lookup_fields_for_dataset.
+    The record relationships are materialised in the RecordLink table along the edges of the graph. Use
+    resolve_records to get the parent and children of a list of records at once.
+    The graphs are cached by project (see get).
+    """
+    # number of project graphs cached by process
+    CACHE_SIZE = 64
+    _cache = collections.OrderedDict()
+    _lock = threading.Lock()
+
+    def __init__(self, datasets):
+        """
+        :param datasets: the datasets of a project, ordered by name.
+        """
+        # a dataset without a resource can't be related
+        datasets = [ds for ds in datasets if isinstance(ds.data_package, dict) and ds.resources]
+        # dataset id -> (parent dataset id, parent_field, child_field)
+        self.parents = {}
+        # the foreign keys: [(child dataset id, parent dataset id, parent_field, child_field, parent_field_type)]
+        self.edges = []
+        self.with_foreign_keys = set([ds.pk for ds in datasets if ds.has_foreign_keys])
+        self.with_primary_key = set([ds.pk for ds in datasets if ds.has_primary_key])
+        for child in datasets:
+            if child.pk not in self.with_foreign_keys:
+                continue
+            # the first dataset (by name) is the parent
+            parent = next((ds for ds in datasets if child.has_foreign_key_to(ds)), None)
+            if parent is not None:
+                parent_field, child_field = child.get_fk_lookup_fields_for_dataset(parent)
+                if parent_field and child_field:
+                    self.parents[child.pk] = (parent.pk, parent_field, child_field)
+            for ds in datasets:
+                if child.has_foreign_key_to(ds):
+                    parent_field, child_field = child.get_fk_lookup_fields_for_dataset(ds)
+                    if parent_field and child_field:
+                        field = ds.schema.get_field_by_name(parent_field)
+                        self.edges.append((child.pk, ds.pk, parent_field, child_field, field.type if field else None))
+
+    @classmethod
+    def get(cls, project_id):
+        """
+        The graph of the project, from the cache if its datasets haven't changed.
+        The cache key includes a hash of the name, code and data package of the datasets of the project, so a graph is
+        never stale even if the datasets are changed by another process.
+        """
+        with connection.cursor() as cursor:
+            cursor.execute(
+                "SELECT id, name, code, md5(data_package::text) FROM {table} WHERE project_id = %s ORDER BY id".format(
+                    table=Dataset._meta.db_table),
+                [project_id]
+            )
+            signature = hashlib.sha1(repr([tuple(row) for row in cursor]).encode('utf-8')).hexdigest()
+        key = (project_id, signature)
+        with cls._lock:
+            graph = cls._cache.pop(key, None)
+            if graph is not None:
+                # most recently used last
+                cls._cache[key] = graph
+        if graph is None:
+            graph = cls(list(Dataset.objects.filter(project_id=project_id).order_by('name')))
+            with cls._lock:
+                cls._cache[key] = graph
+                while len(cls._cache) > cls.CACHE_SIZE:
+                    cls._cache.popitem(last=False)
+        return graph
+
+    def get_edges(self, dataset_id):
+        """
+        :return: the edges of the dataset, as a child or as a parent.
+        """
+        return [edge for edge in self.edges if dataset_id in edge[:2]]
+
+    @classmethod
+    def resolve_records(cls, records):
+        """
+        The parent and children of the records, like Record.parents and Record.children:
+        - parent: the id of the first parent record or None
+        - children: the list of the ids of the children records or None if the dataset has no primary key.
+        Two queries on the RecordLink table whatever the number of records.
+        :param records: a list of records (of any dataset)
+        :return: {record id: (parent, children)}
+        """
+        dataset_ids = set([record.dataset_id for record in records])
+        project_ids = dict(Dataset.objects.filter(pk__in=dataset_ids).values_list('pk', 'project_id'))
+        graphs = dict((project_id, cls.get(project_id)) for project_id in set(project_ids.values()))
+        # the record dataset id -> the parent dataset id
+        parent_dataset_ids = {}
+        with_foreign_keys = set()
+        with_primary_key = set()
+        for dataset_id, project_id in project_ids.items():
+            graph = graphs[project_id]
+            if dataset_id in graph.parents:
+                parent_dataset_ids[dataset_id] = graph.parents[dataset_id][0]
+            if dataset_id in graph.with_foreign_keys:
+                with_foreign_keys.add(dataset_id)
+            if dataset_id in graph.with_primary_key:
+                with_primary_key.add(dataset_id)
+
+        parents = {}
+        child_ids = [record.pk for record in records if record.dataset_id in parent_dataset_ids]
+        if child_ids:
+            datasets = dict((record.pk, record.dataset_id) for record in records)
+            links = RecordLink.objects \
+                .filter(child_id__in=child_ids) \
+                .order_by('parent_id') \
+                .values_list('child_id', 'parent_id', 'parent__dataset_id')
+            for child_id, parent_id, parent_dataset_id in links:
+                if parent_dataset_id == parent_dataset_ids[datasets[child_id]]:
+                    parents.setdefault(child_id, parent_id)
+        children = collections.defaultdict(set)
+        parent_ids = [record.pk for record in records if record.dataset_id in with_primary_key]
+        if parent_ids:
+            for parent_id, child_id in RecordLink.objects.filter(parent_id__in=parent_ids).values_list(
+                    'parent_id', 'child_id'):
+                children[parent_id].add(child_id)
+
+        result = {}
+        for record in records:
+            parent = parents.get(record.pk) if record.dataset_id in with_foreign_keys else None
+            record_children = sorted(children[record.pk]) if record.dataset_id in with_primary_key else None
+            result[record.pk] = (parent, record_children)
+        return result
+
+
+@python_2_unicode_compatible
+class RecordLink(models.Model):
+    """
+    A child -> parent relationship between two records, materialised from the foreignKeys of the dataset schemas:
+    the value of the child field of the child record equals the value of the parent field of the parent record.
+    fk_name is the child field of the foreign key.
+    The links are maintained by the record writes (see add_links and update_links) and rebuilt when a dataset is saved.
+    """
+    child = models.ForeignKey(Record, related_name='parent_links', on_delete=models.CASCADE)
+    parent = models.ForeignKey(Record, related_name='child_links', on_delete=models.CASCADE)
+    fk_name = models.CharField(max_length=500)
+
+    # the child values that never link to a parent. See Record.parents.
+    EMPTY_VALUES = ['null', '""', '0', 'false', '[]', '{}']
+
+    def __str__(self):
+        return '{} -> {} ({})'.format(self.child_id, self.parent_id, self.fk_name)
+
+    @classmethod
+    def add_links(cls, dataset, record_ids=None):
+        """
+        Link the records of the dataset to their parents and children, following the foreign keys of the project
+        graph. The existing links are kept.
+        The typed expressions of the data indexes are used in the join (see main.utils_misc.json_field_expression), so a
+        parent key field flagged as indexed is looked up through its index.
+        :param dataset: the dataset of the records
+        :param record_ids: only these records. All the records of the dataset if None.
+        :return: the number of links created
+        """
+        count = 0
+        with connection.cursor() as cursor:
+            for edge in DatasetGraph.get(dataset.project_id).get_edges(dataset.pk):
+                child_dataset_id, parent_dataset_id = edge[:2]
+                if child_dataset_id == dataset.pk:
+                    count += cls._insert_links(cursor, edge, restrict_to='c', record_ids=record_ids)
+                if parent_dataset_id == dataset.pk:
+                    count += cls._insert_links(cursor, edge, restrict_to='p', record_ids=record_ids)
+        return count
+
+    @staticmethod
+    def get_key_fields(dataset):
+        """
+        :return: the set of the fields of the dataset records used by the links: the child fields of its foreign keys
+        and the parent fields of the foreign keys to the dataset.
+        """
+        fields = set()
+        for child_dataset_id, parent_dataset_id, parent_field, child_field, _ in \
+                DatasetGraph.get(dataset.project_id).get_edges(dataset.pk):
+            if child_dataset_id == dataset.pk:
+                fields.add(child_field)
+            if parent_dataset_id == dataset.pk:
+                fields.add(parent_field)
+        return fields
+
+    @classmethod
+    def update_links(cls, dataset, record_ids):
+        """
+        Replace the links of the records of the dataset, after their data changed.
+        """
+        cls.objects.filter(Q(child_id__in=record_ids) | Q(parent_id__in=record_ids)).delete()
+        return cls.add_links(dataset, record_ids)
+
+    @classmethod
+    def rebuild(cls, dataset):
+        """
+        Replace all the links of the dataset records, after its schema (or the datasets of the project) changed.
+        """
+        cls.objects.filter(Q(child__dataset=dataset) | Q(parent__dataset=dataset)).delete()
+        return cls.add_links(dataset)
+
+    @classmethod
+    def _insert_links(cls, cursor, edge, restrict_to, record_ids=None):
+        child_dataset_id, parent_dataset_id, parent_field, child_field, parent_field_type = edge
+        parent_expression, parent_params = json_field_expression('p.data', parent_field, parent_field_type)
+        child_expression, child_params = json_field_expression('c.data', child_field, parent_field_type)
+        sql = """
+        INSERT INTO {link_table} (child_id, parent_id, fk_name)
+        SELECT c.id, p.id, %s
+        FROM {record_table} c JOIN {record_table} p
+            ON p.dataset_id = %s AND {parent_expression} = {child_expression} AND p.data->%s = c.data->%s
+        WHERE c.dataset_id = %s AND c.data->%s <> ALL(%s::jsonb[])
+        """.format(
+            link_table=cls._meta.db_table,
+            record_table=Record._meta.db_table,
+            parent_expression=parent_expression,
+            child_expression=child_expression
+        )
+        params = [child_field, parent_dataset_id] + parent_params + child_params + \
+                 [parent_field, child_field, child_dataset_id, child_field, cls.EMPTY_VALUES]
+        if record_ids is not None:
+            sql += " AND {}.id = ANY(%s)".format(restrict_to)
+            params.append(list(record_ids))
+        sql += " ON CONFLICT DO NOTHING"
+        cursor.execute(sql, params)
+        return cursor.rowcount
+
+    class Meta:
+        unique_together = ('child', 'parent', 'fk_name')
+
+
 def get_media_path(instance, filename):
     """
     The function used in Media file field to build the path of the uploaded file.
@@ -1026,3 +1340,911 @@ class DatasetMedia(models.Model):
 
     def has_object_destroy_permission(self, request):
         return is_admin(request.user) or self.is_data_engineer(request.user)
+
+
+def get_upload_job_path(instance, filename):
+    """
+    The function used in UploadJob file field to build the path of the uploaded file.
+    see model below
+    https://docs.djangoproject.com/en/1.11/ref/models/fields/#filefield
+    :param instance:
+    :param filename:
+    :return: string
+    """
+    try:
+        return 'project_{project}/dataset_{dataset}/uploads/{filename}'.format(
+            project=instance.dataset.project.id,
+            dataset=instance.dataset.id,
+            filename=filename
+        )
+    except Exception:
+        logger.exception('Error while building the upload job file name')
+        return 'unknown/{}'.format(filename)
+
+
+@python_2_unicode_compatible
+class UploadJob(models.Model):
+    """
+    A records file (csv/xlsx) upload processed in the background by the process_upload_jobs command.
+    """
+    STATUS_PENDING = 'pending'
+    STATUS_RUNNING = 'running'
+    STATUS_SUCCESS = 'success'
+    STATUS_FAILED = 'failed'
+    STATUS_CHOICES = [
+        (STATUS_PENDING, STATUS_PENDING.capitalize()),
+        (STATUS_RUNNING, STATUS_RUNNING.capitalize()),
+        (STATUS_SUCCESS, STATUS_SUCCESS.capitalize()),
+        (STATUS_FAILED, STATUS_FAILED.capitalize()),
+    ]
+    FINISHED_STATUSES = [STATUS_SUCCESS, STATUS_FAILED]
+
+    dataset = models.ForeignKey(Dataset, blank=False, null=False, on_delete=models.CASCADE)
+    user = models.ForeignKey(settings.AUTH_USER_MODEL, blank=True, null=True, on_delete=models.SET_NULL)
+    file = models.FileField(upload_to=get_upload_job_path)
+    # the name and content type of the file as uploaded by the client.
+    file_name = models.CharField(max_length=500, blank=True)
+    content_type = models.CharField(max_length=200, blank=True)
+    # upload options: create_site, delete_previous, strict
+    options = JSONField(null=True, blank=True)
+    status = models.CharField(max_length=20, choices=STATUS_CHOICES, default=STATUS_PENDING)
+    # progress
+    rows_processed = models.IntegerField(default=0)
+    error_count = models.IntegerField(default=0)
+    # a list of row result, same format as the synchronous upload response. Only the first
+    # settings.UPLOAD_JOB_MAX_RESULTS rows are kept, see result_truncated.
+    result = JSONField(null=True, blank=True)
+    result_truncated = models.BooleanField(default=False)
+    # the summary report of all the rows (see UploadResultSummary)
+    summary = JSONField(null=True, blank=True)
+    # error that stopped the job (not a row error)
+    error_message = models.TextField(null=True, blank=True)
+
+    created = models.DateTimeField(auto_now_add=True)
+    started = models.DateTimeField(null=True, blank=True)
+    # last time a running job saved its progress, see fail_stale
+    heartbeat = models.DateTimeField(null=True, blank=True)
+    finished = models.DateTimeField(null=True, blank=True)
+
+    def __str__(self):
+        return '{}: {} ({})'.format(self.dataset.name, self.file_name, self.status)
+
+    @property
+    def is_finished(self):
+        return self.status in self.FINISHED_STATUSES
+
+    @property
+    def has_error(self):
+        return self.status == self.STATUS_FAILED or self.error_count > 0
+
+    @staticmethod
+    def claim_next():
+        """
+        Pick the oldest pending job and mark it as running.
+        The row lock (skip locked) makes it safe to use with several workers.
+        :return: the claimed job or None
+        """
+        with transaction.atomic():
+            job = UploadJob.objects \
+                .select_for_update(skip_locked=True) \
+                .filter(status=UploadJob.STATUS_PENDING) \
+                .order_by('created', 'id') \
+                .first()
+            if job is not None:
+                job.status = UploadJob.STATUS_RUNNING
+                job.started = job.heartbeat = timezone.now()
+                job.save(update_fields=['status', 'started', 'heartbeat'])
+        return job
+
+    @staticmethod
+    def fail_stale(timeout):
+        """
+        Mark as failed the running jobs that haven't saved their progress for timeout seconds: their worker died.
+        They are not put back in the queue: the records of the rows processed before the worker stopped are saved.
+        :return: the number of failed jobs
+        """
+        now = timezone.now()
+        limit = now - datetime.timedelta(seconds=timeout)
+        return UploadJob.objects \
+            .filter(status=UploadJob.STATUS_RUNNING) \
+            .filter(Q(heartbeat__lt=limit) | Q(heartbeat__isnull=True, started__lt=limit)) \
+            .update(
+                status=UploadJob.STATUS_FAILED,
+                finished=now,
+                error_message="The upload worker stopped responding. Some records may have been created, check the "
+                              "dataset before submitting the file again."
+            )
+
+    def is_custodian(self, user):
+        return self.dataset.is_custodian(user)
+
+    def is_data_engineer(self, user):
+        return self.dataset.is_data_engineer(user)
+
+    # API permissions
+    @staticmethod
+    def has_read_permission(request):
+        return True
+
+    def has_object_read_permission(self, request):
+        user = request.user
+        return is_admin(user) or self.user == user or self.is_custodian(user) or self.is_data_engineer(user)
+
+    @staticmethod
+    def has_metadata_permission(request):
+        return True
+
+    def has_object_metadata_permission(self, request):
+        return True
+
+    @staticmethod
+    def has_create_permission(request):
+        """
+        Jobs are created through the dataset upload end-point.
+        :param request:
+        :return:
+        """
+        return False
+
+    @staticmethod
+    def has_update_permission(request):
+        return False
+
+    @staticmethod
+    def has_destroy_permission(request):
+        return False
+
+    class Meta:
+        ordering = ['-created']
+
+
+@python_2_unicode_compatible
+class ChunkedUpload(models.Model):
+    """
+    A records or sites file uploaded in numbered chunks, so that an interrupted upload can be resumed.
+    The chunks are stored on disk (settings.CHUNKED_UPLOAD_ROOT). Chunk n (starting at 0) holds the bytes
+    [n * chunk_size, (n + 1) * chunk_size) of the file, only the last chunk can be smaller.
+    Once all the chunks are received the upload is finalized: the file is assembled and processed like a standard
+    (non chunked) upload.
+    """
+    KIND_RECORDS = 'records'
+    KIND_SITES = 'sites'
+    KIND_CHOICES = [
+        (KIND_RECORDS, KIND_RECORDS.capitalize()),
+        (KIND_SITES, KIND_SITES.capitalize()),
+    ]
+    STATUS_OPEN = 'open'
+    STATUS_FINALIZED = 'finalized'
+    STATUS_CHOICES = [
+        (STATUS_OPEN, STATUS_OPEN.capitalize()),
+        (STATUS_FINALIZED, STATUS_FINALIZED.capitalize()),
+    ]
+    # bytes read at once from a chunk stream
+    COPY_BUFFER_SIZE = 64 * 1024
+
+    user = models.ForeignKey(settings.AUTH_USER_MODEL, blank=True, null=True, on_delete=models.SET_NULL)
+    kind = models.CharField(max_length=20, choices=KIND_CHOICES)
+    # the dataset for a records upload or the project for a sites upload.
+    dataset = models.ForeignKey(Dataset, blank=True, null=True, on_delete=models.CASCADE)
+    project = models.ForeignKey(Project, blank=True, null=True, on_delete=models.CASCADE)
+    file_name = models.CharField(max_length=500)
+    content_type = models.CharField(max_length=200)
+    total_size = models.BigIntegerField()
+    chunk_size = models.IntegerField()
+    # records upload options: create_site, delete_previous, strict, async, report
+    options = JSONField(null=True, blank=True)
+    status = models.CharField(max_length=20, choices=STATUS_CHOICES, default=STATUS_OPEN)
+    created = models.DateTimeField(auto_now_add=True)
+    finalized = models.DateTimeField(null=True, blank=True)
+
+    def __str__(self):
+        return '{} ({})'.format(self.file_name, self.status)
+
+    @property
+    def is_open(self):
+        return self.status == self.STATUS_OPEN
+
+    @property
+    def chunk_count(self):
+        return (self.total_size + self.chunk_size - 1) // self.chunk_size
+
+    @property
+    def directory(self):
+        return path.join(settings.CHUNKED_UPLOAD_ROOT, str(self.pk))
+
+    def chunk_path(self, number):
+        return path.join(self.directory, 'chunk_{}'.format(number))
+
+    def expected_chunk_size(self, number):
+        """
+        :return: the size in bytes of the chunk or None if the chunk number is out of range.
+        """
+        if number < 0 or number >= self.chunk_count:
+            return None
+        return min(self.chunk_size, self.total_size - number * self.chunk_size)
+
+    def write_chunk(self, number, stream):
+        """
+        Store a chunk. The chunk is written in a temporary file and moved when complete, a chunk is never partially
+        received.
+        :param stream: a file like object, read until exhaustion
+        :return: the number of bytes received. Raise a ValueError if the chunk number or its size is not valid.
+        """
+        expected_size = self.expected_chunk_size(number)
+        if expected_size is None:
+            raise ValueError("Wrong chunk number {}. Should be between 0 and {}".format(number, self.chunk_count - 1))
+        if not path.exists(self.directory):
+            os.makedirs(self.directory)
+        # a unique temporary file: the concurrent writes of the same chunk don't mix.
+        fd, part_path = tempfile.mkstemp(prefix=path.basename(self.chunk_path(number)) + '.', suffix='.part',
+                                         dir=self.directory)
+        size = 0
+        try:
+            with os.fdopen(fd, 'wb') as fp:
+                # never read more than one byte past the expected size.
+                while True:
+                    data = stream.read(min(self.COPY_BUFFER_SIZE, expected_size + 1 - size))
+                    if not data:
+                        break
+                    size += len(data)
+                    if size > expected_size:
+                        raise ValueError("Wrong size for chunk {}: more than {} bytes received".format(
+                            number, expected_size))
+                    fp.write(data)
+            if size != expected_size:
+                raise ValueError("Wrong size for chunk {}: {} bytes received, {} expected".format(
+                    number, size, expected_size))
+        except BaseException:
+            os.remove(part_path)
+            raise
+        os.rename(part_path, self.chunk_path(number))
+        return size
+
+    @property
+    def received_chunks(self):
+        if not path.exists(self.directory):
+            return []
+        numbers = []
+        for name in os.listdir(self.directory):
+            if name.startswith('chunk_') and not name.endswith('.part'):
+                numbers.append(int(name[len('chunk_'):]))
+        return sorted(numbers)
+
+    @property
+    def missing_chunks(self):
+        received = set(self.received_chunks)
+        return [n for n in range(self.chunk_count) if n not in received]
+
+    @property
+    def received_ranges(self):
+        """
+        :return: the received byte ranges [[start, end), ...] with the contiguous chunks merged.
+        """
+        ranges = []
+        for number in self.received_chunks:
+            start = number * self.chunk_size
+            end = start + self.expected_chunk_size(number)
+            if ranges and ranges[-1][1] == start:
+                ranges[-1][1] = end
+            else:
+                ranges.append([start, end])
+        return ranges
+
+    @property
+    def is_complete(self):
+        return not self.missing_chunks
+
+    def assemble(self):
+        """
+        Concatenate the chunks in a temporary file (deleted when closed).
+        :return: the temporary file open in binary mode, at position 0.
+        """
+        assembled = tempfile.TemporaryFile(dir=settings.CHUNKED_UPLOAD_ROOT)
+        for number in range(self.chunk_count):
+            with open(self.chunk_path(number), 'rb') as chunk:
+                shutil.copyfileobj(chunk, assembled)
+        assembled.seek(0)
+        return assembled
+
+    def delete_chunks(self):
+        shutil.rmtree(self.directory, ignore_errors=True)
+
+    def mark_finalized(self):
+        """
+        Once the assembled file has been processed: the chunks are not needed anymore.
+        """
+        self.status = ChunkedUpload.STATUS_FINALIZED
+        self.finalized = timezone.now()
+        self.save()
+        self.delete_chunks()
+
+    def delete(self, *args, **kwargs):
+        self.delete_chunks()
+        return super(ChunkedUpload, self).delete(*args, **kwargs)
+
+    # API permissions
+    def is_owner(self, user):
+        return is_admin(user) or self.user == user
+
+    @staticmethod
+    def has_read_permission(request):
+        return True
+
+    def has_object_read_permission(self, request):
+        return self.is_owner(request.user)
+
+    @staticmethod
+    def has_metadata_permission(request):
+        return True
+
+    def has_object_metadata_permission(self, request):
+        return True
+
+    @staticmethod
+    def has_create_permission(request):
+        """
+        The permission on the dataset or the project is checked by the view.
+        """
+        return True
+
+    @staticmethod
+    def has_update_permission(request):
+        return False
+
+    @staticmethod
+    def has_destroy_permission(request):
+        return True
+
+    def has_object_destroy_permission(self, request):
+        return self.is_owner(request.user)
+
+    @staticmethod
+    def has_chunk_permission(request):
+        return True
+
+    def has_object_chunk_permission(self, request):
+        return self.is_owner(request.user)
+
+    @staticmethod
+    def has_finalize_permission(request):
+        return True
+
+    def has_object_finalize_permission(self, request):
+        return self.is_owner(request.user)
+
+    class Meta:
+        ordering = ['-created']
+
+
+@python_2_unicode_compatible
+class CachedSpecies(models.Model):
+    """
+    A local copy of the species list of the species facade (Herbie), see main.utils_species.CachedSpeciesFacade.
+    The whole table is replaced on every refresh.
+    """
+    name_id = models.IntegerField(db_index=True)
+    species_name = models.CharField(max_length=500, db_index=True)
+    refreshed = models.DateTimeField(db_index=True)
+
+    def __str__(self):
+        return '{} ({})'.format(self.species_name, self.name_id)
+
+    class Meta:
+        verbose_name_plural = 'cached species'
+
+
+# the species summary changes collected by SpeciesSummary.batch and the ids of the datasets being deleted, by thread.
+_species_summary_state = threading.local()
+
+
+@python_2_unicode_compatible
+class SpeciesSummary(models.Model):
+    """
+    The species of the records by dataset: number of records and first/last observation of every
+    (dataset, species_name, name_id).
+    The table is maintained incrementally: the record saves and deletes are applied through the Record signals and the
+    bulk paths (record uploads, COPY loader) apply their changes in batches. A change that may move the first or last
+    observation of a species (delete, update) triggers an exact refresh of the species from the records.
+    """
+    dataset = models.ForeignKey(Dataset, null=False, blank=False, on_delete=models.CASCADE)
+    species_name = models.CharField(max_length=500, db_index=True)
+    name_id = models.IntegerField(db_index=True)
+    record_count = models.IntegerField(default=0)
+    first_observation = models.DateTimeField(null=True, blank=True)
+    last_observation = models.DateTimeField(null=True, blank=True)
+
+    def __str__(self):
+        return '{} ({}): {} records'.format(self.species_name, self.dataset_id, self.record_count)
+
+    class Meta:
+        unique_together = ('dataset', 'species_name', 'name_id')
+        verbose_name_plural = 'species summaries'
+
+    @staticmethod
+    def get_entry(record):
+        """
+        :return: the (dataset_id, species_name, name_id, datetime) of the record or None if it has no species name.
+        """
+        if not record.species_name:
+            return None
+        return record.dataset_id, record.species_name, record.name_id, record.datetime
+
+    @classmethod
+    @contextmanager
+    def batch(cls):
+        """
+        Collect the record changes of the block (see record_changes) and apply them at once at the end of the block.
+        Use it around the operations that save or delete many records one by one, e.g. a queryset delete.
+        """
+        batches = getattr(_species_summary_state, 'batches', None)
+        if batches is None:
+            batches = _species_summary_state.batches = []
+        changes = ([], [])
+        batches.append(changes)
+        try:
+            yield
+        finally:
+            batches.pop()
+        cls.record_changes(*changes)
+
+    @classmethod
+    def record_changes(cls, added=(), removed=()):
+        """
+        Apply the records added and removed, or collect them if in a batch.
+        An update is a removal of the old entry and an addition of the new one.
+        :param added: a list of entries (see get_entry). None entries are ignored.
+        :param removed: a list of entries.
+        """
+        added = [entry for entry in added if entry]
+        removed = [entry for entry in removed if entry]
+        batches = getattr(_species_summary_state, 'batches', None)
+        if batches:
+            batches[-1][0].extend(added)
+            batches[-1][1].extend(removed)
+            return
+        # an update that doesn't change the entry is not a change
+        counts = collections.Counter(added)
+        counts.subtract(collections.Counter(removed))
+        cls.add_aggregates(cls._aggregate([(entry, count) for entry, count in counts.items() if count > 0]))
+        cls._remove_aggregates(cls._aggregate([(entry, -count) for entry, count in counts.items() if count < 0]))
+
+    @staticmethod
+    def _aggregate(entries):
+        """
+        :param entries: a list of (entry, count)
+        :return: a list of (dataset_id, species_name, name_id, count, first observation, last observation)
+        """
+        aggregates = collections.OrderedDict()
+        for (dataset_id, species_name, name_id, observation), count in entries:
+            key = (dataset_id, species_name, name_id)
+            aggregate = aggregates.setdefault(key, [0, None, None])
+            aggregate[0] += count
+            if observation is not None:
+                aggregate[1] = observation if aggregate[1] is None else min(aggregate[1], observation)
+                aggregate[2] = observation if aggregate[2] is None else max(aggregate[2], observation)
+        return [key + tuple(aggregate) for key, aggregate in aggregates.items()]
+
+    @classmethod
+    def add_aggregates(cls, aggregates):
+        """
+        Add records to the summary.
+        :param aggregates: a list of (dataset_id, species_name, name_id, count, first observation, last observation)
+        """
+        if not aggregates:
+            return
+        sql = """
+        INSERT INTO {table} AS s (dataset_id, species_name, name_id, record_count, first_observation, last_observation)
+        VALUES {values}
+        ON CONFLICT (dataset_id, species_name, name_id) DO UPDATE SET
+            record_count = s.record_count + EXCLUDED.record_count,
+            first_observation = LEAST(s.first_observation, EXCLUDED.first_observation),
+            last_observation = GREATEST(s.last_observation, EXCLUDED.last_observation)
+        """.format(
+            table=cls._meta.db_table,
+            values=', '.join(['(%s, %s, %s, %s, %s::timestamptz, %s::timestamptz)'] * len(aggregates))
+        )
+        with connection.cursor() as cursor:
+            cursor.execute(sql, [value for aggregate in aggregates for value in aggregate])
+
+    @classmethod
+    def _remove_aggregates(cls, aggregates):
+        """
+        Decrement the record counts. The species left without records or whose first or last observation may have
+        been removed are refreshed.
+        """
+        if not aggregates:
+            return
+        sql = """
+        UPDATE {table} s SET record_count = s.record_count - v.record_count
+        FROM (VALUES {values}) AS v(dataset_id, species_name, name_id, record_count, first_observation, last_observation)
+        WHERE s.dataset_id = v.dataset_id AND s.species_name = v.species_name AND s.name_id = v.name_id
+        RETURNING s.dataset_id, s.species_name, s.name_id,
+            s.record_count <= 0 OR v.first_observation <= s.first_observation
+            OR v.last_observation >= s.last_observation
+        """.format(
+            table=cls._meta.db_table,
+            values=', '.join(
+                ['(%s::integer, %s::varchar, %s::integer, %s::integer, %s::timestamptz, %s::timestamptz)'] *
+                len(aggregates))
+        )
+        with connection.cursor() as cursor:
+            cursor.execute(sql, [value for aggregate in aggregates for value in aggregate])
+            to_refresh = [row[:3] for row in cursor if row[3]]
+        cls.refresh(to_refresh)
+
+    @classmethod
+    def refresh(cls, keys):
+        """
+        Recompute the summary of the given species from the records.
+        :param keys: a list of (dataset_id, species_name, name_id)
+        """
+        keys = list(set(keys))
+        if not keys:
+            return
+        values = ', '.join(['(%s::integer, %s::varchar, %s::integer)'] * len(keys))
+        params = [value for key in keys for value in key]
+        with connection.cursor() as cursor:
+            cursor.execute("""
+            DELETE FROM {table} WHERE (dataset_id, species_name, name_id) IN (VALUES {values})
+            """.format(table=cls._meta.db_table, values=values), params)
+            cursor.execute("""
+            INSERT INTO {table} (dataset_id, species_name, name_id, record_count, first_observation, last_observation)
+            SELECT dataset_id, species_name, name_id, count(*), min(datetime), max(datetime)
+            FROM {record_table}
+            WHERE (dataset_id, species_name, name_id) IN (VALUES {values})
+            GROUP BY dataset_id, species_name, name_id
+            """.format(table=cls._meta.db_table, record_table=Record._meta.db_table, values=values), params)
+
+    @classmethod
+    def rebuild(cls):
+        """
+        Recompute the whole summary from the records.
+        :return: the number of species summaries
+        """
+        with transaction.atomic(), connection.cursor() as cursor:
+            cursor.execute("DELETE FROM {table}".format(table=cls._meta.db_table))
+            cursor.execute("""
+            INSERT INTO {table} (dataset_id, species_name, name_id, record_count, first_observation, last_observation)
+            SELECT dataset_id, species_name, name_id, count(*), min(datetime), max(datetime)
+            FROM {record_table}
+            WHERE species_name IS NOT NULL AND species_name <> ''
+            GROUP BY dataset_id, species_name, name_id
+            """.format(table=cls._meta.db_table, record_table=Record._meta.db_table))
+            return cursor.rowcount
+
+
+@python_2_unicode_compatible
+class DataIndex(models.Model):
+    """
+    A partial expression index on a record data field of a dataset:
+    CREATE INDEX ... ON main_record ((data->>'field'), id) WHERE dataset_id = N
+    The numeric and date fields are indexed with a typed cast (see main.utils_misc.json_field_expression). The id
+    makes the index serve the record ordering and its id tiebreak (see main.utils_misc.order_by_json_fields).
+    The indexes are declared in the dataset schema with the biosys 'indexed' flag. Saving a dataset syncs its
+    DataIndex rows and the indexes are created and dropped concurrently, in a background thread
+    (settings.DATA_INDEX_BACKGROUND_BUILD) or by the build_data_indexes command.
+    The rows of a deleted dataset are kept (dataset = NULL) until their index is dropped.
+    """
+    STATUS_PENDING = 'pending'
+    STATUS_BUILDING = 'building'
+    STATUS_READY = 'ready'
+    STATUS_FAILED = 'failed'
+    STATUS_OBSOLETE = 'obsolete'
+    STATUS_DROPPING = 'dropping'
+    STATUS_CHOICES = [
+        (STATUS_PENDING, STATUS_PENDING.capitalize()),
+        (STATUS_BUILDING, STATUS_BUILDING.capitalize()),
+        (STATUS_READY, STATUS_READY.capitalize()),
+        (STATUS_FAILED, STATUS_FAILED.capitalize()),
+        (STATUS_OBSOLETE, STATUS_OBSOLETE.capitalize()),
+        (STATUS_DROPPING, STATUS_DROPPING.capitalize()),
+    ]
+    # the indexed columns, the expression being the typed field expression (see expression)
+    INDEX_COLUMNS = '{expression}, id'
+    DROP_STATUSES = [STATUS_OBSOLETE, STATUS_DROPPING]
+
+    dataset = models.ForeignKey(Dataset, null=True, blank=True, related_name='data_indexes',
+                                on_delete=models.SET_NULL)
+    field_name = models.CharField(max_length=500)
+    field_type = models.CharField(max_length=50, blank=True)
+    index_name = models.CharField(max_length=63, unique=True)
+    status = models.CharField(max_length=20, choices=STATUS_CHOICES, default=STATUS_PENDING)
+    error_message = models.TextField(null=True, blank=True)
+
+    created = models.DateTimeField(auto_now_add=True)
+    started = models.DateTimeField(null=True, blank=True)
+    finished = models.DateTimeField(null=True, blank=True)
+
+    def __str__(self):
+        return '{}: {} ({})'.format(self.index_name, self.field_name, self.status)
+
+    @property
+    def expression(self):
+        """
+        :return: (sql, params) of the indexed expression
+        """
+        return json_field_expression('data', self.field_name, self.field_type)
+
+    @classmethod
+    def get_index_name(cls, dataset_id, field_name, field_type):
+        # the name changes with the indexed columns: a new cast or a new column gives a new index.
+        columns = cls.INDEX_COLUMNS.format(expression=json_field_expression('data', field_name, field_type)[0])
+        digest = hashlib.md5('{}:{}:{}'.format(field_name, field_type, columns).encode('utf-8')).hexdigest()
+        return 'main_record_data_{}_{}'.format(dataset_id, digest[:12])
+
+    @staticmethod
+    def get_indexed_fields(dataset):
+        """
+        The fields flagged as indexed in the dataset schema.
+        Note: read from the schema descriptor, a dataset with an invalid data package has no indexed field.
+        :return: a list of (field_name, field_type)
+        """
+        if not isinstance(dataset.data_package, dict) or not dataset.resources:
+            return []
+        result = []
+        for field in dataset.schema_data.get('fields', []):
+            if isinstance(field, dict) and field.get('name') and \
+                    BiosysSchema(field.get(BiosysSchema.BIOSYS_KEY_NAME)).is_indexed():
+                result.append((field['name'], field.get('type', 'string')))
+        return result
+
+    @classmethod
+    def sync(cls, dataset):
+        """
+        Create the DataIndex of the newly indexed fields of the dataset (or retry the failed ones) and mark the ones
+        that are not indexed anymore as obsolete. The indexes themselves are created or dropped by the build.
+        An index being dropped is synced again when the drop is done.
+        :return: True if there's something to build or drop.
+        """
+        wanted = collections.OrderedDict(
+            (cls.get_index_name(dataset.pk, field_name, field_type), (field_name, field_type))
+            for field_name, field_type in cls.get_indexed_fields(dataset)
+        )
+        existing = dict((index.index_name, index) for index in cls.objects.filter(dataset=dataset))
+        changed = False
+        for index_name, (field_name, field_type) in wanted.items():
+            index = existing.get(index_name)
+            if index is None:
+                cls.objects.create(dataset=dataset, field_name=field_name, field_type=field_type,
+                                   index_name=index_name)
+                changed = True
+            elif index.status in [cls.STATUS_OBSOLETE, cls.STATUS_FAILED]:
+                # retry the failed builds. An obsolete index may still exist, the build is then a no-op.
+                cls.objects.filter(pk=index.pk, status=index.status).update(
+                    status=cls.STATUS_PENDING, error_message=None)
+                changed = True
+        for index_name, index in existing.items():
+            if index_name not in wanted and index.status not in cls.DROP_STATUSES:
+                cls.objects.filter(pk=index.pk).update(status=cls.STATUS_OBSOLETE)
+                changed = True
+        return changed
+
+    @classmethod
+    def claim_next(cls):
+        """
+        Pick the oldest index to build (pending) or to drop (obsolete) and mark it as building or dropping.
+        The row lock (skip locked) makes it safe to use with several workers.
+        :return: the claimed index or None
+        """
+        with transaction.atomic():
+            index = cls.objects \
+                .select_for_update(skip_locked=True) \
+                .filter(status__in=[cls.STATUS_PENDING, cls.STATUS_OBSOLETE]) \
+                .order_by('created', 'id') \
+                .first()
+            if index is not None:
+                index.status = cls.STATUS_BUILDING if index.status == cls.STATUS_PENDING else cls.STATUS_DROPPING
+                index.started = timezone.now()
+                index.save(update_fields=['status', 'started'])
+        return index
+
+    @classmethod
+    def process_pending(cls):
+        """
+        Build and drop the indexes until there's none left.
+        :return: the number of processed indexes
+        """
+        count = 0
+        index = cls.claim_next()
+        while index is not None:
+            index.run()
+            count += 1
+            index = cls.claim_next()
+        return count
+
+    @classmethod
+    def process_pending_in_background(cls):
+        def process():
+            try:
+                cls.process_pending()
+            except Exception:
+                logger.exception("Error while building the data indexes")
+            finally:
+                connection.close()
+
+        thread = threading.Thread(target=process, name='data-index-builder')
+        thread.daemon = True
+        thread.start()
+        return thread
+
+    def run(self):
+        """
+        Create (status building) or drop (status dropping) the index.
+        The index is created/dropped concurrently (it doesn't lock the record table) unless called within a
+        transaction (tests) where it is not possible.
+        """
+        if self.status == self.STATUS_BUILDING:
+            self._create_index()
+        elif self.status == self.STATUS_DROPPING:
+            self._drop_index()
+
+    def _create_index(self):
+        expression, params = self.expression
+        sql = 'CREATE INDEX {concurrently} IF NOT EXISTS {name} ON {table} (' + self.INDEX_COLUMNS + \
+              ') WHERE dataset_id = %s'
+        try:
+            self._execute(sql, expression, params + [self.dataset_id])
+        except DatabaseError as e:
+            logger.exception("Error while creating the data index {}".format(self.index_name))
+            DataIndex.objects.filter(pk=self.pk, status=self.STATUS_BUILDING).update(
+                status=self.STATUS_FAILED, error_message=str(e), finished=timezone.now())
+            # a failed concurrent build leaves an invalid index.
+            self._execute('DROP INDEX {concurrently} IF EXISTS {name}', silent=True)
+            return
+        # the dataset schema may have changed during the build.
+        DataIndex.objects.filter(pk=self.pk, status=self.STATUS_BUILDING).update(
+            status=self.STATUS_READY, error_message=None, finished=timezone.now())
+
+    def _drop_index(self):
+        self._execute('DROP INDEX {concurrently} IF EXISTS {name}')
+        DataIndex.objects.filter(pk=self.pk).delete()
+        dataset = Dataset.objects.filter(pk=self.dataset_id).first() if self.dataset_id else None
+        if dataset is not None:
+            DataIndex.sync(dataset)
+
+    def _execute(self, sql, expression='', params=None, silent=False):
+        concurrently = not connection.in_atomic_block
+        sql = sql.format(
+            concurrently='CONCURRENTLY' if concurrently else '',
+            name=connection.ops.quote_name(self.index_name),
+            table=Record._meta.db_table,
+            expression=expression
+        )
+        try:
+            if concurrently:
+                with connection.cursor() as cursor:
+                    cursor.execute(sql, params)
+            else:
+                with transaction.atomic(), connection.cursor() as cursor:
+                    cursor.execute(sql, params)
+        except DatabaseError:
+            if not silent:
+                raise
+            logger.exception("Error while executing: {}".format(sql))
+
+    class Meta:
+        ordering = ['created', 'id']
+
+
+@receiver(post_save, sender=Record)
+def update_species_summary_on_record_save(sender, instance, created, **kwargs):
+    entry = SpeciesSummary.get_entry(instance)
+    if created:
+        SpeciesSummary.record_changes(added=[entry])
+    elif hasattr(instance, '_species_summary_entry'):
+        SpeciesSummary.record_changes(added=[entry], removed=[instance._species_summary_entry])
+    elif entry:
+        # the previous state of the record is unknown
+        SpeciesSummary.refresh([entry[:3]])
+    instance._species_summary_entry = entry
+
+
+@receiver(pre_save, sender=Record)
+def store_record_content_change(sender, instance, **kwargs):
+    # the data (or source info) change of the record, compared to its saved content (unknown: changed).
+    # The saved content is updated by store_record_content_on_save, after the other receivers.
+    saved_content = getattr(instance, '_saved_content', None)
+    instance._content = instance.get_content()
+    instance._content_changed = saved_content is None or saved_content != instance._content
+    # the saved data, see update_record_links_on_record_save
+    instance._previous_data = json.loads(saved_content)[0] if instance._content_changed and saved_content else None
+
+
+@receiver(post_save, sender=Record)
+def update_search_vector_on_record_save(sender, instance, **kwargs):
+    # a record is often saved several times in a request (see RecordSerializer), only its first save or a content
+    # change updates the vector.
+    if getattr(instance, '_content_changed', True):
+        Record.update_search_vectors(instance.dataset, [instance.pk])
+
+
+@receiver(post_save, sender=Record)
+def update_record_links_on_record_save(sender, instance, created, **kwargs):
+    if created:
+        RecordLink.add_links(instance.dataset, [instance.pk])
+    elif getattr(instance, '_content_changed', True):
+        # only a change of the key values of the record changes its links.
+        previous_data = getattr(instance, '_previous_data', None)
+        key_fields = RecordLink.get_key_fields(instance.dataset)
+        if key_fields and (previous_data is None or
+                           any([previous_data.get(field) != instance.data.get(field) for field in key_fields])):
+            RecordLink.update_links(instance.dataset, [instance.pk])
+
+
+@receiver(post_save, sender=Record)
+def store_record_content_on_save(sender, instance, **kwargs):
+    instance._saved_content = getattr(instance, '_content', None)
+
+
+@receiver(post_delete, sender=Record)
+def update_species_summary_on_record_delete(sender, instance, **kwargs):
+    # the summary of a deleted dataset is deleted with it.
+    if instance.dataset_id not in getattr(_species_summary_state, 'deleted_dataset_ids', ()):
+        SpeciesSummary.record_changes(removed=[SpeciesSummary.get_entry(instance)])
+
+
+@receiver(post_save, sender=Dataset)
+def invalidate_dataset_schema_on_save(sender, instance, **kwargs):
+    schema_cache.invalidate(instance.pk)
+
+
+@receiver(pre_save, sender=Dataset)
+def store_dataset_record_link_edges(sender, instance, **kwargs):
+    # the foreign key edges of the dataset before the save, see rebuild_dataset_record_links.
+    if instance.pk is not None:
+        instance._record_link_edges = DatasetGraph.get(instance.project_id).get_edges(instance.pk)
+
+
+@receiver(post_save, sender=Dataset)
+def rebuild_dataset_record_links(sender, instance, created, **kwargs):
+    # the links only depend on the graph edges of the dataset: its foreign keys, the key fields and their type, the
+    # dataset names. A title or description change doesn't rebuild them. A new dataset has no records.
+    if not created and DatasetGraph.get(instance.project_id).get_edges(instance.pk) != getattr(
+            instance, '_record_link_edges', None):
+        RecordLink.rebuild(instance)
+
+
+def _get_schema_field_names(dataset):
+    resources = dataset.resources if dataset is not None else []
+    return [field.get('name') for field in resources[0].get('schema', {}).get('fields', [])] if resources else []
+
+
+@receiver(pre_save, sender=Dataset)
+def store_dataset_search_field_names(sender, instance, **kwargs):
+    # the schema fields of the dataset before the save, see update_dataset_search_vectors.
+    if instance.pk is not None:
+        instance._search_field_names = _get_schema_field_names(
+            Dataset.objects.filter(pk=instance.pk).only('data_package').first())
+
+
+@receiver(post_save, sender=Dataset)
+def update_dataset_search_vectors(sender, instance, created, **kwargs):
+    # the search vectors are built from the values of the schema fields, see Record.update_search_vectors. They are
+    # rebuilt in the background, or with the build_search_vectors command.
+    if not created and _get_schema_field_names(instance) != getattr(instance, '_search_field_names', None) and \
+            settings.SEARCH_VECTOR_BACKGROUND_BUILD:
+        dataset_id = instance.pk
+        transaction.on_commit(lambda: Record.rebuild_search_vectors_in_background(dataset_id))
+
+
+@receiver(post_save, sender=Dataset)
+def sync_dataset_data_indexes(sender, instance, **kwargs):
+    if DataIndex.sync(instance) and settings.DATA_INDEX_BACKGROUND_BUILD:
+        transaction.on_commit(DataIndex.process_pending_in_background)
+
+
+@receiver(pre_delete, sender=Dataset)
+def start_dataset_delete(sender, instance, **kwargs):
+    if not hasattr(_species_summary_state, 'deleted_dataset_ids'):
+        _species_summary_state.deleted_dataset_ids = set()
+    _species_summary_state.deleted_dataset_ids.add(instance.pk)
+    # the data indexes outlive the dataset until they are dropped.
+    if DataIndex.objects.filter(dataset=instance).exclude(status=DataIndex.STATUS_DROPPING) \
+            .update(status=DataIndex.STATUS_OBSOLETE) and settings.DATA_INDEX_BACKGROUND_BUILD:
+        transaction.on_commit(DataIndex.process_pending_in_background)
+
+
+@receiver(post_delete, sender=Dataset)
+def end_dataset_delete(sender, instance, **kwargs):
+    getattr(_species_summary_state, 'deleted_dataset_ids', set()).discard(instance.pk)
+    schema_cache.invalidate(instance.pk)
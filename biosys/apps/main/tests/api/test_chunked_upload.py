@@ -0,0 +1,224 @@
+import os
+import shutil
+import tempfile
+
+from django.core.urlresolvers import reverse
+from django.test import override_settings
+from rest_framework import status
+
+from main.models import Dataset, Site, ChunkedUpload
+from main.tests import factories
+from main.tests.api import helpers
+
+
+class TestChunkedUpload(helpers.BaseUserTestCase):
+    def _more_setup(self):
+        self.chunk_root = tempfile.mkdtemp()
+        self.settings_override = override_settings(CHUNKED_UPLOAD_ROOT=self.chunk_root)
+        self.settings_override.enable()
+        self.fields = [
+            {
+                "name": "Column A",
+                "type": "string",
+                "constraints": helpers.NOT_REQUIRED_CONSTRAINTS
+            },
+            {
+                "name": "Column B",
+                "type": "string",
+                "constraints": helpers.REQUIRED_CONSTRAINTS
+            }
+        ]
+        self.ds = factories.DatasetFactory(
+            project=self.project_1,
+            type=Dataset.TYPE_GENERIC,
+            data_package=helpers.create_data_package_from_fields(self.fields))
+        self.url = reverse('api:chunked-upload-list')
+
+    def tearDown(self):
+        self.settings_override.disable()
+        shutil.rmtree(self.chunk_root, ignore_errors=True)
+        super(TestChunkedUpload, self).tearDown()
+
+    @staticmethod
+    def _file_content(rows):
+        with open(helpers.rows_to_csv_file(rows), 'rb') as fp:
+            return fp.read()
+
+    def _init(self, content, chunk_size, client=None, **kwargs):
+        client = client or self.custodian_1_client
+        payload = {
+            'kind': ChunkedUpload.KIND_RECORDS,
+            'dataset': self.ds.pk,
+            'file_name': 'records.csv',
+            'content_type': 'text/csv',
+            'total_size': len(content),
+            'chunk_size': chunk_size,
+        }
+        payload.update(kwargs)
+        return client.post(self.url, data=payload, format='json')
+
+    def _put_chunk(self, upload_id, number, data, client=None):
+        client = client or self.custodian_1_client
+        url = reverse('api:chunked-upload-chunk', kwargs={'pk': upload_id, 'number': number})
+        return client.put(url, data=data, content_type='application/octet-stream')
+
+    def test_records_happy_path(self):
+        content = self._file_content([
+            ['Column A', 'Column B'],
+            ['A1', 'B1'],
+            ['A2', 'B2'],
+            ['A3', 'B3'],
+        ])
+        chunk_size = 10
+        resp = self._init(content, chunk_size)
+        self.assertEqual(status.HTTP_201_CREATED, resp.status_code)
+        upload_id = resp.json().get('id')
+        chunks = [content[i:i + chunk_size] for i in range(0, len(content), chunk_size)]
+        self.assertEqual(len(chunks), resp.json().get('chunk_count'))
+
+        # send all chunks except the second one, in reverse order
+        for number in reversed(range(len(chunks))):
+            if number != 1:
+                resp = self._put_chunk(upload_id, number, chunks[number])
+                self.assertEqual(status.HTTP_200_OK, resp.status_code)
+
+        detail_url = reverse('api:chunked-upload-detail', kwargs={'pk': upload_id})
+        resp = self.custodian_1_client.get(detail_url)
+        self.assertEqual(status.HTTP_200_OK, resp.status_code)
+        self.assertEqual([1], resp.json().get('missing_chunks'))
+        self.assertEqual([[0, chunk_size], [2 * chunk_size, len(content)]], resp.json().get('received_ranges'))
+
+        # can't finalize with a missing chunk
+        finalize_url = reverse('api:chunked-upload-finalize', kwargs={'pk': upload_id})
+        resp = self.custodian_1_client.post(finalize_url)
+        self.assertEqual(status.HTTP_400_BAD_REQUEST, resp.status_code)
+        self.assertEqual(0, self.ds.record_queryset.count())
+
+        resp = self._put_chunk(upload_id, 1, chunks[1])
+        self.assertEqual(status.HTTP_200_OK, resp.status_code)
+        self.assertEqual([], resp.json().get('missing_chunks'))
+
+        resp = self.custodian_1_client.post(finalize_url)
+        self.assertEqual(status.HTTP_200_OK, resp.status_code)
+        results = resp.json()
+        self.assertEqual([2, 3, 4], [r.get('row') for r in results])
+        self.assertEqual(3, self.ds.record_queryset.count())
+        self.assertEqual(
+            ['A1', 'A2', 'A3'],
+            [r.data['Column A'] for r in self.ds.record_queryset.order_by('pk')]
+        )
+        upload = ChunkedUpload.objects.get(pk=upload_id)
+        self.assertEqual(ChunkedUpload.STATUS_FINALIZED, upload.status)
+        self.assertEqual([], upload.received_chunks)
+        # no more chunks accepted
+        resp = self._put_chunk(upload_id, 0, chunks[0])
+        self.assertEqual(status.HTTP_409_CONFLICT, resp.status_code)
+
+    def test_finalize_again_after_error(self):
+        """
+        The upload stays open if the file can't be processed: a corrected chunk can be sent and the upload finalized
+        again without sending all the chunks.
+        """
+        rows = [
+            ['Column A', 'Column B'],
+            ['A1', 'B1'],
+            ['A2', 'B2'],
+        ]
+        content = self._file_content(rows)
+        # the value of the required Column B missing in the last row.
+        faulty = content.replace(b'B2', b'""')
+        chunk_size = len(content) - 4
+        resp = self._init(content, chunk_size, options={'strict': True})
+        self.assertEqual(status.HTTP_201_CREATED, resp.status_code)
+        upload_id = resp.json().get('id')
+        self.assertEqual(status.HTTP_200_OK, self._put_chunk(upload_id, 0, faulty[:chunk_size]).status_code)
+        self.assertEqual(status.HTTP_200_OK, self._put_chunk(upload_id, 1, faulty[chunk_size:]).status_code)
+        finalize_url = reverse('api:chunked-upload-finalize', kwargs={'pk': upload_id})
+        resp = self.custodian_1_client.post(finalize_url)
+        self.assertEqual(status.HTTP_400_BAD_REQUEST, resp.status_code)
+        upload = ChunkedUpload.objects.get(pk=upload_id)
+        self.assertEqual(ChunkedUpload.STATUS_OPEN, upload.status)
+        self.assertEqual([0, 1], upload.received_chunks)
+
+        # send the corrected last chunk only
+        self.assertEqual(status.HTTP_200_OK, self._put_chunk(upload_id, 1, content[chunk_size:]).status_code)
+        self.ds.record_queryset.delete()
+        resp = self.custodian_1_client.post(finalize_url)
+        self.assertEqual(status.HTTP_200_OK, resp.status_code)
+        self.assertEqual(['B1', 'B2'], [r.data['Column B'] for r in self.ds.record_queryset.order_by('pk')])
+        upload = ChunkedUpload.objects.get(pk=upload_id)
+        self.assertEqual(ChunkedUpload.STATUS_FINALIZED, upload.status)
+        self.assertEqual([], upload.received_chunks)
+
+    def test_wrong_chunk_size(self):
+        content = self._file_content([
+            ['Column A', 'Column B'],
+            ['A1', 'B1'],
+        ])
+        resp = self._init(content, 10)
+        upload_id = resp.json().get('id')
+        resp = self._put_chunk(upload_id, 0, content[:5])
+        self.assertEqual(status.HTTP_400_BAD_REQUEST, resp.status_code)
+        # out of range
+        resp = self._put_chunk(upload_id, 100, content[:10])
+        self.assertEqual(status.HTTP_400_BAD_REQUEST, resp.status_code)
+        self.assertEqual([], ChunkedUpload.objects.get(pk=upload_id).received_chunks)
+
+    def test_chunk_too_large(self):
+        """
+        The chunk stream is not read past the expected size and nothing is left on disk.
+        """
+        class EndlessStream(object):
+            def __init__(self):
+                self.read_size = 0
+
+            def read(self, size=-1):
+                self.read_size += size
+                return b'x' * size
+
+        resp = self._init(b'x' * 100, 10)
+        upload = ChunkedUpload.objects.get(pk=resp.json().get('id'))
+        stream = EndlessStream()
+        with self.assertRaises(ValueError):
+            upload.write_chunk(0, stream)
+        self.assertEqual(11, stream.read_size)
+        self.assertEqual([], os.listdir(upload.directory))
+        # too large through the API
+        resp = self._put_chunk(upload.pk, 0, b'x' * 11)
+        self.assertEqual(status.HTTP_400_BAD_REQUEST, resp.status_code)
+        self.assertEqual([], upload.received_chunks)
+
+    def test_permissions(self):
+        content = self._file_content([
+            ['Column A', 'Column B'],
+            ['A1', 'B1'],
+        ])
+        # custodian of another project can't upload into the dataset
+        resp = self._init(content, 10, client=self.custodian_2_client)
+        self.assertEqual(status.HTTP_403_FORBIDDEN, resp.status_code)
+
+        resp = self._init(content, 10)
+        upload_id = resp.json().get('id')
+        # only the owner can send chunks
+        resp = self._put_chunk(upload_id, 0, content[:10], client=self.custodian_2_client)
+        self.assertIn(resp.status_code, [status.HTTP_403_FORBIDDEN, status.HTTP_404_NOT_FOUND])
+
+    def test_sites(self):
+        content = self._file_content([
+            ['Site Code', 'Latitude', 'Longitude'],
+            ['C1', '-32', '116'],
+            ['C2', '-31', '115'],
+        ])
+        resp = self._init(content, 16, kind=ChunkedUpload.KIND_SITES, dataset=None, project=self.project_1.pk,
+                          file_name='sites.csv')
+        self.assertEqual(status.HTTP_201_CREATED, resp.status_code)
+        upload_id = resp.json().get('id')
+        for number, start in enumerate(range(0, len(content), 16)):
+            resp = self._put_chunk(upload_id, number, content[start:start + 16])
+            self.assertEqual(status.HTTP_200_OK, resp.status_code)
+        resp = self.custodian_1_client.post(reverse('api:chunked-upload-finalize', kwargs={'pk': upload_id}))
+        self.assertEqual(status.HTTP_200_OK, resp.status_code)
+        self.assertEqual(
+            ['C1', 'C2'],
+            [s.code for s in Site.objects.filter(project=self.project_1, code__in=['C1', 'C2']).order_by('code')]
+        )
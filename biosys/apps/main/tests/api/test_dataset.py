@@ -1,7 +1,14 @@
+import hashlib
+
+from django.core.management import call_command
 from django.core.urlresolvers import reverse
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+from django.utils import six
+from django.utils.timezone import utc
 from rest_framework import status
 
-from main.models import Dataset
+from main.models import Dataset, DataIndex, Record
 from main.tests.api import helpers
 from main.tests.test_data_package import (
     clone,
@@ -9,6 +16,8 @@ from main.tests.test_data_package import (
     LAT_LONG_OBSERVATION_DATA_PACKAGE,
     SPECIES_OBSERVATION_DATA_PACKAGE,
 )
+from main.utils_data_package import parse_datetime_day_first
+from main.utils_misc import filter_indexed_json_fields, json_field_expression
 
 
 class TestPermissions(helpers.BaseUserTestCase):
@@ -728,6 +737,89 @@ class TestDatasetRecordsSearchAndOrdering(helpers.BaseUserTestCase):
 
         self.assertEqual(len(resp.json()), expected_number_of_records)
 
+    def test_server_side_fulltext_search(self):
+        rows = [
+            ['When', 'Species', 'How Many', 'Latitude', 'Longitude', 'Comments'],
+            ['2018-02-07', 'Canis lupus', 1, -32.0, 115.75, ''],
+            ['2018-01-12', 'Chubby bat', 10, -32.0, 115.75, 'Awesome'],
+            ['2018-02-02', 'Canis dingo', 2, -32.0, 115.75, 'Watch out kids'],
+            ['2018-02-10', 'Unknown', 3, -32.0, 115.75, 'Canis?'],
+        ]
+        dataset = self._create_dataset_and_records_from_rows(rows)
+        url = reverse('api:dataset-records', kwargs={'pk': dataset.pk})
+
+        def search(term):
+            resp = self.client.get(url, data={'search': term, 'search_mode': 'fulltext'}, format='json')
+            self.assertEqual(resp.status_code, status.HTTP_200_OK)
+            return sorted(record['data']['Species'] for record in resp.json())
+
+        self.assertEqual(['Canis dingo', 'Canis lupus', 'Unknown'], search('canis'))
+        # prefix of every word
+        self.assertEqual(['Canis dingo', 'Canis lupus', 'Unknown'], search('Can'))
+        self.assertEqual(['Canis lupus'], search('canis LUP'))
+        self.assertEqual(['Chubby bat'], search('awesome'))
+        self.assertEqual([], search('wolf'))
+
+        # the records written through the API
+        record = dataset.record_queryset.get(data__Species='Canis lupus')
+        record_url = reverse('api:record-detail', kwargs={'pk': record.pk})
+        data = clone(record.data)
+        data['Species'] = 'Canis familiaris'
+        with CaptureQueriesContext(connection) as context:
+            resp = self.client.patch(record_url, data={'data': data}, format='json')
+        self.assertEqual(resp.status_code, status.HTTP_200_OK)
+        # the record is saved several times by the serializer, its vector is updated once.
+        self.assertEqual(1, len([q for q in context.captured_queries if 'SET search_vector' in q['sql']]))
+        self.assertEqual(['Canis familiaris'], search('famil'))
+        self.assertEqual([], search('lupus'))
+
+        # the backfill
+        with connection.cursor() as cursor:
+            cursor.execute("UPDATE main_record SET search_vector = NULL WHERE dataset_id = %s", [dataset.pk])
+        self.assertEqual([], search('canis'))
+        call_command('build_search_vectors', dataset=[dataset.pk], stdout=six.StringIO())
+        self.assertEqual(['Canis dingo', 'Canis familiaris', 'Unknown'], search('canis'))
+
+        # a change of the schema fields: the vectors are rebuilt after the commit, in the background (or with the
+        # command), not in the request. The values of a removed field are no longer searched.
+        data_package = clone(dataset.data_package)
+        fields = data_package['resources'][0]['schema']['fields']
+        data_package['resources'][0]['schema']['fields'] = [f for f in fields if f['name'] != 'Comments']
+        dataset.data_package = data_package
+        with CaptureQueriesContext(connection) as context:
+            dataset.save()
+        self.assertEqual([], [q for q in context.captured_queries if 'SET search_vector' in q['sql']])
+        call_command('build_search_vectors', dataset=[dataset.pk], stdout=six.StringIO())
+        self.assertEqual(['Canis dingo', 'Canis familiaris'], search('canis'))
+        self.assertEqual([], search('awesome'))
+
+        resp = self.client.get(url, data={'search': 'canis', 'search_mode': 'unknown'}, format='json')
+        self.assertEqual(resp.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_biosys_to_timestamp(self):
+        """
+        The SQL date cast of the ordering and the data indexes gives the same dates as the upload (dateutil), the
+        datetimes with a time zone offset in UTC.
+        """
+        values = [
+            '2018-02-01', '2018-2-1', '2018-2-13', '01/02/2018', '1/2/2018', '02/13/2018', '13.02.2018', '13-02-2018',
+            '2018-02-01 10:30', '2018-02-01T10:30:15.5', ' 01/02/2018 10:30:15 ', '2018-02-01T10:30:00+08:00',
+            '2018-02-01T10:30:00Z', '2018-02-01 10:30-0930', '01/02/2018 23:30 +11'
+        ]
+        for value in values:
+            expected = parse_datetime_day_first(value)
+            if expected.tzinfo is not None:
+                expected = expected.astimezone(utc).replace(tzinfo=None)
+            with connection.cursor() as cursor:
+                cursor.execute("SELECT biosys_to_timestamp(%s)", [value])
+                self.assertEqual(expected, cursor.fetchone()[0], value)
+        # invalid dates, two-digit years and the other formats
+        for value in ['31/02/2018', '2018-13-01', '29/02/2017', '2018-02-01 24:00', '0000-01-01', '01/02/18',
+                      '2018-02-01 garbage', '1 Feb 2018', '']:
+            with connection.cursor() as cursor:
+                cursor.execute("SELECT biosys_to_timestamp(%s)", [value])
+                self.assertIsNone(cursor.fetchone()[0], value)
+
     def test_server_side_ordering_string(self):
         rows = [
             ['When', 'Species', 'How Many', 'Latitude', 'Longitude', 'Comments'],
@@ -816,3 +908,191 @@ class TestDatasetRecordsSearchAndOrdering(helpers.BaseUserTestCase):
 
         record_rows = [record['source_info']['row'] for record in json_response]
         self.assertEqual(record_rows, list(reversed(sorted_rows)))
+
+    def test_server_side_ordering_typed_multiple_keys(self):
+        """
+        The data fields are ordered according to their schema type (not as strings), several keys can be given and the
+        record id is the tiebreak.
+        """
+        fields = [
+            {'name': 'What', 'type': 'string'},
+            {'name': 'When', 'type': 'date', 'format': 'any'},
+            {'name': 'How Many', 'type': 'integer'}
+        ]
+        dataset = self._create_dataset_with_schema(self.project_1, self.data_engineer_1_client, fields)
+        rows = [
+            ('A', '12/02/2017', '10'),
+            ('B', '01/03/2018', '9'),
+            ('C', '05/01/2018', '10'),
+            ('D', '2018-01-05', '10'),
+        ]
+        for what, when, how_many in rows:
+            self._create_record(self.client, dataset, {'What': what, 'When': when, 'How Many': how_many})
+
+        urls = [
+            reverse('api:dataset-records', kwargs={'pk': dataset.pk}) + '?',
+            reverse('api:record-list') + '?dataset__id={}&'.format(dataset.pk)
+        ]
+        expected = [
+            # day first, the ISO date is the same day as C
+            ('When', ['A', 'C', 'D', 'B']),
+            ('-When', ['B', 'D', 'C', 'A']),
+            # numbers not strings
+            ('How Many', ['B', 'A', 'C', 'D']),
+            ('How Many,-When', ['B', 'C', 'D', 'A']),
+            ('-How Many, What', ['A', 'C', 'D', 'B']),
+            ('How Many,-id', ['B', 'D', 'C', 'A']),
+            # unknown keys are ignored
+            ('Unknown,How Many', ['B', 'A', 'C', 'D']),
+        ]
+        for url in urls:
+            for ordering, expected_order in expected:
+                resp = self.client.get(url + 'ordering=' + ordering, format='json')
+                self.assertEqual(resp.status_code, status.HTTP_200_OK)
+                self.assertEqual(expected_order, [record['data']['What'] for record in resp.json()], ordering)
+
+
+class TestDataIndexes(helpers.BaseUserTestCase):
+    """
+    The indexes of the schema fields flagged with biosys.indexed
+    """
+
+    def _more_setup(self):
+        self.client = self.data_engineer_1_client
+        self.fields = [
+            {
+                'name': 'What',
+                'type': 'string',
+                'biosys': {'indexed': True}
+            },
+            {
+                'name': 'How Many',
+                'type': 'integer',
+                'biosys': {'indexed': True}
+            },
+            {
+                'name': 'When',
+                'type': 'date'
+            }
+        ]
+
+    @staticmethod
+    def index_exists(index_name):
+        with connection.cursor() as cursor:
+            cursor.execute("SELECT 1 FROM pg_indexes WHERE indexname = %s", [index_name])
+            return cursor.fetchone() is not None
+
+    def test_index_name(self):
+        """
+        The index name changes with the indexed columns: the indexes of the field expression alone (no id) are
+        replaced by a sync.
+        """
+        expression = json_field_expression('data', 'How Many', 'integer')[0]
+        digest = hashlib.md5('{}:{}:{}'.format('How Many', 'integer', expression).encode('utf-8')).hexdigest()
+        self.assertNotEqual('main_record_data_1_{}'.format(digest[:12]),
+                            DataIndex.get_index_name(1, 'How Many', 'integer'))
+        self.assertEqual(DataIndex.get_index_name(1, 'How Many', 'integer'),
+                         DataIndex.get_index_name(1, 'How Many', 'integer'))
+
+    def test_build_and_status(self):
+        dataset = self._create_dataset_with_schema(self.project_1, self.client, self.fields)
+        url = reverse('api:dataset-detail', kwargs={'pk': dataset.pk})
+        resp = self.client.get(url)
+        self.assertEqual(resp.status_code, status.HTTP_200_OK)
+        self.assertEqual(
+            [('What', 'string', DataIndex.STATUS_PENDING), ('How Many', 'integer', DataIndex.STATUS_PENDING)],
+            [(i['field_name'], i['field_type'], i['status']) for i in resp.json()['data_indexes']]
+        )
+
+        self.assertEqual(2, DataIndex.process_pending())
+        for index in DataIndex.objects.filter(dataset=dataset):
+            self.assertEqual(DataIndex.STATUS_READY, index.status)
+            self.assertTrue(self.index_exists(index.index_name))
+            with connection.cursor() as cursor:
+                cursor.execute("SELECT indexdef FROM pg_indexes WHERE indexname = %s", [index.index_name])
+                self.assertIn(', id) WHERE', cursor.fetchone()[0])
+        resp = self.client.get(url)
+        self.assertEqual(
+            [DataIndex.STATUS_READY, DataIndex.STATUS_READY],
+            [i['status'] for i in resp.json()['data_indexes']]
+        )
+        # nothing left to build
+        self.assertEqual(0, DataIndex.process_pending())
+
+    def test_drop_on_schema_change(self):
+        dataset = self._create_dataset_with_schema(self.project_1, self.client, self.fields)
+        DataIndex.process_pending()
+        index = DataIndex.objects.get(dataset=dataset, field_name='What')
+
+        data_package = clone(dataset.data_package)
+        del data_package['resources'][0]['schema']['fields'][0]['biosys']
+        url = reverse('api:dataset-detail', kwargs={'pk': dataset.pk})
+        resp = self.client.patch(url, data={'data_package': data_package}, format='json')
+        self.assertEqual(resp.status_code, status.HTTP_200_OK)
+        self.assertEqual(
+            [('What', DataIndex.STATUS_OBSOLETE), ('How Many', DataIndex.STATUS_READY)],
+            [(i['field_name'], i['status']) for i in resp.json()['data_indexes']]
+        )
+
+        self.assertEqual(1, DataIndex.process_pending())
+        self.assertFalse(DataIndex.objects.filter(pk=index.pk).exists())
+        self.assertFalse(self.index_exists(index.index_name))
+        self.assertEqual(['How Many'], [i.field_name for i in DataIndex.objects.filter(dataset=dataset)])
+
+    def test_drop_on_dataset_delete(self):
+        dataset = self._create_dataset_with_schema(self.project_1, self.client, self.fields)
+        DataIndex.process_pending()
+        index_names = [i.index_name for i in DataIndex.objects.filter(dataset=dataset)]
+
+        url = reverse('api:dataset-detail', kwargs={'pk': dataset.pk})
+        resp = self.client.delete(url)
+        self.assertEqual(resp.status_code, status.HTTP_204_NO_CONTENT)
+        indexes = DataIndex.objects.filter(index_name__in=index_names)
+        self.assertEqual(
+            [(None, DataIndex.STATUS_OBSOLETE), (None, DataIndex.STATUS_OBSOLETE)],
+            [(i.dataset_id, i.status) for i in indexes]
+        )
+
+        self.assertEqual(2, DataIndex.process_pending())
+        self.assertFalse(indexes.exists())
+        for index_name in index_names:
+            self.assertFalse(self.index_exists(index_name))
+
+    def test_filter_indexed_fields(self):
+        dataset = self._create_dataset_with_schema(self.project_1, self.client, self.fields)
+        DataIndex.process_pending()
+        for what, how_many in [('Canis lupus', 1), ('Chubby bat', 10), ('Canis dingo', 10)]:
+            self._create_record(self.client, dataset, {'What': what, 'How Many': how_many, 'When': '2018-01-12'})
+
+        url = reverse('api:dataset-records', kwargs={'pk': dataset.pk})
+        filters = [
+            ('{"How Many": 10}', ['Chubby bat', 'Canis dingo']),
+            ('{"How Many": 10, "What": "Canis dingo"}', ['Canis dingo']),
+            ('{"What": "Canis"}', []),
+        ]
+        for data_filter, expected in filters:
+            resp = self.client.get(url, data={'data__contains': data_filter})
+            self.assertEqual(resp.status_code, status.HTTP_200_OK)
+            self.assertEqual(sorted(expected), sorted(r['data']['What'] for r in resp.json()))
+
+    def test_filter_indexed_numeric_fields_use_index(self):
+        """
+        The numeric values are compared as numeric, an int or a float value must not give a
+        biosys_to_numeric(...) = double precision clause that can't use the index.
+        """
+        dataset = self._create_dataset_with_schema(self.project_1, self.client, self.fields)
+        DataIndex.process_pending()
+        index_name = DataIndex.objects.get(dataset=dataset, field_name='How Many').index_name
+        for value in [10, 10.5, 1e20, '10']:
+            qs = filter_indexed_json_fields(
+                Record.objects.filter(dataset=dataset, data__contains={'How Many': value}),
+                'data', [('How Many', 'integer')], {'How Many': value}
+            )
+            sql, params = qs.query.sql_with_params()
+            self.assertIn('::numeric', sql)
+            with connection.cursor() as cursor:
+                cursor.execute('SET LOCAL enable_seqscan = off')
+                cursor.execute('EXPLAIN ' + sql, params)
+                plan = '\n'.join(row[0] for row in cursor.fetchall())
+                cursor.execute('RESET enable_seqscan')
+            self.assertIn(index_name, plan)
@@ -2,13 +2,16 @@ import json
 import re
 from os import path
 
+from django.core.management import call_command
 from django.core.urlresolvers import reverse
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
 from django.utils import six
 from openpyxl import load_workbook
 from openpyxl.cell import Cell
 from rest_framework import status
 
-from main.models import Dataset, Record
+from main.models import Dataset, Record, RecordLink
 from main.tests import factories
 from main.tests.api import helpers
 from main.tests.test_data_package import clone
@@ -1125,3 +1128,196 @@ class TestForeignKey(helpers.BaseUserTestCase):
             data = resp.json()
             self.assertEqual(data['children'], expected_children_ids)
             self.assertEqual(data['parent'], expected_parent_id)
+
+    def test_list_pages(self):
+        """
+        The parent and children of the records of a list are resolved for the whole page: the number of queries doesn't
+        depend on the number of records.
+        """
+        parent_dataset = self._create_dataset_and_records_from_rows([
+            ['Survey ID', 'Where'],
+            ['ID-001', 'King\'s Park'],
+            ['ID-002', 'Cottesloe'],
+        ])
+        parent_dataset.data_package['resources'][0]['schema']['primaryKey'] = 'Survey ID'
+        parent_dataset.save()
+        child_schema = helpers.create_schema_from_fields([
+            {
+                "name": "Survey ID",
+                "type": "string",
+                "constraints": helpers.REQUIRED_CONSTRAINTS
+            },
+            {
+                "name": "What",
+                "type": "string",
+                "constraints": helpers.NOT_REQUIRED_CONSTRAINTS
+            }
+        ])
+        child_schema['foreignKeys'] = [{
+            'fields': 'Survey ID',
+            'reference': {
+                'fields': 'Survey ID',
+                'resource': parent_dataset.name
+            }
+        }]
+        child_dataset = self._create_dataset_with_schema(self.project_1, self.data_engineer_1_client, child_schema)
+        self._upload_records_from_rows([
+            ['Survey ID', 'What'],
+            ['ID-001', 'Canis lupus'],
+            ['ID-001', 'A frog'],
+            ['ID-003', 'No survey'],
+        ], child_dataset.pk, strict=False)
+        client = self.custodian_1_client
+
+        def get_records(dataset):
+            url = reverse('api:dataset-records', kwargs={'pk': dataset.pk})
+            with CaptureQueriesContext(connection) as context:
+                resp = client.get(url)
+            self.assertEqual(resp.status_code, status.HTTP_200_OK)
+            return resp.json(), len(context.captured_queries)
+
+        parents = dict((r.data['Survey ID'], r.pk) for r in parent_dataset.record_set.all())
+        children = dict((r.data['What'], r.pk) for r in child_dataset.record_set.all())
+        # the project dataset graph is cached after the first request
+        get_records(parent_dataset)
+        records, parent_queries = get_records(parent_dataset)
+        self.assertEqual(
+            [('ID-001', None, sorted([children['Canis lupus'], children['A frog']])), ('ID-002', None, [])],
+            [(r['data']['Survey ID'], r['parent'], r['children']) for r in records]
+        )
+        records, child_queries = get_records(child_dataset)
+        self.assertEqual(
+            [('Canis lupus', parents['ID-001'], None), ('A frog', parents['ID-001'], None), ('No survey', None, None)],
+            [(r['data']['What'], r['parent'], r['children']) for r in records]
+        )
+        # same as the record end-point
+        for record in records:
+            resp = client.get(reverse('api:record-detail', kwargs={'pk': record['id']}))
+            self.assertEqual((record['parent'], record['children']), (resp.json()['parent'], resp.json()['children']))
+
+        # more records, same number of queries
+        self._upload_records_from_rows([
+            ['Survey ID', 'Where'],
+            ['ID-004', 'Perth'],
+            ['ID-005', 'Fremantle'],
+        ], parent_dataset.pk, strict=False)
+        self._upload_records_from_rows([
+            ['Survey ID', 'What'],
+            ['ID-004', 'A bird'],
+            ['ID-005', 'A cat'],
+        ], child_dataset.pk, strict=False)
+        records, queries = get_records(parent_dataset)
+        self.assertEqual(4, len(records))
+        self.assertEqual(parent_queries, queries)
+        records, queries = get_records(child_dataset)
+        self.assertEqual(5, len(records))
+        self.assertEqual(child_queries, queries)
+
+    def test_record_links(self):
+        """
+        The parent/child links are maintained by the record writes and the dataset saves.
+        """
+        parent_dataset = self._create_dataset_and_records_from_rows([
+            ['Survey ID', 'Where'],
+            ['ID-001', 'King\'s Park'],
+            ['ID-002', 'Cottesloe'],
+        ])
+        child_schema = helpers.create_schema_from_fields([
+            {
+                "name": "Survey ID",
+                "type": "string",
+                "constraints": helpers.REQUIRED_CONSTRAINTS
+            },
+            {
+                "name": "What",
+                "type": "string",
+                "constraints": helpers.NOT_REQUIRED_CONSTRAINTS
+            }
+        ])
+        child_schema['foreignKeys'] = [{
+            'fields': 'Survey ID',
+            'reference': {
+                'fields': 'Survey ID',
+                'resource': parent_dataset.name
+            }
+        }]
+        child_dataset = self._create_dataset_with_schema(self.project_1, self.data_engineer_1_client, child_schema)
+        self._upload_records_from_rows([
+            ['Survey ID', 'What'],
+            ['ID-001', 'Canis lupus'],
+            ['ID-003', 'A frog'],
+        ], child_dataset.pk, strict=False)
+        parents = dict((r.data['Survey ID'], r) for r in parent_dataset.record_set.all())
+        children = dict((r.data['What'], r) for r in child_dataset.record_set.all())
+
+        def get_links():
+            return sorted(
+                (link.child_id, link.parent_id, link.fk_name) for link in RecordLink.objects.filter(
+                    child__dataset=child_dataset)
+            )
+
+        self.assertEqual([(children['Canis lupus'].pk, parents['ID-001'].pk, 'Survey ID')], get_links())
+        self.assertEqual([parents['ID-001']], list(children['Canis lupus'].parents))
+        # no primary key in the parent dataset
+        self.assertIsNone(parents['ID-001'].children)
+
+        # a new parent record links the existing children
+        self._upload_records_from_rows([
+            ['Survey ID', 'Where'],
+            ['ID-003', 'Perth'],
+        ], parent_dataset.pk, strict=False)
+        parents['ID-003'] = parent_dataset.record_set.get(data__contains={'Survey ID': 'ID-003'})
+        self.assertEqual(
+            sorted([
+                (children['Canis lupus'].pk, parents['ID-001'].pk, 'Survey ID'),
+                (children['A frog'].pk, parents['ID-003'].pk, 'Survey ID')
+            ]),
+            get_links()
+        )
+
+        # a record update moves its links
+        record = children['Canis lupus']
+        url = reverse('api:record-detail', kwargs={'pk': record.pk})
+        data = clone(record.data)
+        data['Survey ID'] = 'ID-002'
+        resp = self.custodian_1_client.patch(url, data={'data': data}, format='json')
+        self.assertEqual(resp.status_code, status.HTTP_200_OK)
+        self.assertEqual(parents['ID-002'].pk, resp.json()['parent'])
+        self.assertEqual([parents['ID-002']], list(record.parents))
+
+        # a change of the other fields doesn't touch the links
+        data['What'] = 'Canis familiaris'
+        with CaptureQueriesContext(connection) as captured:
+            resp = self.custodian_1_client.patch(url, data={'data': data}, format='json')
+        self.assertEqual(resp.status_code, status.HTTP_200_OK)
+        # the response reads the links
+        self.assertFalse([query for query in captured.captured_queries if RecordLink._meta.db_table in query['sql'] and
+                          not query['sql'].startswith('SELECT')])
+        self.assertEqual([parents['ID-002']], list(record.parents))
+
+        # a record delete removes its links
+        parents['ID-002'].delete()
+        self.assertEqual([(children['A frog'].pk, parents['ID-003'].pk, 'Survey ID')], get_links())
+
+        # the children need a parent primary key
+        parent_dataset.data_package['resources'][0]['schema']['primaryKey'] = 'Survey ID'
+        parent_dataset.save()
+        self.assertEqual([children['A frog']], list(parents['ID-003'].children))
+
+        # the links are not rebuilt on a description change
+        with CaptureQueriesContext(connection) as captured:
+            child_dataset.description = 'A new description'
+            child_dataset.save()
+        self.assertFalse([query for query in captured.captured_queries if RecordLink._meta.db_table in query['sql']])
+
+        # a schema without the foreign key
+        del child_dataset.data_package['resources'][0]['schema']['foreignKeys']
+        child_dataset.save()
+        self.assertEqual([], get_links())
+
+        # the rebuild
+        child_dataset.data_package['resources'][0]['schema']['foreignKeys'] = child_schema['foreignKeys']
+        Dataset.objects.filter(pk=child_dataset.pk).update(data_package=child_dataset.data_package)
+        self.assertEqual([], get_links())
+        call_command('rebuild_record_links', datasets=[child_dataset.pk], stdout=six.StringIO())
+        self.assertEqual([(children['A frog'].pk, parents['ID-003'].pk, 'Survey ID')], get_links())
@@ -1,14 +1,20 @@
 import datetime
+import json
 from os import path
 
 from django.contrib.gis.geos import Point
+from django.core.files import File
+from django.core.management import call_command
 from django.core.urlresolvers import reverse
-from django.utils import timezone
+from django.test import override_settings
+from django.utils import six, timezone
 from rest_framework import status
 
+from main.api.uploaders import FileReader, RecordCreator, iter_upload_results
 from main.models import Dataset, Site
 from main.tests import factories
 from main.tests.api import helpers
+from main.utils_data_package import ObservationSchema
 
 
 class TestPermission(helpers.BaseUserTestCase):
@@ -205,6 +211,79 @@ class TestGenericRecord(helpers.BaseUserTestCase):
             self.assertEqual(self.project_1.record_count, len(csv_data) - 1)
             self.assertEqual(self.ds.record_count, len(csv_data) - 1)
 
+    def test_upload_xlsx_dates(self):
+        """
+        The xlsx date cells are formatted with the DATE_FORMAT setting.
+        """
+        csv_data = [
+            ['Column A', 'Column B'],
+            [datetime.datetime(2018, 2, 1), 'B1'],
+            ['A2', datetime.datetime(2017, 12, 31, 10, 30)]
+        ]
+        file_ = helpers.rows_to_xlsx_file(csv_data)
+        client = self.custodian_1_client
+        with open(file_, 'rb') as fp:
+            data = {
+                'file': fp,
+                'strict': True  # upload in strict mode
+            }
+            resp = client.post(self.url, data=data, format='multipart')
+            self.assertEqual(status.HTTP_200_OK, resp.status_code)
+            qs = self.ds.record_queryset.order_by('pk')
+            self.assertEqual(len(csv_data) - 1, qs.count())
+            self.assertEqual({'Column A': '01/02/2018', 'Column B': 'B1'}, qs[0].data)
+            self.assertEqual({'Column A': 'A2', 'Column B': '31/12/2017'}, qs[1].data)
+
+    def test_upload_xlsx_trailing_empty_rows(self):
+        """
+        The empty rows at the end of a sheet are ignored. An empty row followed by a row with values is not.
+        """
+        csv_data = [
+            ['Column A', 'Column B'],
+            ['A1', 'B1'],
+            ['', ''],
+            ['A3', 'B3'],
+            ['', ''],
+            ['', ''],
+        ]
+        file_ = helpers.rows_to_xlsx_file(csv_data)
+        client = self.custodian_1_client
+        with open(file_, 'rb') as fp:
+            data = {
+                'file': fp,
+                'strict': True  # upload in strict mode
+            }
+            resp = client.post(self.url, data=data, format='multipart')
+            self.assertEqual(status.HTTP_400_BAD_REQUEST, resp.status_code)
+            results = resp.json()
+            self.assertEqual([2, 3, 4], [r['row'] for r in results])
+            self.assertIn('Column B', results[1].get('errors'))
+            self.assertEqual(['B1', 'B3'], [r.data['Column B'] for r in self.ds.record_queryset.order_by('pk')])
+
+    def test_xlsx_reader(self):
+        """
+        The xlsx reader skips the blank columns and closes the file once read. Reading it again yields no rows.
+        """
+        csv_data = [
+            ['Column A', '', 'Column B'],
+            ['A1', 'something', datetime.datetime(2018, 2, 1)],
+            ['A2', None, 'B2'],
+            [None, None, None],
+        ]
+        file_ = helpers.rows_to_xlsx_file(csv_data)
+        with open(file_, 'rb') as fp:
+            uploaded_file = File(fp, name='records.xlsx')
+            uploaded_file.content_type = FileReader.XLSX_TYPES[0]
+            reader = FileReader(uploaded_file)
+            self.assertEqual(['Column A', '', 'Column B'], reader.reader.fieldnames)
+            expected = [
+                {'Column A': 'A1', 'Column B': '01/02/2018'},
+                {'Column A': 'A2', 'Column B': 'B2'},
+            ]
+            self.assertEqual(expected, list(reader))
+            self.assertTrue(fp.closed)
+            self.assertEqual([], list(reader))
+
     def test_unicode(self):
         """
         Test that unicode characters works
@@ -336,6 +415,301 @@ class TestGenericRecord(helpers.BaseUserTestCase):
         self.assertEqual(resp.status_code, status.HTTP_400_BAD_REQUEST)
 
 
+    @override_settings(RECORD_UPLOAD_BATCH_SIZE=2)
+    def test_upload_batched(self):
+        """
+        Records are saved in chunks but every row should still get its own recordId or errors
+        """
+        csv_data = [
+            ['Column A', 'Column B'],
+            ['A1', 'B1'],
+            ['A2', 'B2'],
+            ['A3', ''],  # Column B is required
+            ['A4', 'B4'],
+            ['A5', 'B5'],
+        ]
+        file_ = helpers.rows_to_csv_file(csv_data)
+        client = self.custodian_1_client
+        self.assertEqual(0, self.ds.record_queryset.count())
+        with open(file_) as fp:
+            data = {
+                'file': fp,
+                'strict': True  # upload in strict mode
+            }
+            resp = client.post(self.url, data=data, format='multipart')
+            self.assertEqual(status.HTTP_400_BAD_REQUEST, resp.status_code)
+            results = resp.json()
+            self.assertEqual(len(csv_data) - 1, len(results))
+            self.assertEqual([r['row'] for r in results], [2, 3, 4, 5, 6])
+            # the invalid row
+            error_result = results[2]
+            self.assertIsNone(error_result.get('recordId'))
+            self.assertIn('Column B', error_result.get('errors'))
+            # the valid ones
+            valid_results = [r for r in results if not r.get('errors')]
+            self.assertEqual(4, len(valid_results))
+            self.assertEqual(4, self.ds.record_queryset.count())
+            for result in valid_results:
+                record = self.ds.record_queryset.filter(pk=result.get('recordId')).first()
+                self.assertIsNotNone(record)
+                self.assertEqual(record.source_info.get('row'), result.get('row'))
+                expected_data = dict(zip(csv_data[0], csv_data[result.get('row') - 1]))
+                self.assertEqual(expected_data, record.data)
+
+    def test_upload_summary_report(self):
+        """
+        With report=summary the errors are grouped by column and message.
+        """
+        csv_data = [
+            ['Column A', 'Column B'],
+            ['A1', 'B1'],
+            ['A2', ''],  # Column B is required
+            ['A3', 'B3'],
+            ['A4', ''],
+        ]
+        file_ = helpers.rows_to_csv_file(csv_data)
+        client = self.custodian_1_client
+        with open(file_) as fp:
+            data = {
+                'file': fp,
+                'strict': True,  # upload in strict mode
+                'report': 'summary'
+            }
+            resp = client.post(self.url, data=data, format='multipart')
+            self.assertEqual(status.HTTP_400_BAD_REQUEST, resp.status_code)
+            report = resp.json()
+            self.assertEqual(4, report.get('rowCount'))
+            self.assertEqual(2, report.get('recordCount'))
+            self.assertEqual(2, report.get('errorRowCount'))
+            self.assertEqual(1, len(report.get('errors')))
+            error = report.get('errors')[0]
+            self.assertEqual('Column B', error.get('column'))
+            self.assertEqual(2, error.get('count'))
+            self.assertEqual([3, 5], error.get('rows'))
+            self.assertEqual(2, self.ds.record_queryset.count())
+
+    def test_upload_streamed(self):
+        """
+        With the ndjson media type the row results are streamed, followed by a status line.
+        """
+        csv_data = [
+            ['Column A', 'Column B'],
+            ['A1', 'B1'],
+            ['A2', ''],  # Column B is required
+            ['A3', 'B3'],
+        ]
+        file_ = helpers.rows_to_csv_file(csv_data)
+        client = self.custodian_1_client
+        with open(file_) as fp:
+            data = {
+                'file': fp,
+                'strict': True  # upload in strict mode
+            }
+            resp = client.post(self.url, data=data, format='multipart', HTTP_ACCEPT='application/x-ndjson')
+            self.assertEqual(status.HTTP_200_OK, resp.status_code)
+            self.assertTrue(resp.streaming)
+            self.assertEqual('application/x-ndjson', resp['Content-Type'])
+            lines = b''.join(resp.streaming_content).decode('utf-8').splitlines()
+            results = [json.loads(line) for line in lines]
+            self.assertEqual(len(csv_data), len(results))
+            self.assertEqual([r.get('row') for r in results[:-1]], [2, 3, 4])
+            self.assertIsNotNone(results[0].get('recordId'))
+            self.assertIn('Column B', results[1].get('errors'))
+            final = results[-1]
+            self.assertEqual('error', final.get('status'))
+            self.assertEqual(status.HTTP_400_BAD_REQUEST, final.get('statusCode'))
+            self.assertEqual(3, final.get('rowCount'))
+            self.assertEqual(1, final.get('errorCount'))
+            self.assertEqual(2, self.ds.record_queryset.count())
+
+    @override_settings(RECORD_UPLOAD_BATCH_SIZE=2)
+    def test_upload_create_site_batched(self):
+        """
+        With the create_site option, the missing sites are created once per code and the existing ones reused.
+        """
+        fields = self.fields + [
+            {
+                "name": "Site Code",
+                "type": "string",
+                "biosys": {
+                    "type": "siteCode"
+                }
+            }
+        ]
+        dataset = factories.DatasetFactory(
+            project=self.project_1,
+            type=Dataset.TYPE_GENERIC,
+            data_package=helpers.create_data_package_from_fields(fields))
+        existing_site = factories.SiteFactory(project=self.project_1, code='EXISTING')
+        site_count = Site.objects.filter(project=self.project_1).count()
+        csv_data = [
+            ['Column A', 'Column B', 'Site Code'],
+            ['A1', 'B1', 'NEW1'],
+            ['A2', 'B2', 'EXISTING'],
+            ['A3', 'B3', 'NEW1'],
+            ['A4', 'B4', 'NEW2'],
+            ['A5', 'B5', 'NEW2'],
+        ]
+        file_ = helpers.rows_to_csv_file(csv_data)
+        client = self.custodian_1_client
+        url = reverse('api:dataset-upload', kwargs={'pk': dataset.pk})
+        with open(file_) as fp:
+            data = {
+                'file': fp,
+                'create_site': True
+            }
+            resp = client.post(url, data=data, format='multipart')
+            self.assertEqual(status.HTTP_200_OK, resp.status_code)
+        # NEW1 and NEW2
+        self.assertEqual(site_count + 2, Site.objects.filter(project=self.project_1).count())
+        records = dataset.record_queryset.order_by('pk')
+        self.assertEqual(len(csv_data) - 1, records.count())
+        for record, row in zip(records, csv_data[1:]):
+            self.assertIsNotNone(record.site)
+            self.assertEqual(row[2], record.site.code)
+        self.assertEqual(existing_site, records[1].site)
+        self.assertEqual(records[0].site, records[2].site)
+
+    def test_upload_upsert(self):
+        """
+        With the upsert option the rows are matched to the existing records by primary key.
+        """
+        fields = [
+            {
+                "name": "Id",
+                "type": "integer",
+                "constraints": helpers.REQUIRED_CONSTRAINTS
+            },
+            {
+                "name": "Column B",
+                "type": "string",
+                "constraints": helpers.NOT_REQUIRED_CONSTRAINTS
+            }
+        ]
+        schema = helpers.create_schema_from_fields(fields)
+        schema['primaryKey'] = 'Id'
+        dataset = factories.DatasetFactory(
+            project=self.project_1,
+            type=Dataset.TYPE_GENERIC,
+            data_package=helpers.create_data_package_from_schema(schema))
+        url = reverse('api:dataset-upload', kwargs={'pk': dataset.pk})
+        client = self.custodian_1_client
+        file_ = helpers.rows_to_csv_file([
+            ['Id', 'Column B'],
+            ['1', 'B1'],
+            ['2', 'B2'],
+            ['3', 'B3'],
+        ])
+        with open(file_) as fp:
+            resp = client.post(url, data={'file': fp, 'upsert': True}, format='multipart')
+            self.assertEqual(status.HTTP_200_OK, resp.status_code)
+            self.assertEqual(['created'] * 3, [r.get('action') for r in resp.json()])
+        ids_by_key = {r.data['Id']: r.pk for r in dataset.record_queryset.all()}
+        self.assertEqual({1, 2, 3}, set(ids_by_key.keys()))
+
+        # 1 unchanged, 2 updated, 3 missing, 4 new
+        file_ = helpers.rows_to_csv_file([
+            ['Id', 'Column B'],
+            ['1', 'B1'],
+            ['2', 'B2 updated'],
+            ['4', 'B4'],
+        ])
+        with open(file_) as fp:
+            data = {'file': fp, 'upsert': True, 'delete_missing': True, 'report': 'summary'}
+            resp = client.post(url, data=data, format='multipart')
+            self.assertEqual(status.HTTP_200_OK, resp.status_code)
+            report = resp.json()
+            self.assertEqual(1, report.get('createdCount'))
+            self.assertEqual(1, report.get('updatedCount'))
+            self.assertEqual(1, report.get('unchangedCount'))
+            self.assertEqual(1, report.get('deletedCount'))
+        records = {r.data['Id']: r for r in dataset.record_queryset.all()}
+        self.assertEqual({1, 2, 4}, set(records.keys()))
+        self.assertEqual(ids_by_key[1], records[1].pk)
+        self.assertEqual(ids_by_key[2], records[2].pk)
+        self.assertEqual('B2 updated', records[2].data['Column B'])
+
+        # nothing is deleted for a file without keys or with a failed row
+        for rows in [[], [['', 'B']], [['4', 'B4'], ['x', 'B']]]:
+            with open(helpers.rows_to_csv_file([['Id', 'Column B']] + rows)) as fp:
+                data = {'file': fp, 'upsert': True, 'delete_missing': True, 'report': 'summary'}
+                resp = client.post(url, data=data, format='multipart')
+                self.assertEqual(0, resp.json().get('deletedCount'))
+            self.assertEqual({1, 2, 4}, set(r.data['Id'] for r in dataset.record_queryset.all()))
+
+        # duplicate key in the file
+        file_ = helpers.rows_to_csv_file([
+            ['Id', 'Column B'],
+            ['5', 'B5'],
+            ['5', 'B5 again'],
+        ])
+        with open(file_) as fp:
+            resp = client.post(url, data={'file': fp, 'upsert': True}, format='multipart')
+            self.assertEqual(status.HTTP_400_BAD_REQUEST, resp.status_code)
+            self.assertIn('Id', resp.json()[1].get('errors'))
+        self.assertEqual(1, dataset.record_queryset.filter(data__Id=5).count())
+
+        # no upsert without primary key
+        with open(file_) as fp:
+            resp = client.post(self.url, data={'file': fp, 'upsert': True}, format='multipart')
+            self.assertEqual(status.HTTP_400_BAD_REQUEST, resp.status_code)
+
+    def test_upload_upsert_composite_key(self):
+        """
+        A composite primary key on a schema without string fields. The missing keys are found in SQL.
+        """
+        fields = [
+            {
+                "name": "Site",
+                "type": "integer",
+                "constraints": helpers.REQUIRED_CONSTRAINTS
+            },
+            {
+                "name": "Visit",
+                "type": "integer",
+                "constraints": helpers.REQUIRED_CONSTRAINTS
+            },
+            {
+                "name": "Count",
+                "type": "number",
+                "constraints": helpers.NOT_REQUIRED_CONSTRAINTS
+            }
+        ]
+        schema = helpers.create_schema_from_fields(fields)
+        schema['primaryKey'] = ['Site', 'Visit']
+        dataset = factories.DatasetFactory(
+            project=self.project_1,
+            type=Dataset.TYPE_GENERIC,
+            data_package=helpers.create_data_package_from_schema(schema))
+        url = reverse('api:dataset-upload', kwargs={'pk': dataset.pk})
+        client = self.custodian_1_client
+        file_ = helpers.rows_to_csv_file([
+            ['Site', 'Visit', 'Count'],
+            ['1', '1', '10'],
+            ['1', '2', '12'],
+            ['2', '1', '20'],
+        ])
+        with open(file_) as fp:
+            resp = client.post(url, data={'file': fp, 'upsert': True}, format='multipart')
+            self.assertEqual(status.HTTP_200_OK, resp.status_code)
+
+        # (1, 2) updated, (2, 1) missing
+        file_ = helpers.rows_to_csv_file([
+            ['Site', 'Visit', 'Count'],
+            ['1', '1', '10'],
+            ['1', '2', '13.5'],
+        ])
+        with open(file_) as fp:
+            data = {'file': fp, 'upsert': True, 'delete_missing': True, 'report': 'summary'}
+            resp = client.post(url, data=data, format='multipart')
+            self.assertEqual(status.HTTP_200_OK, resp.status_code)
+            report = resp.json()
+            self.assertEqual(1, report.get('updatedCount'))
+            self.assertEqual(1, report.get('unchangedCount'))
+            self.assertEqual(1, report.get('deletedCount'))
+        records = {(r.data['Site'], r.data['Visit']): r.data['Count'] for r in dataset.record_queryset.all()}
+        self.assertEqual({(1, 1): 10, (1, 2): 13.5}, records)
+
 class TestObservation(helpers.BaseUserTestCase):
     all_fields_nothing_required = [
         {
@@ -470,3 +844,164 @@ class TestObservation(helpers.BaseUserTestCase):
             expected_date = datetime.date(2017, 6, 4)
             self.assertEqual(timezone.localtime(record.datetime).date(), expected_date)
             self.assertEqual(record.geometry, self.site.geometry)
+
+    def test_site_from_other_project(self):
+        """
+        The site geometry lookup must be scoped to the dataset project.
+        """
+        other_site = factories.SiteFactory(project=self.project_2, code='OTHER', geometry=Point(116.0, -31.0))
+        csv_data = [
+            ['What', 'Site'],
+            ['Same project', self.site.code],
+            ['Other project', other_site.code],
+            ['Same project again', self.site.code]
+        ]
+        file_ = helpers.rows_to_xlsx_file(csv_data)
+        client = self.custodian_1_client
+        with open(file_, 'rb') as fp:
+            data = {
+                'file': fp,
+                'strict': True  # upload in strict mode
+            }
+            resp = client.post(self.url, data=data, format='multipart')
+            self.assertEqual(status.HTTP_400_BAD_REQUEST, resp.status_code)
+            results = resp.json()
+            self.assertEqual(3, len(results))
+            self.assertFalse(results[0].get('errors'))
+            self.assertIn('Site', results[1].get('errors'))
+            self.assertFalse(results[2].get('errors'))
+            records = self.dataset.record_queryset.all()
+            self.assertEqual(2, len(records))
+            for record in records:
+                self.assertEqual(self.site.geometry, record.geometry)
+
+    def test_dataset_schema_site_scope(self):
+        """
+        The schema of a dataset only resolves the sites of its project, whoever uses it.
+        """
+        other_site = factories.SiteFactory(project=self.project_2, code='OTHER', geometry=Point(116.0, -31.0))
+        schema = self.dataset.schema
+        self.assertEqual((True, self.site.geometry), schema.site_geometry_resolver.resolve(self.site.code))
+        self.assertEqual((False, None), schema.site_geometry_resolver.resolve(other_site.code))
+        self.assertEqual((False, None), schema.copy().site_geometry_resolver.resolve(other_site.code))
+        # the dataset keeps its resolver: the sites are not fetched again through another schema
+        self.assertIs(schema.site_geometry_resolver, self.dataset.schema.site_geometry_resolver)
+        with self.assertNumQueries(0):
+            self.assertEqual((True, self.site.geometry), self.dataset.schema.site_geometry_resolver.resolve(
+                self.site.code))
+        # no project, no site lookup
+        schema = ObservationSchema(self.dataset.schema_data)
+        self.assertIsNone(schema.site_geometry_resolver)
+        with self.assertRaises(Exception):
+            schema.cast_geometry({'Site': self.site.code})
+
+    def test_dry_run_sites(self):
+        """
+        Without commit the records get the site that is matched or the site that would be created. Nothing is saved.
+        """
+        csv_data = [
+            ['What', 'When', 'Site', 'Latitude', 'Longitude'],
+            ['Existing', '04/06/2017', self.site.code, '', ''],
+            ['New', '05/06/2017', 'NEW', -32.0, 115.75],
+            ['New again', '06/06/2017', 'NEW', -32.0, 115.75],
+        ]
+        file_ = helpers.rows_to_csv_file(csv_data)
+        with open(file_, 'rb') as fp:
+            uploaded_file = File(fp, name='records.csv')
+            uploaded_file.content_type = FileReader.CSV_TYPES[0]
+            creator = RecordCreator(self.dataset, FileReader(uploaded_file), commit=False, create_site=True)
+            results = list(creator)
+        self.assertEqual([True, True, True], [validator_result.is_valid for _, validator_result in results])
+        sites = [record.site for record, _ in results]
+        self.assertEqual(self.site, sites[0])
+        self.assertEqual(self.site.pk, results[0][0].site_id)
+        self.assertEqual('NEW', sites[1].code)
+        self.assertEqual(self.project, sites[1].project)
+        self.assertIsNone(sites[1].pk)
+        self.assertIs(sites[1], sites[2])
+        self.assertFalse(Site.objects.filter(project=self.project, code='NEW').exists())
+        self.assertEqual(0, self.dataset.record_queryset.count())
+
+    @override_settings(RECORD_UPLOAD_PROCESSES=2, RECORD_UPLOAD_BATCH_SIZE=3)
+    def test_upload_multi_process(self):
+        """
+        The process pool is never forked from a web request (RECORD_UPLOAD_PROCESSES is for the upload jobs) or
+        inside a transaction. The results should be the same and in the same order as a serial upload.
+        """
+        class NoPoolRecordCreator(RecordCreator):
+            def _iter_prepared_rows_parallel(self, context):
+                raise AssertionError("The process pool shouldn't be used inside a transaction.")
+
+        csv_data = [['What', 'When', 'Latitude', 'Longitude']]
+        for i in range(10):
+            csv_data.append(['Row {}'.format(i), '0{}/06/2017'.format(i % 9 + 1), -32.0 - i, 115.75])
+        # invalid latitude
+        csv_data[5][2] = -100
+        file_ = helpers.rows_to_csv_file(csv_data)
+        client = self.custodian_1_client
+        with open(file_) as fp:
+            data = {
+                'file': fp,
+                'strict': True  # upload in strict mode
+            }
+            resp = client.post(self.url, data=data, format='multipart')
+            self.assertEqual(status.HTTP_400_BAD_REQUEST, resp.status_code)
+            results = resp.json()
+            self.assertEqual([r['row'] for r in results], list(range(2, 12)))
+            self.assertIn('Latitude', results[4].get('errors'))
+            self.assertIsNone(results[4].get('recordId'))
+            self.assertEqual(9, self.dataset.record_queryset.count())
+            for result in [r for r in results if not r.get('errors')]:
+                record = self.dataset.record_queryset.get(pk=result.get('recordId'))
+                expected_row = csv_data[result.get('row') - 1]
+                self.assertEqual(record.data['What'], expected_row[0])
+                self.assertEqual(record.geometry.y, expected_row[2])
+                self.assertEqual(record.geometry.x, expected_row[3])
+                self.assertIsNotNone(record.datetime)
+
+        # the test runs in a transaction: the rows of a creator with processes are validated serially.
+        with open(file_, 'rb') as fp:
+            uploaded_file = File(fp, name='records.csv')
+            uploaded_file.content_type = FileReader.CSV_TYPES[0]
+            creator = NoPoolRecordCreator(self.dataset, FileReader(uploaded_file), commit=False, processes=2)
+            self.assertTrue(creator.is_parallel)
+            results = list(iter_upload_results(creator))
+        self.assertEqual([r['row'] for r in results], list(range(2, 12)))
+        self.assertIn('Latitude', results[4].get('errors'))
+
+    def test_load_records_command(self):
+        """
+        The COPY staging loader builds the same geometry, datetime and site as the upload.
+        """
+        csv_data = [
+            ['What', 'When', 'Site', 'Latitude', 'Longitude'],
+            ['Coordinates', '04/06/2017', '', -32.0, 115.75],
+            ['Site', '05/06/2017', self.site.code, '', ''],
+            ['Unknown site', '06/06/2017', 'UNKNOWN', '', ''],
+            ['Wrong latitude', '07/06/2017', '', -100, 115.75],
+        ]
+        file_ = helpers.rows_to_csv_file(csv_data)
+        out = six.StringIO()
+        call_command('load_records', self.dataset.pk, file_, '--strict', stdout=out)
+        summary = json.loads(out.getvalue())
+        self.assertEqual(4, summary.get('rowCount'))
+        self.assertEqual(2, summary.get('recordCount'))
+        self.assertEqual(2, summary.get('errorRowCount'))
+        error_rows = {}
+        for error in summary.get('errors'):
+            error_rows.setdefault(error['column'], set()).update(error['rows'])
+        self.assertEqual({4}, error_rows.get('Site'))
+        self.assertEqual({4, 5}, error_rows.get('Latitude'))
+        records = self.dataset.record_queryset.order_by('pk')
+        self.assertEqual(2, records.count())
+        record = records[0]
+        self.assertEqual('Coordinates', record.data['What'])
+        self.assertIsNone(record.site)
+        self.assertAlmostEqual(-32.0, record.geometry.y)
+        self.assertAlmostEqual(115.75, record.geometry.x)
+        self.assertEqual(datetime.date(2017, 6, 4), timezone.localtime(record.datetime).date())
+        self.assertEqual(2, record.source_info.get('row'))
+        record = records[1]
+        self.assertEqual(self.site, record.site)
+        self.assertEqual(self.site.geometry, record.geometry)
+        self.assertEqual(datetime.date(2017, 6, 5), timezone.localtime(record.datetime).date())
@@ -4,15 +4,17 @@ from os import path
 import json
 
 from django.contrib.gis.geos import Point
+from django.core.files import File
 from django.core.urlresolvers import reverse
 from django.utils import timezone, six
 from openpyxl import load_workbook
 from rest_framework import status
 
-from main.models import Dataset, Record
+from main.api.uploaders import FileReader, RecordCopyLoader
+from main.models import Dataset, Record, SpeciesSummary
 from main.tests.api import helpers
 from main.tests.test_data_package import clone
-from main.utils_species import NoSpeciesFacade
+from main.utils_species import NoSpeciesFacade, SpeciesIndex
 
 
 class TestPermissions(helpers.BaseUserTestCase):
@@ -878,6 +880,18 @@ class TestSpeciesNameExtraction(helpers.BaseUserTestCase):
         self.assertEqual(record.species_name, 'Canis lupus')
 
 
+class CollidingSpeciesFacade(helpers.LightSpeciesFacade):
+    """
+    Two species names with the same normalised form.
+    """
+
+    def get_species_index(self):
+        index = SpeciesIndex()
+        for species_name, name_id in [('Canis lupus', 25454), ('canis lupus', 1)]:
+            index.add(species_name, name_id)
+        return index
+
+
 class TestNameIDFromSpeciesName(helpers.BaseUserTestCase):
     """
     Test that we retrieve the name id from the species facade
@@ -953,6 +967,52 @@ class TestNameIDFromSpeciesName(helpers.BaseUserTestCase):
             self.assertEqual(ds.record_queryset.count(), 1)
             self.assertEqual(ds.record_queryset.first().name_id, name_id)
 
+    def test_load_records_colliding_names(self):
+        """
+        The COPY loader picks the same name id as the upload when several species names have the same normalised form:
+        the exact name first.
+        """
+        ds = self._create_dataset_with_schema(
+            self.project_1, self.data_engineer_1_client, self.schema_with_species_name(),
+            dataset_type=Dataset.TYPE_SPECIES_OBSERVATION
+        )
+        rows = [['Species Name', 'When', 'Latitude', 'Longitude']]
+        for species_name in ['canis lupus', 'Canis lupus', 'CANIS LUPUS']:
+            rows.append([species_name, '2018-01-31', -32.0, 115.75])
+        with open(helpers.rows_to_csv_file(rows), 'rb') as fp:
+            file_ = File(fp, name='records.csv')
+            file_.content_type = FileReader.CSV_TYPES[0]
+            RecordCopyLoader(ds, FileReader(file_), species_facade_class=CollidingSpeciesFacade).load()
+        index = CollidingSpeciesFacade().get_species_index()
+        expected = dict((name, index.get_name_id(name)) for name in ['canis lupus', 'Canis lupus', 'CANIS LUPUS'])
+        self.assertEqual({'canis lupus': 1, 'Canis lupus': 25454, 'CANIS LUPUS': 25454}, expected)
+        self.assertEqual(expected, dict((r.data['Species Name'], r.name_id) for r in ds.record_queryset.all()))
+        # the species name of the species list
+        self.assertEqual(
+            {'canis lupus': 'canis lupus', 'Canis lupus': 'Canis lupus', 'CANIS LUPUS': 'Canis lupus'},
+            dict((r.data['Species Name'], r.species_name) for r in ds.record_queryset.all())
+        )
+
+    def test_upload_species_name_of_the_species_list(self):
+        """
+        The name lookup ignores the case and the whitespaces, the record gets the name of the species list. The data
+        keeps the name as given.
+        """
+        ds = self._create_dataset_with_schema(
+            self.project_1, self.data_engineer_1_client, self.schema_with_species_name(),
+            dataset_type=Dataset.TYPE_SPECIES_OBSERVATION
+        )
+        rows = [['Species Name', 'When', 'Latitude', 'Longitude']]
+        for species_name in ['canis LUPUS', ' Canis   lupus ', 'Chubby Bat']:
+            rows.append([species_name, '2018-01-31', -32.0, 115.75])
+        resp = self._upload_records_from_rows(rows, dataset_pk=ds.pk, strict=False)
+        self.assertEqual(status.HTTP_200_OK, resp.status_code)
+        self.assertEqual(
+            [('Canis lupus', 25454), ('Canis lupus', 25454), ('Chubby Bat', -1)],
+            [(r.species_name, r.name_id) for r in ds.record_queryset.order_by('id')]
+        )
+        self.assertEqual('canis LUPUS', ds.record_queryset.order_by('id').first().data['Species Name'])
+
     def test_update(self):
         """
         Test that the name_id is retrieved from the species facade from the species_name
@@ -1053,6 +1113,209 @@ class TestNameIDFromSpeciesName(helpers.BaseUserTestCase):
         self.assertEqual(record.name_id, expected_name_id)
 
 
+    def test_upload_species_match(self):
+        """
+        The unknown species names are fuzzy matched once per distinct name and the suggestions above the threshold
+        are accepted.
+        """
+        schema = self.schema_with_species_name()
+        ds = self._create_dataset_with_schema(
+            self.project_1, self.data_engineer_1_client, schema, dataset_type=Dataset.TYPE_SPECIES_OBSERVATION
+        )
+        rows = [
+            ['Species Name', 'When', 'Latitude', 'Longitude'],
+            ['Canis lupis', '2018-01-31', -32.0, 115.75],
+            ['Vespadelus douglasorm', '2018-01-31', -32.0, 115.75],
+            ['Canis lupis', '2018-01-31', -32.0, 115.75],
+            ['Chubby Bat', '2018-01-31', -32.0, 115.75],
+        ]
+        file_ = helpers.rows_to_xlsx_file(rows)
+        url = reverse('api:dataset-upload', kwargs={'pk': ds.pk})
+        with open(file_, 'rb') as fp:
+            payload = {
+                'file': fp,
+                'report': 'summary',
+                'species_match_threshold': 0.8
+            }
+            resp = self.custodian_1_client.post(url, data=payload, format='multipart')
+        self.assertEqual(resp.status_code, status.HTTP_200_OK)
+        matches = {match['speciesName']: match for match in resp.json().get('speciesMatches')}
+        self.assertEqual(['Canis lupis', 'Vespadelus douglasorm', 'Chubby Bat'], list(matches.keys()))
+
+        canis = matches['Canis lupis']
+        self.assertEqual(2, canis['rowCount'])
+        self.assertEqual('Canis lupus', canis['suggestions'][0]['speciesName'])
+        self.assertEqual(25454, canis['suggestions'][0]['nameId'])
+        self.assertIsNone(canis['accepted'])
+
+        vespadelus = matches['Vespadelus douglasorm']
+        self.assertEqual(1, vespadelus['rowCount'])
+        self.assertEqual('Vespadelus douglasorum', vespadelus['accepted']['speciesName'])
+
+        self.assertEqual([], matches['Chubby Bat']['suggestions'])
+
+        self.assertEqual(4, ds.record_queryset.count())
+        self.assertEqual(3, ds.record_queryset.filter(name_id=-1).count())
+        record = ds.record_queryset.get(name_id=24204)
+        self.assertEqual('Vespadelus douglasorum', record.species_name)
+        # the data are not modified
+        self.assertEqual('Vespadelus douglasorm', record.data['Species Name'])
+
+        # wrong threshold
+        with open(file_, 'rb') as fp:
+            resp = self.custodian_1_client.post(url, data={'file': fp, 'species_match_threshold': 2},
+                                                format='multipart')
+        self.assertEqual(resp.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_species_match_end_point(self):
+        url = reverse('api:species-match')
+        resp = self.custodian_1_client.post(url, {'names': ['canis lupis', 'Canis lupis', 'Chubby Bat'], 'limit': 1},
+                                            format='json')
+        self.assertEqual(resp.status_code, status.HTTP_200_OK)
+        data = resp.json()
+        self.assertEqual(['canis lupis', 'Canis lupis', 'Chubby Bat'], [match['speciesName'] for match in data])
+        self.assertEqual([{'speciesName': 'Canis lupus', 'nameId': 25454, 'score': 0.783}], data[0]['suggestions'])
+        self.assertEqual([], data[2]['suggestions'])
+
+        resp = self.custodian_1_client.post(url, {'names': 'Canis lupis'}, format='json')
+        self.assertEqual(resp.status_code, status.HTTP_400_BAD_REQUEST)
+
+
+class TestSpeciesSummary(helpers.BaseUserTestCase):
+    """
+    The species summary table is kept up to date on record create, update, delete and upload.
+    """
+    species_facade_class = helpers.LightSpeciesFacade
+
+    def _more_setup(self):
+        from main.api.views import SpeciesMixin
+        SpeciesMixin.species_facade_class = self.species_facade_class
+
+    def _create_dataset(self, project, client):
+        return self._create_dataset_with_schema(
+            project, client, TestNameIDFromSpeciesName.schema_with_species_name(),
+            dataset_type=Dataset.TYPE_SPECIES_OBSERVATION
+        )
+
+    def get_summary(self, dataset):
+        tz = dataset.project.timezone
+        return {
+            (s.species_name, s.name_id): (
+                s.record_count,
+                timezone.localtime(s.first_observation, tz).date(),
+                timezone.localtime(s.last_observation, tz).date()
+            ) for s in SpeciesSummary.objects.filter(dataset=dataset)
+        }
+
+    def test_record_create_update_delete(self):
+        ds = self._create_dataset(self.project_1, self.data_engineer_1_client)
+        client = self.custodian_1_client
+        url = reverse('api:record-list')
+        record_ids = []
+        for species_name, when in [('Canis lupus', '2018-01-31'), ('Canis lupus', '2017-06-30'),
+                                   ('Chubby Bat', '2018-02-01')]:
+            payload = {
+                'dataset': ds.pk,
+                'data': {
+                    'Species Name': species_name,
+                    'When': when,
+                    'Latitude': -32.0,
+                    'Longitude': 115.75
+                }
+            }
+            resp = client.post(url, payload, format='json')
+            self.assertEqual(resp.status_code, status.HTTP_201_CREATED)
+            record_ids.append(resp.json()['id'])
+        self.assertEqual({
+            ('Canis lupus', 25454): (2, datetime.date(2017, 6, 30), datetime.date(2018, 1, 31)),
+            ('Chubby Bat', -1): (1, datetime.date(2018, 2, 1), datetime.date(2018, 2, 1)),
+        }, self.get_summary(ds))
+
+        # update the species of the first record
+        payload = {
+            'data': {
+                'Species Name': 'Vespadelus douglasorum',
+                'When': '2018-01-31',
+                'Latitude': -32.0,
+                'Longitude': 115.75
+            }
+        }
+        resp = client.patch(reverse('api:record-detail', kwargs={'pk': record_ids[0]}), payload, format='json')
+        self.assertEqual(resp.status_code, status.HTTP_200_OK)
+        self.assertEqual({
+            ('Canis lupus', 25454): (1, datetime.date(2017, 6, 30), datetime.date(2017, 6, 30)),
+            ('Vespadelus douglasorum', 24204): (1, datetime.date(2018, 1, 31), datetime.date(2018, 1, 31)),
+            ('Chubby Bat', -1): (1, datetime.date(2018, 2, 1), datetime.date(2018, 2, 1)),
+        }, self.get_summary(ds))
+
+        # delete
+        resp = client.delete(reverse('api:record-detail', kwargs={'pk': record_ids[2]}))
+        self.assertEqual(resp.status_code, status.HTTP_204_NO_CONTENT)
+        self.assertEqual({('Canis lupus', 25454), ('Vespadelus douglasorum', 24204)}, set(self.get_summary(ds)))
+
+        # bulk delete
+        resp = client.delete(reverse('api:dataset-records', kwargs={'pk': ds.pk}), data='all', format='json')
+        self.assertEqual(resp.status_code, status.HTTP_204_NO_CONTENT)
+        self.assertEqual({}, self.get_summary(ds))
+
+    def test_upload_and_species_view(self):
+        ds_1 = self._create_dataset(self.project_1, self.data_engineer_1_client)
+        rows = [
+            ['Species Name', 'When', 'Latitude', 'Longitude'],
+            ['Canis lupus', '2018-01-31', -32.0, 115.75],
+            ['Vespadelus douglasorum', '2018-01-31', -32.0, 115.75],
+            ['Canis lupus', '2016-01-31', -32.0, 115.75],
+        ]
+        resp = self._upload_records_from_rows(rows, dataset_pk=ds_1.pk)
+        self.assertEqual(resp.status_code, status.HTTP_200_OK)
+        self.assertEqual({
+            ('Canis lupus', 25454): (2, datetime.date(2016, 1, 31), datetime.date(2018, 1, 31)),
+            ('Vespadelus douglasorum', 24204): (1, datetime.date(2018, 1, 31), datetime.date(2018, 1, 31)),
+        }, self.get_summary(ds_1))
+
+        ds_2 = self._create_dataset(self.project_2, self.data_engineer_2_client)
+        rows = [
+            ['Species Name', 'When', 'Latitude', 'Longitude'],
+            ['Canis lupus', '2018-01-31', -32.0, 115.75],
+            ['Chubby Bat', '2018-01-31', -32.0, 115.75],
+        ]
+        file_ = helpers.rows_to_xlsx_file(rows)
+        with open(file_, 'rb') as fp:
+            resp = self.custodian_2_client.post(reverse('api:dataset-upload', kwargs={'pk': ds_2.pk}),
+                                                data={'file': fp}, format='multipart')
+        self.assertEqual(resp.status_code, status.HTTP_200_OK)
+
+        url = reverse('api:species')
+        client = self.custodian_1_client
+        self.assertEqual(['Canis lupus', 'Chubby Bat', 'Vespadelus douglasorum'], client.get(url).json())
+        self.assertEqual(['Canis lupus', 'Vespadelus douglasorum'],
+                         client.get(url, {'project': self.project_1.pk}).json())
+        self.assertEqual(['Canis lupus', 'Vespadelus douglasorum'], client.get(url, {'strict': 'true'}).json())
+        self.assertEqual(['Chubby Bat'], client.get(url, {'search': 'bat'}).json())
+        # paging
+        data = client.get(url, {'limit': 2, 'offset': 1}).json()
+        self.assertEqual(3, data['count'])
+        self.assertEqual(['Chubby Bat', 'Vespadelus douglasorum'], data['results'])
+        # details
+        data = client.get(url, {'details': 'true', 'search': 'canis'}).json()
+        self.assertEqual(1, len(data))
+        self.assertEqual('Canis lupus', data[0]['speciesName'])
+        self.assertEqual(25454, data[0]['nameId'])
+        self.assertEqual(3, data[0]['recordCount'])
+        self.assertEqual(sorted([ds_1.pk, ds_2.pk]), data[0]['datasetIds'])
+        self.assertTrue(data[0]['firstObservation'].startswith('2016-01-3'))
+
+        self.assertEqual(client.get(url, {'project': 'one'}).status_code, status.HTTP_400_BAD_REQUEST)
+
+        # the summary of a deleted dataset is deleted
+        ds_2.delete()
+        self.assertEqual(['Canis lupus', 'Vespadelus douglasorum'], client.get(url).json())
+        # rebuild
+        SpeciesSummary.objects.all().delete()
+        SpeciesSummary.rebuild()
+        self.assertEqual(2, SpeciesSummary.objects.count())
+
+
 class TestExport(helpers.BaseUserTestCase):
 
     def setUp(self):
@@ -0,0 +1,167 @@
+import datetime
+
+from django.core.urlresolvers import reverse
+from django.utils import timezone
+from rest_framework import status
+
+from main.api.uploaders import UploadJobRunner
+from main.models import Dataset, UploadJob
+from main.tests import factories
+from main.tests.api import helpers
+
+
+class TestUploadJob(helpers.BaseUserTestCase):
+    def _more_setup(self):
+        self.fields = [
+            {
+                "name": "Column A",
+                "type": "string",
+                "constraints": helpers.NOT_REQUIRED_CONSTRAINTS
+            },
+            {
+                "name": "Column B",
+                "type": "string",
+                "constraints": helpers.REQUIRED_CONSTRAINTS
+            }
+        ]
+        self.data_package = helpers.create_data_package_from_fields(self.fields)
+        self.ds = factories.DatasetFactory(
+            project=self.project_1,
+            type=Dataset.TYPE_GENERIC,
+            data_package=self.data_package)
+        self.url = reverse('api:dataset-upload', kwargs={'pk': self.ds.pk})
+
+    def _submit(self, csv_data, client=None, **options):
+        file_ = helpers.rows_to_csv_file(csv_data)
+        client = client or self.custodian_1_client
+        with open(file_) as fp:
+            data = {
+                'file': fp,
+                'strict': True,
+                'async': True
+            }
+            data.update(options)
+            return client.post(self.url, data=data, format='multipart')
+
+    def test_async_upload(self):
+        csv_data = [
+            ['Column A', 'Column B'],
+            ['A1', 'B1'],
+            ['A2', ''],
+            ['A3', 'B3']
+        ]
+        resp = self._submit(csv_data)
+        self.assertEqual(resp.status_code, status.HTTP_202_ACCEPTED)
+        job_id = resp.json().get('id')
+        self.assertEqual(resp.json().get('status'), UploadJob.STATUS_PENDING)
+        # nothing created yet
+        self.assertEqual(0, self.ds.record_queryset.count())
+
+        client = self.custodian_1_client
+        progress_url = reverse('api:upload-job-detail', kwargs={'pk': job_id})
+        results_url = reverse('api:upload-job-results', kwargs={'pk': job_id})
+        # results not available until the job is finished
+        resp = client.get(results_url)
+        self.assertEqual(resp.status_code, status.HTTP_409_CONFLICT)
+
+        # run the worker
+        job = UploadJob.claim_next()
+        self.assertEqual(job.pk, job_id)
+        self.assertEqual(job.status, UploadJob.STATUS_RUNNING)
+        UploadJobRunner(job, species_facade_class=self.species_facade_class).run()
+        self.assertIsNone(UploadJob.claim_next())
+
+        resp = client.get(progress_url)
+        self.assertEqual(resp.status_code, status.HTTP_200_OK)
+        progress = resp.json()
+        self.assertEqual(progress.get('status'), UploadJob.STATUS_SUCCESS)
+        self.assertTrue(progress.get('is_finished'))
+        self.assertTrue(progress.get('has_error'))
+        self.assertEqual(progress.get('rows_processed'), 3)
+        self.assertEqual(progress.get('error_count'), 1)
+
+        resp = client.get(results_url)
+        self.assertEqual(resp.status_code, status.HTTP_200_OK)
+        results = resp.json()
+        self.assertEqual([r.get('row') for r in results], [2, 3, 4])
+        self.assertIn('Column B', results[1].get('errors'))
+        self.assertEqual(2, self.ds.record_queryset.count())
+        for result in [results[0], results[2]]:
+            record = self.ds.record_queryset.filter(pk=result.get('recordId')).first()
+            self.assertIsNotNone(record)
+            self.assertEqual(record.source_info.get('row'), result.get('row'))
+
+    def test_job_not_visible_to_other_users(self):
+        csv_data = [
+            ['Column A', 'Column B'],
+            ['A1', 'B1'],
+        ]
+        resp = self._submit(csv_data)
+        self.assertEqual(resp.status_code, status.HTTP_202_ACCEPTED)
+        job_id = resp.json().get('id')
+        url = reverse('api:upload-job-detail', kwargs={'pk': job_id})
+        self.assertEqual(self.custodian_2_client.get(url).status_code, status.HTTP_404_NOT_FOUND)
+        self.assertEqual(self.admin_client.get(url).status_code, status.HTTP_200_OK)
+        self.assertIn(self.anonymous_client.get(url).status_code,
+                      [status.HTTP_401_UNAUTHORIZED, status.HTTP_403_FORBIDDEN])
+
+    def test_results_truncated(self):
+        """
+        Only the first rows results are kept, the summary covers all the rows.
+        """
+        csv_data = [
+            ['Column A', 'Column B'],
+            ['A1', 'B1'],
+            ['A2', ''],
+            ['A3', 'B3'],
+            ['A4', '']
+        ]
+        resp = self._submit(csv_data)
+        job_id = resp.json().get('id')
+        job = UploadJob.claim_next()
+        UploadJobRunner(job, species_facade_class=self.species_facade_class, max_results=2).run()
+        client = self.custodian_1_client
+        resp = client.get(reverse('api:upload-job-detail', kwargs={'pk': job_id}))
+        self.assertTrue(resp.json().get('result_truncated'))
+        self.assertEqual(4, resp.json().get('rows_processed'))
+        results_url = reverse('api:upload-job-results', kwargs={'pk': job_id})
+        self.assertEqual([2, 3], [r.get('row') for r in client.get(results_url).json()])
+        summary = client.get(results_url, {'report': 'summary'}).json()
+        self.assertEqual(4, summary.get('rowCount'))
+        self.assertEqual(2, summary.get('recordCount'))
+        self.assertEqual([3, 5], summary.get('errors')[0].get('rows'))
+
+    def test_fail_stale(self):
+        """
+        A running job without progress for longer than the timeout is failed, its worker died.
+        """
+        resp = self._submit([['Column A', 'Column B'], ['A1', 'B1']])
+        job = UploadJob.claim_next()
+        self.assertEqual(0, UploadJob.fail_stale(timeout=60))
+        UploadJob.objects.filter(pk=job.pk).update(heartbeat=timezone.now() - datetime.timedelta(seconds=120))
+        self.assertEqual(1, UploadJob.fail_stale(timeout=60))
+        job = UploadJob.objects.get(pk=resp.json().get('id'))
+        self.assertEqual(UploadJob.STATUS_FAILED, job.status)
+        self.assertTrue(job.is_finished)
+        self.assertIsNotNone(job.error_message)
+        self.assertIsNone(UploadJob.claim_next())
+
+    def test_delete_previous(self):
+        """
+        The previous records are only deleted once the job file has been processed.
+        """
+        self._submit([['Column A', 'Column B'], ['A1', 'B1']])
+        UploadJobRunner(UploadJob.claim_next(), species_facade_class=self.species_facade_class).run()
+        self.assertEqual(['B1'], [r.data['Column B'] for r in self.ds.record_queryset.all()])
+        # the job fails: the previous records are kept
+        self._submit([['Column A', 'Column B'], ['A2', 'B2']], delete_previous=True)
+        job = UploadJob.claim_next()
+        job.file.delete(save=False)
+        job = UploadJobRunner(job, species_facade_class=self.species_facade_class).run()
+        self.assertEqual(UploadJob.STATUS_FAILED, job.status)
+        self.assertEqual(['B1'], [r.data['Column B'] for r in self.ds.record_queryset.all()])
+        # success
+        self._submit([['Column A', 'Column B'], ['A2', 'B2'], ['A3', 'B3']], delete_previous=True)
+        job = UploadJobRunner(UploadJob.claim_next(), species_facade_class=self.species_facade_class).run()
+        self.assertEqual(UploadJob.STATUS_SUCCESS, job.status)
+        self.assertEqual(['B2', 'B3'], [r.data['Column B'] for r in self.ds.record_queryset.order_by('pk')])
@@ -0,0 +1,27 @@
+import json
+
+from django.core.management import call_command
+from django.test import TestCase
+from django.utils import six
+
+from main.models import Program, Record
+
+
+class TestBenchmarkIngest(TestCase):
+
+    def test_all_scenarios(self):
+        out = six.StringIO()
+        call_command('benchmark_ingest', '--rows', '5', '--format', 'csv', stdout=out, stderr=six.StringIO())
+        output = json.loads(out.getvalue())
+        self.assertEqual(5, output.get('rows'))
+        results = output.get('results')
+        self.assertEqual(5, len(results))
+        for result in results:
+            self.assertEqual('csv', result.get('format'))
+            self.assertEqual(0, result.get('errorCount'), result.get('scenario'))
+            self.assertEqual(5, result.get('recordCount'), result.get('scenario'))
+            self.assertEqual({'generate', 'read', 'validate', 'ingest'}, set(result.get('stages').keys()))
+            self.assertIsNotNone(result.get('rowsPerSecond'))
+        # the benchmark data are deleted
+        self.assertFalse(Program.objects.filter(name__startswith='Ingest benchmark').exists())
+        self.assertEqual(0, Record.objects.count())
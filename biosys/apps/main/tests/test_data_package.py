@@ -408,6 +408,69 @@ class TestGenericSchemaValidation(TestCase):
         self.sch = GenericSchema(self.descriptor)
 
 
+class TestCompiledSchemaValidator(TestCase):
+    """
+    The compiled validator must return exactly the same messages as the SchemaField validation.
+    """
+    descriptors = [
+        {'name': 'String', 'type': 'string'},
+        {'name': 'String', 'type': 'string', 'constraints': {'required': True}},
+        {'name': 'String', 'type': 'string', 'constraints': {'enum': ['a', 'b']}},
+        {'name': 'String', 'type': 'string', 'constraints': {'pattern': '[a-z]+'}},
+        {'name': 'Integer', 'type': 'integer'},
+        {'name': 'Integer', 'type': 'integer', 'constraints': {'required': True, 'minimum': 0, 'maximum': 10}},
+        {'name': 'Integer', 'type': 'integer', 'constraints': {'enum': [1, 2]}},
+        {'name': 'Number', 'type': 'number', 'constraints': {'minimum': -90.0, 'maximum': 90.0}},
+        {'name': 'Number', 'type': 'number', 'constraints': {'required': True}},
+        {'name': 'Boolean', 'type': 'boolean'},
+        {'name': 'Boolean', 'type': 'boolean', 'constraints': {'required': True}},
+        {'name': 'Date', 'type': 'date', 'format': 'any'},
+        {'name': 'Date', 'type': 'date', 'format': 'any', 'constraints': {'required': True}},
+        {'name': 'Date', 'type': 'date'},
+        {'name': 'Datetime', 'type': 'datetime', 'format': 'any'},
+    ]
+    values = [
+        '', ' ', None, 'a', ' a ', 'b', 'c', 'A1', '1', '01', ' 1', '+5', '1.0', '1.5', '-1', '11', '5', 5, 5.5, True,
+        '1e3', '.5', '5.', '1,000', '-100', '45.5', ' 45.5 ', 'yes', 'No', 'true', '0', '10/07/2016', '2016-07-10',
+        '31/02/2017', 'djskdj'
+    ]
+
+    def test_same_messages_as_schema_field(self):
+        for descriptor in self.descriptors:
+            field = SchemaField(clone(descriptor))
+            validator = CompiledSchemaValidator(GenericSchema({'fields': [clone(descriptor)]}))
+            for value in self.values:
+                self.assertEqual(
+                    field.validation_error(value),
+                    validator.field_validation_error(descriptor['name'], value),
+                    msg="{} {}".format(descriptor, repr(value))
+                )
+
+    def test_boolean_fast_path(self):
+        """
+        The boolean values are accepted by the specialised check, without the tableschema cast.
+        """
+        validator = CompiledSchemaValidator(GenericSchema({'fields': [{'name': 'Boolean', 'type': 'boolean'}]}))
+        check = validator.checks['Boolean']
+        self.assertIsNotNone(check)
+        for value in SchemaField.TRUE_VALUES + SchemaField.FALSE_VALUES + [True, False, '', ' yes ']:
+            self.assertTrue(check(value), repr(value))
+        for value in ['maybe', 2, None]:
+            self.assertFalse(check(value), repr(value))
+        # the tableschema default values if the descriptor has none
+        field = SchemaField({'name': 'Boolean', 'type': 'boolean'})
+        field.tableschema_field = TableField({'name': 'Boolean', 'type': 'boolean'})
+        check = CompiledSchemaValidator.compile_field_check(field)
+        for value in ['true', 'TRUE', '1', 'false', 'FALSE', '0']:
+            self.assertTrue(check(value), value)
+        self.assertFalse(check('yes'))
+
+    def test_unknown_field(self):
+        schema = GenericSchema({'fields': [clone(self.descriptors[0])]})
+        with self.assertRaises(Exception):
+            schema.field_validation_error('Unknown', 'value')
+
+
 class TestObservationSchemaCast(TestCase):
     def setUp(self):
         self.descriptor = clone(LAT_LONG_OBSERVATION_SCHEMA)
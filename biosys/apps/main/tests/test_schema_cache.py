@@ -0,0 +1,89 @@
+import datetime
+
+from django.test import TestCase
+
+from main.models import Dataset, schema_cache
+from main.tests import factories
+from main.tests.test_data_package import clone, GENERIC_SCHEMA, LAT_LONG_OBSERVATION_SCHEMA
+from main.utils_data_package import GenericSchema, ObservationSchema, SchemaCache, SiteGeometryResolver
+
+
+class TestSchemaCache(TestCase):
+
+    def test_cached_copies(self):
+        cache = SchemaCache(max_size=10)
+        descriptor = clone(LAT_LONG_OBSERVATION_SCHEMA)
+        schema_1 = cache.get(1, ObservationSchema, descriptor)
+        schema_2 = cache.get(1, ObservationSchema, descriptor)
+        self.assertEqual(1, cache.misses)
+        self.assertEqual(1, cache.hits)
+        self.assertIsNot(schema_1, schema_2)
+        # the compiled parts are shared
+        self.assertIs(schema_1.get_field_by_name('Latitude'), schema_2.get_field_by_name('Latitude'))
+        self.assertIs(schema_1.compiled_validator.checks['Latitude'], schema_2.compiled_validator.checks['Latitude'])
+        # the per use state is not
+        resolver = SiteGeometryResolver(1)
+        schema_1.site_geometry_resolver = resolver
+        self.assertIsNot(resolver, schema_2.site_geometry_resolver)
+        self.assertIsNot(resolver, cache.get(1, ObservationSchema, descriptor).site_geometry_resolver)
+
+    def test_date_casters_per_copy(self):
+        """
+        The date format learned by a copy is not used by the other copies.
+        """
+        cache = SchemaCache(max_size=10)
+        descriptor = clone(LAT_LONG_OBSERVATION_SCHEMA)
+        schema_1 = cache.get(1, ObservationSchema, descriptor)
+        schema_2 = cache.get(1, ObservationSchema, descriptor)
+        self.assertIsNone(schema_1.field_validation_error('Observation Date', '20/12/2017'))
+        self.assertEqual(datetime.date(2017, 12, 20), schema_1.cast_record_observation_date({
+            'Observation Date': '20/12/2017'
+        }))
+        self.assertEqual('%d/%m/%Y', schema_1.observation_date_field.date_caster.format)
+        field = schema_2.observation_date_field
+        self.assertIsNot(schema_1.observation_date_field, field)
+        self.assertIs(field, schema_2.get_field_by_name('Observation Date'))
+        self.assertIsNone(schema_2.field_validation_error('Observation Date', '2017-12-20'))
+        self.assertEqual('%Y-%m-%d', field.date_caster.format)
+        self.assertEqual('%d/%m/%Y', schema_1.observation_date_field.date_caster.format)
+        self.assertIsNone(cache.get(1, ObservationSchema, descriptor).observation_date_field.date_caster.format)
+
+    def test_key(self):
+        cache = SchemaCache(max_size=10)
+        descriptor = clone(GENERIC_SCHEMA)
+        schema = cache.get(1, GenericSchema, descriptor)
+        # another dataset
+        cache.get(2, GenericSchema, descriptor)
+        self.assertEqual(2, cache.misses)
+        # a changed descriptor
+        descriptor['fields'].append({'name': 'New Column', 'type': 'string'})
+        self.assertEqual(schema.field_names + ['New Column'], cache.get(1, GenericSchema, descriptor).field_names)
+        self.assertEqual(3, cache.misses)
+
+    def test_lru(self):
+        cache = SchemaCache(max_size=2)
+        descriptor = clone(GENERIC_SCHEMA)
+        cache.get(1, GenericSchema, descriptor)
+        cache.get(2, GenericSchema, descriptor)
+        cache.get(1, GenericSchema, descriptor)
+        cache.get(3, GenericSchema, descriptor)
+        self.assertEqual(2, len(cache))
+        # 2 is the least recently used
+        cache.get(1, GenericSchema, descriptor)
+        self.assertEqual(2, cache.hits)
+        cache.get(2, GenericSchema, descriptor)
+        self.assertEqual(4, cache.misses)
+
+    def test_invalidated_on_dataset_save(self):
+        project = factories.ProjectFactory.create()
+        data_package = {
+            'name': 'test',
+            'resources': [{'name': 'test', 'schema': clone(GENERIC_SCHEMA)}]
+        }
+        dataset = Dataset.objects.create(project=project, name='test', data_package=data_package)
+        field_names = dataset.schema.field_names
+        self.assertTrue(any([key[0] == dataset.pk for key in schema_cache._schemas]))
+        dataset.data_package['resources'][0]['schema']['fields'].append({'name': 'New Column', 'type': 'string'})
+        dataset.save()
+        self.assertFalse(any([key[0] == dataset.pk for key in schema_cache._schemas]))
+        self.assertEqual(field_names + ['New Column'], Dataset.objects.get(pk=dataset.pk).schema.field_names)
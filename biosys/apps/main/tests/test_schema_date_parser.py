@@ -2,7 +2,8 @@ import datetime
 
 from django.test import TestCase
 
-from main.utils_data_package import ObservationSchema, ObservationDateParser, InvalidDateType
+from main.utils_data_package import ObservationSchema, ObservationDateParser, InvalidDateType, AdaptiveDateCaster, \
+    cast_date_any_format, cast_datetime_any_format
 
 from main.tests.test_data_package import clone, GENERIC_SCHEMA, REQUIRED_CONSTRAINTS, NOT_REQUIRED_CONSTRAINTS
 
@@ -388,3 +389,54 @@ class TestObservationDateParser(TestCase):
                 parser.cast_date({
                     "The expected date": dt
                 })
+
+
+class TestAdaptiveDateCaster(TestCase):
+
+    def test_learn_day_first_format(self):
+        caster = AdaptiveDateCaster(date_only=True)
+        self.assertEqual(datetime.date(2017, 6, 4), caster.cast('04/06/2017'))
+        self.assertEqual('%d/%m/%Y', caster.format)
+        self.assertEqual(datetime.date(2017, 12, 25), caster.cast('25/12/2017'))
+        self.assertEqual('%d/%m/%Y', caster.format)
+
+    def test_outliers(self):
+        """
+        Values that don't match the learned format are parsed by dateutil, with the day first.
+        """
+        caster = AdaptiveDateCaster(date_only=True)
+        caster.cast('04/06/2017')
+        # month first is the only possible reading
+        self.assertEqual(datetime.date(2017, 1, 13), caster.cast('01/13/2017'))
+        self.assertEqual(datetime.date(2017, 6, 4), caster.cast('4 June 2017'))
+        self.assertEqual(datetime.date(2017, 6, 4), caster.cast('2017-06-04'))
+        with self.assertRaises(InvalidDateType):
+            caster.cast('blah blah')
+
+    def test_unpadded_iso_date(self):
+        """
+        strptime accepts an unpadded '2018-2-1' for '%Y-%m-%d' (1 Feb) but it is not an ISO date for
+        parse_datetime_day_first (2 Jan). The learned format must not be used.
+        """
+        caster = AdaptiveDateCaster(date_only=True)
+        self.assertEqual(datetime.date(2018, 6, 4), caster.cast('2018-06-04'))
+        self.assertEqual('%Y-%m-%d', caster.format)
+        self.assertEqual(cast_date_any_format('2018-2-1'), caster.cast('2018-2-1'))
+        self.assertEqual(datetime.date(2018, 1, 2), caster.cast('2018-2-1'))
+        # not learned from an unpadded value
+        caster = AdaptiveDateCaster(date_only=True)
+        caster.cast('2018-2-1')
+        self.assertIsNone(caster.format)
+
+    def test_same_as_dateutil(self):
+        values = [
+            '04/06/2017', '4/6/2017', '13/01/2017', '01/13/2017', '2017-06-04', '04-06-2017', '04.06.2017',
+            '04/06/2017 10:30', '04/06/2017 10:30:15', '2017-06-04T10:30:15', '2017-06-04 10:30:15.5',
+            '2017/06/04', '2017/06/25', '04/06/17', '4 June 2017', 'June 4 2017', '2017-6-4', '2017-06-4 10:30'
+        ]
+        date_caster = AdaptiveDateCaster(date_only=True)
+        datetime_caster = AdaptiveDateCaster(date_only=False)
+        # twice: the second pass goes through the learned formats
+        for value in values + values:
+            self.assertEqual(cast_date_any_format(value), date_caster.cast(value), value)
+            self.assertEqual(cast_datetime_any_format(value), datetime_caster.cast(value), value)
@@ -1,6 +1,16 @@
-from django.test import TestCase
+import datetime
+import json
+import threading
 
-from main.utils_species import HerbieFacade
+from django.conf import settings
+from django.core.management import call_command
+from django.test import TestCase, override_settings
+from django.utils import six, timezone
+from django.utils.six.moves import BaseHTTPServer, socketserver
+from django.utils.six.moves.urllib import parse
+
+from main.models import CachedSpecies
+from main.utils_species import HerbieFacade, CachedSpeciesFacade, SpeciesIndex
 
 
 class TestHerbieFacade(TestCase):
@@ -37,3 +47,212 @@ class TestHerbieFacade(TestCase):
             self.assertTrue(self.facade.PROPERTY_NAME_ID.herbie_name in sp)
         except Exception as e:
             self.fail("Should not raise an exception!: {}: '{}'".format(e.__class__, e))
+
+
+class LocalWFSServer(object):
+    """
+    A local stand-in for the Herbie WFS service. Serves the given species as a GeoJSON feature collection and supports
+    the WFS paging parameters startIndex and count (or maxFeatures).
+    Use as a context manager: HerbieFacade.BASE_URL points to the local server for the duration.
+    :param failures: {startIndex: number of times the request of this page fails with a 503 before succeeding}
+    :param send_total: if False the number of species matched is not sent.
+    """
+
+    def __init__(self, species, failures=None, send_total=True):
+        self.species = species
+        self.requests = []
+        self.failures = dict(failures or {})
+        server = self
+
+        class Handler(BaseHTTPServer.BaseHTTPRequestHandler):
+            def do_GET(self):
+                params = dict(parse.parse_qsl(parse.urlparse(self.path).query))
+                server.requests.append(params)
+                start = int(params.get('startIndex', 0))
+                if server.failures.get(start):
+                    server.failures[start] -= 1
+                    self.send_error(503)
+                    return
+                count = params.get('count') or params.get('maxFeatures')
+                end = start + int(count) if count else len(server.species)
+                features = [
+                    {'type': 'Feature', 'id': 'species.{}'.format(i), 'geometry': None, 'properties': sp}
+                    for i, sp in enumerate(server.species[start:end], start)
+                ]
+                content = {
+                    'type': 'FeatureCollection',
+                    'numberReturned': len(features),
+                    'features': features
+                }
+                if send_total:
+                    content['totalFeatures'] = content['numberMatched'] = len(server.species)
+                body = json.dumps(content).encode('utf-8')
+                self.send_response(200)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, *args):
+                pass
+
+        class Server(socketserver.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+            daemon_threads = True
+
+        self.httpd = Server(('127.0.0.1', 0), Handler)
+        self.url = 'http://127.0.0.1:{}/ows?service=wfs&version=1.1.0&request=GetFeature' \
+                   '&typeNames=public:herbie_hbvspecies_public&outputFormat=application/json' \
+            .format(self.httpd.server_address[1])
+        self._base_url = None
+
+    def __enter__(self):
+        self.thread = threading.Thread(target=self.httpd.serve_forever)
+        self.thread.daemon = True
+        self.thread.start()
+        self._base_url = HerbieFacade.BASE_URL
+        HerbieFacade.BASE_URL = self.url
+        return self
+
+    def __exit__(self, *args):
+        HerbieFacade.BASE_URL = self._base_url
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+
+def build_species(count):
+    return [{'species_name': 'Species {}'.format(i), 'name_id': i} for i in range(1, count + 1)]
+
+
+class TestHerbieFacadePaging(TestCase):
+    def setUp(self):
+        self.attributes = {name: getattr(HerbieFacade, name) for name in ['PAGE_SIZE', 'RETRY_DELAY']}
+        HerbieFacade.PAGE_SIZE = 10
+        HerbieFacade.RETRY_DELAY = 0
+
+    def tearDown(self):
+        for name, value in self.attributes.items():
+            setattr(HerbieFacade, name, value)
+
+    def test_pages(self):
+        species = build_species(95)
+        with LocalWFSServer(species) as server:
+            self.assertEqual(species, HerbieFacade().get_all_species())
+            self.assertEqual(10, len(server.requests))
+            self.assertEqual(set(range(0, 95, 10)), set(int(params['startIndex']) for params in server.requests))
+            # WFS 1.1.0
+            self.assertEqual({'10'}, set(params['maxFeatures'] for params in server.requests))
+            # stable order of the pages
+            self.assertEqual({'name_id'}, set(params.get('sortBy') for params in server.requests))
+
+    def test_property_filter(self):
+        with LocalWFSServer(build_species(25)) as server:
+            facade = HerbieFacade()
+            result = facade.name_id_by_species_name()
+            self.assertEqual(25, len(result))
+            self.assertEqual(25, result['Species 25'])
+            self.assertEqual('(species_name,name_id)', server.requests[0]['propertyName'])
+
+    def test_retry(self):
+        species = build_species(30)
+        with LocalWFSServer(species, failures={0: 1, 20: 2}) as server:
+            self.assertEqual(species, HerbieFacade().get_all_species())
+            self.assertEqual(6, len(server.requests))
+        with LocalWFSServer(species, failures={10: HerbieFacade.MAX_RETRIES + 1}):
+            with self.assertRaises(Exception):
+                HerbieFacade().get_all_species()
+
+    def test_unknown_total(self):
+        species = build_species(30)
+        with LocalWFSServer(species, send_total=False) as server:
+            self.assertEqual(species, HerbieFacade().get_all_species())
+            # the last page is empty
+            self.assertEqual(4, len(server.requests))
+
+
+@override_settings(SPECIES_CACHE_BACKGROUND_REFRESH=False)
+class TestCachedSpeciesFacade(TestCase):
+    def setUp(self):
+        CachedSpeciesFacade._memory = None
+
+    def test_empty_cache_filled_from_source(self):
+        species = build_species(10)
+        with LocalWFSServer(species) as server:
+            facade = CachedSpeciesFacade()
+            expected = {sp['species_name']: sp['name_id'] for sp in species}
+            self.assertEqual(expected, facade.name_id_by_species_name())
+            self.assertEqual(1, len(server.requests))
+            self.assertEqual(10, CachedSpecies.objects.count())
+            # served from the cache
+            self.assertEqual(expected, CachedSpeciesFacade().name_id_by_species_name())
+            self.assertEqual(1, len(server.requests))
+            self.assertEqual(
+                {'species_name': 'Species 1', 'name_id': 1},
+                sorted(facade.get_all_species(), key=lambda sp: sp['name_id'])[0]
+            )
+
+    def test_stale_cache_refreshed(self):
+        with LocalWFSServer(build_species(5)) as server:
+            facade = CachedSpeciesFacade()
+            self.assertEqual(5, len(facade.name_id_by_species_name()))
+            server.species = build_species(7)
+            self.assertEqual(5, len(facade.name_id_by_species_name()))
+            # expire the cache
+            CachedSpecies.objects.update(
+                refreshed=timezone.now() - datetime.timedelta(seconds=settings.SPECIES_CACHE_TTL + 1))
+            self.assertEqual(7, len(facade.name_id_by_species_name()))
+            self.assertEqual(2, len(server.requests))
+
+    def test_refresh_command(self):
+        with LocalWFSServer(build_species(3)) as server:
+            out = six.StringIO()
+            call_command('refresh_species_cache', stdout=out)
+            self.assertEqual(3, CachedSpecies.objects.count())
+            call_command('refresh_species_cache', '--if-stale', stdout=out)
+            self.assertEqual(1, len(server.requests))
+            call_command('refresh_species_cache', stdout=out)
+            self.assertEqual(2, len(server.requests))
+
+
+class TestSpeciesIndex(TestCase):
+
+    def test_lookups(self):
+        index = SpeciesIndex({'Canis lupus': 1, 'Vulpes vulpes': 2, 'Felis catus': 3})
+        self.assertEqual(3, len(index))
+        self.assertEqual(1, index.get_name_id('Canis lupus'))
+        self.assertEqual('Vulpes vulpes', index.get_species_name(2))
+        self.assertEqual('Vulpes vulpes', index.get_species_name('2'))
+        self.assertTrue(index.has_name_id(3))
+        self.assertFalse(index.has_name_id(4))
+        self.assertIsNone(index.get_name_id('Unknown'))
+        self.assertEqual(-1, index.get_name_id('Unknown', -1))
+        self.assertIsNone(index.get_species_name('not a number'))
+        self.assertEqual({'Canis lupus': 1, 'Vulpes vulpes': 2, 'Felis catus': 3}, dict(index.items()))
+
+    def test_name_case_and_whitespace_insensitive(self):
+        index = SpeciesIndex({'Canis lupus': 1})
+        self.assertEqual(1, index.get_name_id('canis LUPUS'))
+        self.assertEqual(1, index.get_name_id('  Canis   lupus '))
+        self.assertEqual(('Canis lupus', 1), index.get_species('canis LUPUS'))
+        self.assertIsNone(index.get_species('Canis'))
+
+    def test_name_collisions(self):
+        """
+        Two names that only differ by the case keep their own id when matched exactly.
+        """
+        index = SpeciesIndex()
+        index.add('Canis lupus', 1)
+        index.add('canis lupus', 2)
+        self.assertEqual(1, index.get_name_id('Canis lupus'))
+        self.assertEqual(2, index.get_name_id('canis lupus'))
+        self.assertEqual(1, index.get_name_id('CANIS LUPUS'))
+
+    def test_matcher(self):
+        index = SpeciesIndex({'Canis lupus': 1, 'Canis latrans': 2, 'Vulpes vulpes': 3})
+        matches = index.matcher.match(['canis lupis', 'Vulpes  Vulpes', 'canis lupis', 'Acacia'])
+        self.assertEqual(['canis lupis', 'Vulpes  Vulpes', 'Acacia'], list(matches.keys()))
+        self.assertEqual(['Canis lupus', 'Canis latrans'], [m['speciesName'] for m in matches['canis lupis']])
+        self.assertEqual({'speciesName': 'Vulpes vulpes', 'nameId': 3, 'score': 1.0}, matches['Vulpes  Vulpes'][0])
+        self.assertEqual([], matches['Acacia'])
+        # limit and min score
+        self.assertEqual(1, len(index.matcher.suggest('canis lupis', limit=1)))
+        self.assertEqual([], index.matcher.suggest('canis lupis', min_score=0.9))
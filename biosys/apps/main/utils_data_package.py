@@ -1,10 +1,16 @@
 from __future__ import absolute_import, unicode_literals, print_function, division
 
+import collections
+import copy
 import datetime
 import decimal
+import functools
+import hashlib
+import itertools
 import json
 import logging
 import re
+import threading
 
 from dateutil.parser import parse as date_parse
 from django.contrib.gis.geos import Point
@@ -87,6 +93,86 @@ def cast_datetime_any_format(value):
         raise_with_traceback(InvalidDateType(e))
 
 
+def strptime_format_to_regex(format_):
+    """
+    The strict regex of a strptime format: the fields must be zero padded (strptime also accepts '2018-2-1' for
+    '%Y-%m-%d').
+    """
+    patterns = {
+        '%d': '[0-9]{2}', '%m': '[0-9]{2}', '%Y': '[0-9]{4}', '%H': '[0-9]{2}', '%M': '[0-9]{2}', '%S': '[0-9]{2}',
+        '%f': '[0-9]{1,6}'
+    }
+    parts = re.split('(%[a-zA-Z])', format_)
+    return re.compile('^' + ''.join(patterns[part] if part in patterns else re.escape(part) for part in parts) + '$')
+
+
+class AdaptiveDateCaster(object):
+    """
+    Cast the values of a date or datetime column with the 'any' format.
+    The concrete format of the column is learned from the values parsed by dateutil and then used with strptime,
+    which is much faster. The values that don't match the learned format (outliers) still go through dateutil.
+    Only formats that give the same result as parse_datetime_day_first for every value they match are learned:
+    4 digits years, day first or ISO (YYYY-MM-DD), and a value must match the zero padded regex of the format (see
+    strptime_format_to_regex). An unpadded ISO date like '2018-2-1' is parsed day first by dateutil.
+    The copies of a cached schema get new casters (see GenericSchema.copy), a format is learned per upload.
+    """
+    DATE_FORMATS = ['%d/%m/%Y', '%d-%m-%Y', '%d.%m.%Y', '%Y-%m-%d']
+    TIME_FORMATS = ['', ' %H:%M', ' %H:%M:%S', ' %H:%M:%S.%f']
+    ISO_TIME_FORMATS = ['T%H:%M', 'T%H:%M:%S', 'T%H:%M:%S.%f']
+    FORMATS = [d + t for d, t in itertools.product(DATE_FORMATS, TIME_FORMATS)] + \
+        ['%Y-%m-%d' + t for t in ISO_TIME_FORMATS]
+    # format -> strict regex
+    FORMAT_REGEXES = dict(zip(FORMATS, map(strptime_format_to_regex, FORMATS)))
+    # number of values parsed by dateutil without finding a format before giving up the learning.
+    MAX_LEARNING_ATTEMPTS = 20
+
+    def __init__(self, date_only=False):
+        self.date_only = date_only
+        self.format = None
+        self.learning_attempts = 0
+        # (value, result) of the last string value. The same value is often casted several times in a row (validation
+        # then record creation). A single attribute so that a caster can be shared by threads.
+        self._last = None
+
+    def cast(self, value):
+        if not isinstance(value, six.string_types):
+            return cast_date_any_format(value) if self.date_only else cast_datetime_any_format(value)
+        last = self._last
+        if last is not None and last[0] == value:
+            return last[1]
+        result = None
+        format_ = self.format
+        if format_ is not None and self.FORMAT_REGEXES[format_].match(value):
+            try:
+                result = datetime.datetime.strptime(value, format_)
+            except ValueError:
+                pass
+        if result is None:
+            result = cast_datetime_any_format(value)
+            if self.learning_attempts < self.MAX_LEARNING_ATTEMPTS:
+                self.learn(value, result)
+        if self.date_only:
+            result = result.date()
+        self._last = (value, result)
+        return result
+
+    def learn(self, value, expected):
+        """
+        Look for a format that parses the value into the expected datetime.
+        """
+        for format_ in self.FORMATS:
+            if not self.FORMAT_REGEXES[format_].match(value):
+                continue
+            try:
+                if datetime.datetime.strptime(value, format_) == expected:
+                    self.format = format_
+                    return format_
+            except ValueError:
+                pass
+        self.learning_attempts += 1
+        return None
+
+
 def find_unique_field(schema, biosys_type, column_name):
     """
     Precedence Rules:
@@ -122,10 +208,12 @@ class BiosysSchema:
       constraints: ....
       biosys: {
                 type: observationDate|latitude|longitude|...
+                indexed: true|false
               }
     }
     """
     BIOSYS_KEY_NAME = 'biosys'
+    INDEXED_KEY_NAME = 'indexed'
     OBSERVATION_DATE_TYPE_NAME = 'observationDate'
     LATITUDE_TYPE_NAME = 'latitude'
     LONGITUDE_TYPE_NAME = 'longitude'
@@ -191,6 +279,9 @@ class BiosysSchema:
     def is_species(self):
         return self.type == self.SPECIES_TYPE_NAME
 
+    def is_indexed(self):
+        return self.get(self.INDEXED_KEY_NAME) is True
+
 
 @python_2_unicode_compatible
 class SchemaField:
@@ -214,6 +305,7 @@ class SchemaField:
         # biosys specific
         self.biosys = BiosysSchema(self.descriptor.get(BiosysSchema.BIOSYS_KEY_NAME))
         self.constraints = SchemaConstraints(self.descriptor.get('constraints', {}))
+        self._date_caster = None
 
     # implement some dict like methods
     def __getitem__(self, item):
@@ -254,10 +346,35 @@ class SchemaField:
     def is_numeric(self):
         return self.type in ['number', 'integer']
 
+    @property
+    def is_indexed(self):
+        return self.biosys.is_indexed()
+
     @property
     def format(self):
         return self.descriptor['format']
 
+    @property
+    def has_date_caster(self):
+        return self.is_datetime_types and self.format == 'any'
+
+    @property
+    def date_caster(self):
+        """
+        :return: the AdaptiveDateCaster of a date/datetime field with the 'any' format.
+        """
+        if self._date_caster is None:
+            self._date_caster = AdaptiveDateCaster(date_only=self.is_date_type)
+        return self._date_caster
+
+    def copy(self):
+        """
+        A shallow copy with its own date caster.
+        """
+        result = copy.copy(self)
+        result._date_caster = None
+        return result
+
     def has_alias(self, name, icase=False):
         for alias in self.aliases:
             if (alias == name) or (icase and alias.lower() == name.lower()):
@@ -293,8 +410,8 @@ class SchemaField:
                 # the ensure only unicode
                 value = six.u(value).strip()
         # date or datetime with format='any
-        if self.is_datetime_types and self.format == 'any' and value:
-            return cast_date_any_format(value) if self.is_date_type else cast_datetime_any_format(value)
+        if self.has_date_caster and value:
+            return self.date_caster.cast(value)
         # delegates to tableschema.Field.cast_value
         return self.tableschema_field.cast_value(value, constraints=True)
 
@@ -437,6 +554,185 @@ class SchemaForeignKey:
 
 
 @python_2_unicode_compatible
+class CompiledSchemaValidator(object):
+    """
+    A field validator built once per schema for the row validation hot loop.
+    The fields are indexed by name and the common field types (string, integer, number, boolean and date/datetime
+    with format 'any') get a specialised check that doesn't go through the tableschema cast.
+    The specialised check only decides that a value is valid. For anything else (invalid value, other types, formats
+    or constraints) the validation falls back to SchemaField.validation_error, so the error messages are unchanged.
+    """
+    NUMBER_REGEX = re.compile(r'^[+-]?(\d+(\.\d*)?|\.\d+)([eE][+-]?\d+)?$')
+    # the boolean values of tableschema when the descriptor has no trueValues/falseValues
+    TABLESCHEMA_TRUE_VALUES = ['true', 'True', 'TRUE', '1']
+    TABLESCHEMA_FALSE_VALUES = ['false', 'False', 'FALSE', '0']
+    # the constraints that the specialised checks know how to verify
+    SUPPORTED_CONSTRAINTS = {
+        'string': ['required', 'enum'],
+        'integer': ['required', 'enum', 'minimum', 'maximum'],
+        'number': ['required', 'enum', 'minimum', 'maximum'],
+        'boolean': ['required'],
+        'date': ['required'],
+        'datetime': ['required'],
+    }
+
+    def __init__(self, schema):
+        self.schema = schema
+        self.fields_by_name = {}
+        self.checks = {}
+        for field in schema.fields:
+            # same precedence as GenericSchema.get_field_by_name: first field wins.
+            if field.name not in self.fields_by_name:
+                self.fields_by_name[field.name] = field
+                self.checks[field.name] = self.compile_field_check(field)
+        self.required_fields = [f for f in schema.fields if f.required]
+
+    def get_field_by_name(self, name):
+        return self.fields_by_name.get(name)
+
+    def copy(self, schema):
+        """
+        The validator of a copy of the schema (see GenericSchema.copy). The checks are shared, except the ones of the
+        copied fields.
+        """
+        result = copy.copy(self)
+        result.schema = schema
+        result.fields_by_name = {}
+        result.checks = dict(self.checks)
+        for field in schema.fields:
+            if field.name not in result.fields_by_name:
+                result.fields_by_name[field.name] = field
+                if field is not self.fields_by_name[field.name]:
+                    result.checks[field.name] = self.compile_field_check(field)
+        result.required_fields = [f for f in schema.fields if f.required]
+        return result
+
+    def field_validation_error(self, field_name, value):
+        field = self.fields_by_name.get(field_name)
+        if field is None:
+            raise Exception("The field '{}' doesn't exists in the schema. Should be one of {}"
+                            .format(field_name, self.schema.field_names))
+        check = self.checks[field_name]
+        if check is not None and check(value):
+            return None
+        return field.validation_error(value)
+
+    @classmethod
+    def compile_field_check(cls, field):
+        """
+        :return: a function value -> True if the value is valid for the field. A False means 'not sure' and the
+        value must go through the standard validation.
+        None if the field type, format or constraints are not supported.
+        """
+        table_field = field.tableschema_field
+        field_type = table_field.type
+        field_format = table_field.format
+        constraints = field.constraints.descriptor
+        supported = cls.SUPPORTED_CONSTRAINTS.get(field_type)
+        if supported is None or [c for c in constraints if c not in supported]:
+            return None
+        required = bool(constraints.get('required', False))
+        try:
+            cast = functools.partial(table_field.cast_value, constraints=False)
+            enum = [cast(v) for v in constraints['enum']] if 'enum' in constraints else None
+            minimum = cast(constraints['minimum']) if 'minimum' in constraints else None
+            maximum = cast(constraints['maximum']) if 'maximum' in constraints else None
+        except Exception:
+            return None
+
+        def check_constraints(casted):
+            return all([
+                enum is None or casted in enum,
+                minimum is None or casted >= minimum,
+                maximum is None or casted <= maximum
+            ])
+
+        if field_type == 'string' and field_format == 'default':
+            def check(value):
+                if not isinstance(value, six.string_types):
+                    return False
+                value = value.strip()
+                if not value:
+                    return not required
+                return check_constraints(value)
+
+            return check
+
+        if field_type == 'integer':
+            def check(value):
+                if isinstance(value, bool):
+                    return False
+                if isinstance(value, six.integer_types):
+                    return check_constraints(value)
+                if not isinstance(value, six.string_types):
+                    return False
+                if not value.strip():
+                    return not required
+                try:
+                    casted = int(value)
+                except ValueError:
+                    return False
+                # same rule as SchemaField.validation_error: '1.0', '01' or ' 1' are not whole numbers.
+                return str(casted) == value and check_constraints(casted)
+
+            return check
+
+        if field_type == 'number':
+            if [option for option in ['decimalChar', 'groupChar', 'bareNumber'] if option in field.descriptor]:
+                return None
+
+            def check(value):
+                if isinstance(value, bool):
+                    return False
+                if isinstance(value, six.integer_types):
+                    return check_constraints(decimal.Decimal(value))
+                if not isinstance(value, six.string_types):
+                    return False
+                value = value.strip()
+                if not value:
+                    return not required
+                if not cls.NUMBER_REGEX.match(value):
+                    return False
+                return check_constraints(decimal.Decimal(value))
+
+            return check
+
+        if field_type == 'boolean':
+            accepted = set(table_field.descriptor.get('trueValues') or cls.TABLESCHEMA_TRUE_VALUES) | set(
+                table_field.descriptor.get('falseValues') or cls.TABLESCHEMA_FALSE_VALUES)
+
+            def check(value):
+                if isinstance(value, bool):
+                    return True
+                if not isinstance(value, six.string_types):
+                    return False
+                value = value.strip()
+                if not value:
+                    return not required
+                return value in accepted
+
+            return check
+
+        if field.is_datetime_types and field_format == 'any':
+            cast_any = field.date_caster.cast
+
+            def check(value):
+                if not isinstance(value, six.string_types):
+                    return False
+                value = value.strip()
+                if not value:
+                    return not required
+                try:
+                    cast_any(value)
+                    return True
+                except Exception:
+                    return False
+
+            return check
+
+        return None
+
+
 class GenericSchema(object):
     """
     A utility class for schema.
@@ -452,6 +748,7 @@ class GenericSchema(object):
         self.foreign_keys = [SchemaForeignKey(fk) for fk in
                              self.schema_model.foreign_keys] if self.schema_model.foreign_keys else []
         self.project = project
+        self._compiled_validator = None
 
     # implement some dict like methods
     def __getitem__(self, item):
@@ -476,19 +773,40 @@ class GenericSchema(object):
     def numeric_fields(self):
         return [f for f in self.fields if f.is_numeric]
 
+    @property
+    def indexed_fields(self):
+        return [f for f in self.fields if f.is_indexed]
+
+    @property
+    def primary_key(self):
+        """
+        :return: the list of the field names of the declared primaryKey. Empty if none.
+        """
+        return self.schema_model.primary_key or []
+
+    @property
+    def compiled_validator(self):
+        if self._compiled_validator is None:
+            self._compiled_validator = CompiledSchemaValidator(self)
+        return self._compiled_validator
+
     def get_field_by_name(self, name):
-        for f in self.fields:
-            if f.name == name:
-                return f
-        return None
+        return self.compiled_validator.get_field_by_name(name)
+
+    def copy(self):
+        """
+        A shallow copy that shares the parsers and the compiled validator of this schema. The fields with a date caster
+        are copied: the date formats learned from the values of a use (an upload) must not be shared with the other
+        uses. See SchemaCache.
+        """
+        result = copy.copy(self)
+        result.fields = [f.copy() if f.has_date_caster else f for f in self.fields]
+        if self._compiled_validator is not None:
+            result._compiled_validator = self._compiled_validator.copy(result)
+        return result
 
     def field_validation_error(self, field_name, value):
-        field = self.get_field_by_name(field_name)
-        if field is not None:
-            return field.validation_error(value)
-        else:
-            raise Exception("The field '{}' doesn't exists in the schema. Should be one of {}"
-                            .format(field_name, self.field_names))
+        return self.compiled_validator.field_validation_error(field_name, value)
 
     def is_field_valid(self, field_name, value):
         return self.field_validation_error(field_name, value) is None
@@ -677,6 +995,30 @@ class ObservationSchema(GenericSchema):
     def cast_geometry(self, record, default_srid=MODEL_SRID):
         return self.geometry_parser.cast_geometry(record, default_srid=default_srid)
 
+    @property
+    def site_geometry_resolver(self):
+        return self.geometry_parser.site_geometry_resolver
+
+    @site_geometry_resolver.setter
+    def site_geometry_resolver(self, resolver):
+        self.geometry_parser.site_geometry_resolver = resolver
+
+    def copy(self):
+        """
+        The copy gets its own site geometry resolver and the date parser uses the copied date field.
+        """
+        result = super(ObservationSchema, self).copy()
+        result.errors = list(self.errors)
+        result.date_parser = copy.copy(self.date_parser)
+        result.date_parser.schema = result
+        if self.date_parser.observation_date_field is not None:
+            result.date_parser.observation_date_field = result.get_field_by_name(
+                self.date_parser.observation_date_field.name)
+        result.geometry_parser = copy.copy(self.geometry_parser)
+        result.geometry_parser.site_geometry_resolver = SiteGeometryResolver(self.project) \
+            if self.project is not None else None
+        return result
+
 
 class SpeciesObservationSchema(ObservationSchema):
     """
@@ -708,6 +1050,64 @@ class SpeciesObservationSchema(ObservationSchema):
         return self.species_name_parser.cast_species_name_id(record)
 
 
+class SchemaCache(object):
+    """
+    A thread safe LRU cache of the schema objects (GenericSchema and subclasses) of the datasets, shared by the
+    requests of a process.
+    The key includes a hash of the schema descriptor, so a changed schema is never served from the cache even if the
+    entry hasn't been invalidated (e.g. a dataset saved by another process).
+    The cached schemas are templates: get returns a copy (see GenericSchema.copy) that can be given per use state.
+    """
+
+    def __init__(self, max_size=128):
+        self.max_size = max_size
+        self._schemas = collections.OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def get_descriptor_hash(descriptor):
+        return hashlib.sha1(json.dumps(descriptor, sort_keys=True).encode('utf-8')).hexdigest()
+
+    def get(self, dataset_id, schema_class, descriptor):
+        """
+        :return: a copy of the cached schema_class(descriptor). Built and cached if not in the cache.
+        """
+        if not self.max_size:
+            return schema_class(descriptor)
+        key = (dataset_id, schema_class, self.get_descriptor_hash(descriptor))
+        with self._lock:
+            schema = self._schemas.pop(key, None)
+            if schema is not None:
+                # most recently used last
+                self._schemas[key] = schema
+                self.hits += 1
+        if schema is None:
+            # the cached schema must not share the descriptor with the caller.
+            schema = schema_class(copy.deepcopy(descriptor))
+            # built once, shared by the copies
+            schema.compiled_validator
+            with self._lock:
+                self.misses += 1
+                self._schemas[key] = schema
+                while len(self._schemas) > self.max_size:
+                    self._schemas.popitem(last=False)
+        return schema.copy()
+
+    def invalidate(self, dataset_id):
+        with self._lock:
+            for key in [key for key in self._schemas if key[0] == dataset_id]:
+                del self._schemas[key]
+
+    def clear(self):
+        with self._lock:
+            self._schemas.clear()
+
+    def __len__(self):
+        return len(self._schemas)
+
+
 def format_required_message(field):
     return "The field named '{field_name}' must have the 'required' constraint set to true.".format(
         field_name=field.name
@@ -772,16 +1172,52 @@ class ObservationDateParser(object):
         return [f for f in all_possibles_fields if f is not None]
 
 
+class SiteGeometryResolver(object):
+    """
+    Resolve a site code into the site geometry.
+    The lookup is scoped to the project and cached: every site code is fetched at most once.
+    An instance is meant to live for the duration of a request or an upload.
+    """
+
+    def __init__(self, project):
+        """
+        :param project: a project or a project id
+        """
+        self.project = project
+        # site code -> (site exists, site geometry)
+        self._cache = {}
+
+    def add_sites(self, sites):
+        """
+        Seed the cache with already fetched sites.
+        """
+        for site in sites:
+            self._cache[site.code] = (True, site.geometry)
+
+    def resolve(self, site_code):
+        """
+        :return: a tuple (site exists, site geometry). The geometry can be None
+        """
+        if site_code not in self._cache:
+            from main.models import Site  # import here to avoid cyclic import problem
+            site = Site.objects.filter(code=site_code, project=self.project).only('pk', 'geometry').first()
+            self._cache[site_code] = (site is not None, site.geometry if site is not None else None)
+        return self._cache[site_code]
+
+
 class GeometryParser(object):
     """
     A utility class to extract the geometry from data given a schema.
     """
 
-    def __init__(self, schema, project=None):
+    def __init__(self, schema, project=None, site_geometry_resolver=None):
         if not isinstance(schema, GenericSchema):
             schema = GenericSchema(schema)
         self.schema = schema
         self.project = project
+        # used to get the geometry of a record from its site code. The site codes can't be resolved without a project.
+        self.site_geometry_resolver = site_geometry_resolver or (
+            SiteGeometryResolver(project) if project is not None else None)
         self.errors = []
 
         # Site Code
@@ -1003,17 +1439,16 @@ class GeometryParser(object):
             result = default_srid
         return result
 
-    def cast_geometry(self, record, default_srid=MODEL_SRID):
+    def cast_coordinates(self, record, default_srid=MODEL_SRID):
         """
         Precedences rules:
-        easting/northing > lat/long > site geometry
+        easting/northing > lat/long
         :param record: a column -> value dictionary
         :param default_srid:
-        :return: Will throw an exception if anything went wrong
+        :return: (x, y, srid) or None if the record has no coordinates. x = longitude or easting,
+        y = latitude or northing. Will throw an exception if the values are not valid.
         """
-        x, y = (None, None)  # x = longitude or easting, y = latitude or northing.
-        geometry = None
-
+        x, y = (None, None)
         if self.is_easting_northing:
             x = record.get(self.easting_field.name)
             y = record.get(self.northing_field.name)
@@ -1022,15 +1457,30 @@ class GeometryParser(object):
             y = record.get(self.latitude_field.name)
         if not is_blank_value(x) and not is_blank_value(y):
             srid = self.cast_srid(record, default_srid=default_srid)
-            geometry = Point(x=float(x), y=float(y), srid=srid)
+            return float(x), float(y), srid
+        return None
+
+    def cast_geometry(self, record, default_srid=MODEL_SRID):
+        """
+        Precedences rules:
+        easting/northing > lat/long > site geometry
+        :param record: a column -> value dictionary
+        :param default_srid:
+        :return: Will throw an exception if anything went wrong
+        """
+        geometry = None
+        coordinates = self.cast_coordinates(record, default_srid=default_srid)
+        if coordinates is not None:
+            x, y, srid = coordinates
+            geometry = Point(x=x, y=y, srid=srid)
         if geometry is None and self.site_code_field is not None:
             # extract geometry from site
-            from main.models import Site  # import here to avoid cyclic import problem
             site_code = self.get_site_code(record)
-            site = Site.objects.filter(code=site_code).first()
-            if site_code and site is None:
+            if site_code and self.site_geometry_resolver is None:
+                raise Exception("The site {} can't be looked up outside of a project".format(site_code))
+            site_exists, geometry = self.site_geometry_resolver.resolve(site_code) if site_code else (False, None)
+            if site_code and not site_exists:
                 raise Exception('The site {} does not exist'.format(site_code))
-            geometry = site.geometry if site is not None else None
             if geometry is None and self.is_site_code_only:
                 raise Exception('The site {} has no geometry'.format(site_code))
         if geometry is not None:
@@ -1,6 +1,11 @@
 from __future__ import absolute_import, unicode_literals, print_function, division
 
-from django.http import HttpResponse
+import json
+
+from django.core.serializers.json import DjangoJSONEncoder
+from django.http import HttpResponse, StreamingHttpResponse
+
+NDJSON_CONTENT_TYPE = 'application/x-ndjson'
 
 
 class CSVFileResponse(HttpResponse):
@@ -37,3 +42,14 @@ class WorkbookResponse(ExcelFileResponse):
         wb.save(self)
 
 
+class NDJSONStreamingResponse(StreamingHttpResponse):
+    """
+    Stream an iterable of json serializable objects as newline delimited json, one object per line.
+    """
+
+    def __init__(self, objects, **kwargs):
+        kwargs.setdefault('content_type', NDJSON_CONTENT_TYPE)
+        super(NDJSONStreamingResponse, self).__init__(
+            (json.dumps(obj, cls=DjangoJSONEncoder) + '\n' for obj in objects),
+            **kwargs
+        )
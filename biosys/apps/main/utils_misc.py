@@ -1,4 +1,15 @@
+import math
+import re
+from decimal import Decimal
+
+from django.db.models import F
 from django.db.models.expressions import RawSQL
+from django.utils import six
+
+# the text values converted by the biosys_to_numeric database function. Keep in sync with the migration 0022.
+NUMERIC_REGEX = re.compile(r'^\s*[-+]?([0-9]+\.?[0-9]*|\.[0-9]+)([eE][-+]?[0-9]+)?\s*$')
+# the text search configuration of the record search vectors. Keep in sync with the migration 0024.
+SEARCH_CONFIG = 'simple'
 
 
 def get_value(keys, dict_, default=None):
@@ -58,20 +69,119 @@ def search_json_fields(qs, field_info, search_param):
     return qs.extra(where=['OR '.join(where_clauses)], params=params)
 
 
-def order_by_json_field(qs, json_field_name, keys, ordering_param):
+def search_records(qs, search_param, rank=True):
+    """
+    Full text search on the record search vectors (see Record.update_search_vectors).
+    Every word of the search must match the prefix of a word of the record.
+    :param qs: record queryset
+    :param search_param: the words to search
+    :param rank: order the records by rank (best first) then id
+    :return: the queryset after search filters applied. Unchanged if there's no word to search.
+    """
+    words = re.findall(r'\w+', search_param, flags=re.UNICODE)
+    if not words:
+        return qs
+    query = ' & '.join(word + ':*' for word in words)
+    vector = qs.model._meta.db_table + '.search_vector'
+    tsquery = "to_tsquery('" + SEARCH_CONFIG + "', %s)"
+    qs = qs.extra(where=[vector + ' @@ ' + tsquery], params=[query])
+    if rank:
+        qs = qs.extra(
+            select={'search_rank': 'ts_rank(' + vector + ', ' + tsquery + ')'},
+            select_params=[query],
+            order_by=['-search_rank', 'id']
+        )
+    return qs
+
+
+def order_by_json_fields(qs, fields, ordering_param, model_fields=None, tiebreak='id'):
     """
-    Order by does not support ordering within JSONField.
+    Order by keys within JSONFields, cast according to their type, and model fields.
+    The expressions are the ones of the data indexes (see json_field_expression) so an index can serve the ordering.
     :param qs: queryset
-    :param json_field_name: json field with values within to potentially order by
-    :param keys: list of keys in json field to potentially order by
-    :param ordering_param: field to order by, prefixed with '-' for descending order
-    :return: the queryset after ordering is applied if order_by param is within the json field
+    :param fields: dictionary key -> (json_field_name, field_type) of the keys that can be ordered by
+    :param ordering_param: comma separated keys, each prefixed with '-' for descending order. Unknown keys are ignored.
+    :param model_fields: list of the model fields that can be ordered by
+    :param tiebreak: the unique model field added to the ordering to make it stable, in the direction of the first key.
+    :return: the queryset after ordering is applied if any key is valid
     """
-    for key in keys:
-        if ordering_param == key or ordering_param == '-' + key:
-            if ordering_param.startswith('-'):
-                qs = qs.order_by(RawSQL(json_field_name + '->%s', (ordering_param[1:],)).desc())
-            else:
-                qs = qs.order_by(RawSQL(json_field_name + '->%s', (ordering_param,)))
+    model_fields = model_fields or []
+    order_by = []
+    names = []
+    for term in ordering_param.split(','):
+        term = term.strip()
+        descending = term.startswith('-')
+        name = term[1:] if descending else term
+        if name in fields:
+            json_field_name, field_type = fields[name]
+            expression = RawSQL(*json_field_expression(json_field_name, name, field_type))
+        elif name in model_fields:
+            expression = F(name)
+        else:
+            continue
+        order_by.append(expression.desc() if descending else expression.asc())
+        names.append(name)
+    if not order_by:
+        return qs
+    if tiebreak not in names:
+        first_descending = order_by[0].descending
+        order_by.append(F(tiebreak).desc() if first_descending else F(tiebreak).asc())
+    return qs.order_by(*order_by)
 
-    return qs
+
+def json_field_expression(json_field_name, key, field_type=None):
+    """
+    The typed SQL expression of a key within a JSONField. It's the expression of the data indexes (see DataIndex), a
+    query must use the exact same expression for the index to be used.
+    The numeric values are cast with the biosys_to_numeric function (see migration 0022) and the dates with the
+    biosys_to_timestamp function (see migrations 0023 and 0027), the invalid values give NULL instead of an error.
+    All the other types are compared as text.
+    :param json_field_name: json field name
+    :param key: key in the json field
+    :param field_type: the schema type of the key ('integer', 'number', 'string'...)
+    :return: (sql, params)
+    """
+    if field_type in ['integer', 'number']:
+        return 'biosys_to_numeric(' + json_field_name + '->>%s)', [key]
+    if field_type in ['date', 'datetime']:
+        return 'biosys_to_timestamp(' + json_field_name + '->>%s)', [key]
+    return '(' + json_field_name + '->>%s)', [key]
+
+
+def filter_indexed_json_fields(qs, json_field_name, fields, values):
+    """
+    Add to the queryset an equality clause for each value of an indexed field, so that the data index can be used.
+    The clauses don't replace the json field contains filter, they are implied by it and only give the database a
+    way to use the index.
+    The numeric values are cast to numeric whatever their literal is (a float can give a double precision one): the
+    index on biosys_to_numeric(...) can't be used by a biosys_to_numeric(...) = float8 clause.
+    :param qs: queryset
+    :param json_field_name: json field name
+    :param fields: list of (key, field_type) of the indexed keys
+    :param values: the dictionary of values of the contains filter
+    :return: the queryset after the clauses are applied
+    """
+    if not isinstance(values, dict):
+        return qs
+    where_clauses = []
+    params = []
+    for key, field_type in fields:
+        value = values.get(key)
+        if field_type in ['integer', 'number']:
+            if isinstance(value, six.string_types) and NUMERIC_REGEX.match(value):
+                value = Decimal(value.strip())
+            elif isinstance(value, bool) or not isinstance(value, six.integer_types + (float,)) \
+                    or math.isinf(value) or math.isnan(value):
+                continue
+            cast = '::numeric'
+        elif field_type in ['date', 'datetime'] or not isinstance(value, six.string_types):
+            # a date string can't be compared to the cast date without parsing it like the database does.
+            continue
+        else:
+            cast = ''
+        sql, sql_params = json_field_expression(json_field_name, key, field_type)
+        where_clauses.append(sql + ' = %s' + cast)
+        params += sql_params + [value]
+    if not where_clauses:
+        return qs
+    return qs.extra(where=where_clauses, params=params)
@@ -46,11 +46,25 @@ All species information are in the properties field.
 """
 from __future__ import absolute_import, unicode_literals, print_function, division
 
+import array
+import collections
+import datetime
+import heapq
 import logging
+import threading
+import time
+from multiprocessing.pool import ThreadPool
+
 import requests
 from confy import env
 
-from django.utils import six
+from django.conf import settings
+from django.db import connections, transaction
+from django.db.models import Max
+from django.utils import six, timezone
+from django.utils.six.moves.urllib import parse
+
+from main.models import CachedSpecies
 
 logger = logging.getLogger(__name__)
 
@@ -70,6 +84,176 @@ def get_key_for_value(dict_, value, default=None):
     return default
 
 
+class SpeciesIndex(object):
+    """
+    O(1) species name -> name id and name id -> species name lookups over a species list.
+    The name lookup is case and whitespace insensitive (see normalise).
+    The names and ids are stored once, in a list and an array, and the two indexes only hold positions.
+    """
+
+    def __init__(self, name_id_by_species_name=None):
+        self.names = []
+        self.ids = array.array('l')
+        # normalised name -> position
+        self._position_by_key = {}
+        # name id -> position
+        self._position_by_id = {}
+        # exact name -> position for the names that have the same normalised form as another one.
+        self._collisions = {}
+        # see matcher
+        self._matcher = None
+        for species_name, name_id in six.iteritems(name_id_by_species_name or {}):
+            self.add(species_name, name_id)
+
+    @staticmethod
+    def normalise(species_name):
+        return ' '.join(species_name.split()).lower()
+
+    def add(self, species_name, name_id):
+        position = len(self.names)
+        self.names.append(species_name)
+        self.ids.append(int(name_id))
+        key = self.normalise(species_name)
+        if key in self._position_by_key:
+            self._collisions[species_name] = position
+        else:
+            self._position_by_key[key] = position
+        self._position_by_id.setdefault(int(name_id), position)
+        self._matcher = None
+
+    def _get_position(self, species_name):
+        if not species_name:
+            return None
+        position = self._collisions.get(species_name) if self._collisions else None
+        if position is None:
+            position = self._position_by_key.get(self.normalise(species_name))
+        return position
+
+    def get_name_id(self, species_name, default=None):
+        position = self._get_position(species_name)
+        return self.ids[position] if position is not None else default
+
+    def get_species(self, species_name, default=None):
+        """
+        :return: the (species name, name id) of the species list that matches the name. The species name is the one of
+        the list, whatever the case and the whitespaces of the given name.
+        """
+        position = self._get_position(species_name)
+        return (self.names[position], self.ids[position]) if position is not None else default
+
+    def get_species_name(self, name_id, default=None):
+        try:
+            position = self._position_by_id.get(int(name_id))
+        except (TypeError, ValueError):
+            return default
+        return self.names[position] if position is not None else default
+
+    def has_name_id(self, name_id):
+        return self.get_species_name(name_id) is not None
+
+    def items(self):
+        """
+        :return: the (species_name, name_id) pairs
+        """
+        return zip(self.names, self.ids)
+
+    def __len__(self):
+        return len(self.names)
+
+    @property
+    def matcher(self):
+        """
+        The SpeciesMatcher of the index. Built on first use.
+        """
+        if self._matcher is None:
+            self._matcher = SpeciesMatcher(self)
+        return self._matcher
+
+
+class SpeciesMatcher(object):
+    """
+    Fuzzy species name matching over a SpeciesIndex with a trigram index.
+    The similarity of two names is the Dice coefficient of their sets of trigrams (0 to 1), computed on the normalised
+    names. Only the species that share at least one trigram with a name are scored.
+    """
+    N = 3
+
+    def __init__(self, species_index):
+        self.species_index = species_index
+        # trigram -> positions in the species index
+        self._positions_by_gram = collections.defaultdict(lambda: array.array('l'))
+        # number of distinct trigrams of the species at position
+        self._gram_counts = array.array('l')
+        for position, species_name in enumerate(species_index.names):
+            grams = self.get_grams(species_name)
+            self._gram_counts.append(len(grams))
+            for gram in grams:
+                self._positions_by_gram[gram].append(position)
+        self._positions_by_gram = dict(self._positions_by_gram)
+
+    @classmethod
+    def get_grams(cls, species_name):
+        """
+        :return: the set of trigrams of the normalised name, padded with spaces so that the start and the end of the
+        words weigh more.
+        """
+        padded = '  {} '.format(SpeciesIndex.normalise(species_name))
+        return set(padded[i:i + cls.N] for i in range(len(padded) - cls.N + 1))
+
+    def suggest(self, species_name, limit=None, min_score=None):
+        """
+        :return: the list of the best matches, best first: [{'speciesName': .., 'nameId': .., 'score': ..}]
+        """
+        limit = limit or settings.SPECIES_MATCH_SUGGESTIONS
+        min_score = settings.SPECIES_MATCH_MIN_SCORE if min_score is None else min_score
+        grams = self.get_grams(species_name) if species_name else set()
+        if not grams:
+            return []
+        shared = collections.Counter()
+        for gram in grams:
+            shared.update(self._positions_by_gram.get(gram, ()))
+        scores = (
+            (2.0 * count / (len(grams) + self._gram_counts[position]), position)
+            for position, count in six.iteritems(shared)
+        )
+        best = heapq.nlargest(limit, (item for item in scores if item[0] >= min_score),
+                              key=lambda item: (item[0], -item[1]))
+        return [
+            {
+                'speciesName': self.species_index.names[position],
+                'nameId': self.species_index.ids[position],
+                'score': round(score, 3)
+            } for score, position in best
+        ]
+
+    def match(self, species_names, limit=None, min_score=None):
+        """
+        Suggestions for a batch of names. Every distinct name is matched once.
+        :return: an OrderedDict {species_name: suggestions (see suggest)} in the order of the names.
+        """
+        result = collections.OrderedDict()
+        for species_name in species_names:
+            if species_name not in result:
+                result[species_name] = self.suggest(species_name, limit=limit, min_score=min_score)
+        return result
+
+
+def get_species_facade_class():
+    """
+    :return: the species facade class declared in settings.SPECIES_FACADE_CLASS or the NoSpeciesFacade if not set or
+    the class cannot be imported.
+    """
+    # import here to avoid loading DRF at module level
+    from rest_framework.settings import import_from_string
+    if settings.SPECIES_FACADE_CLASS:
+        try:
+            return import_from_string(settings.SPECIES_FACADE_CLASS, 'SPECIES_FACADE_CLASS')
+        except Exception:
+            msg = "Error while importing the species facade class {}".format(settings.SPECIES_FACADE_CLASS)
+            logger.exception(msg)
+    return NoSpeciesFacade
+
+
 class HerbieError(Exception):
     pass
 
@@ -92,6 +276,12 @@ class SpeciesFacade(object):
             [(sp[self.PROPERTY_SPECIES_NAME.herbie_name], sp[self.PROPERTY_NAME_ID.herbie_name]) for sp in species]
         )
 
+    def get_species_index(self):
+        """
+        :return: a SpeciesIndex of the species list
+        """
+        return SpeciesIndex(self.name_id_by_species_name())
+
     def get_all_species(self, properties=None):
         """
         :param properties: a sequence of Property, e.g [PROPERTY_SPECIES_NAME, PROPERTY_NAME_ID] or None for all
@@ -106,6 +296,17 @@ class HerbieFacade(SpeciesFacade):
     BASE_URL = env('HERBIE_SPECIES_WFS_URL',
                    'https://kmi.dbca.wa.gov.au/geoserver/ows?service=wfs&version=1.1.0'
                    '&request=GetFeature&typeNames=public:herbie_hbvspecies_public&outputFormat=application/json')
+    # The species are fetched by pages of PAGE_SIZE features with at most MAX_PARALLEL_REQUESTS requests at once.
+    # A request that fails with a connection error, a timeout or a server error is retried MAX_RETRIES times, after
+    # RETRY_DELAY seconds doubled at every attempt.
+    PAGE_SIZE = env('HERBIE_PAGE_SIZE', 5000)
+    MAX_PARALLEL_REQUESTS = env('HERBIE_MAX_PARALLEL_REQUESTS', 4)
+    MAX_RETRIES = env('HERBIE_MAX_RETRIES', 3)
+    RETRY_DELAY = env('HERBIE_RETRY_DELAY', 1)
+    TIMEOUT = env('HERBIE_TIMEOUT', 60)
+    # The pages are sorted on a unique property: the WFS servers don't guarantee the order of the features between two
+    # requests, without a sort the pages could overlap or miss species.
+    SORT_BY = env('HERBIE_SORT_BY', 'name_id')
 
     @staticmethod
     def _add_attributes_filter_to_params(properties, params=None):
@@ -123,25 +324,105 @@ class HerbieFacade(SpeciesFacade):
             )
         return params
 
-    @staticmethod
-    def _query_species(params=None):
-        r = requests.get(HerbieFacade.BASE_URL, params=params)
-        r.raise_for_status()
+    @classmethod
+    def _get_page_size_param(cls):
+        # WFS 2.0 'count', WFS 1.x 'maxFeatures'
+        version = dict(parse.parse_qsl(parse.urlparse(cls.BASE_URL).query)).get('version', '')
+        return 'maxFeatures' if version.startswith('1.') else 'count'
+
+    @classmethod
+    def _query_page(cls, params, start_index):
+        """
+        Fetch and parse one page of species, with retries.
+        :return: (list of species properties, number of species matched by the query or None if unknown)
+        """
+        page_params = dict(params or {})
+        page_params['startIndex'] = start_index
+        page_params[cls._get_page_size_param()] = cls.PAGE_SIZE
+        if cls.SORT_BY:
+            page_params.setdefault('sortBy', cls.SORT_BY)
+        attempt = 0
+        while True:
+            try:
+                r = requests.get(cls.BASE_URL, params=page_params, timeout=cls.TIMEOUT)
+                r.raise_for_status()
+                break
+            except requests.RequestException as e:
+                response = getattr(e, 'response', None)
+                if (response is not None and response.status_code < 500) or attempt >= cls.MAX_RETRIES:
+                    raise
+                attempt += 1
+                logger.warning("Herbie request failed (startIndex={}, attempt {}): {}".format(start_index, attempt, e))
+                time.sleep(cls.RETRY_DELAY * 2 ** (attempt - 1))
         try:
-            return [f['properties'] for f in r.json()['features']]
+            content = r.json()
+            species = [f['properties'] for f in content['features']]
         except Exception as e:
             # If we have an exception here it's probably because the request is not correct (XML error from geoserver)
             message = 'Herbie returned an error: {}. \nURL: {}. \nResponse: {}'.format(e, r.url, r.content)
             logger.warning(message)
             raise HerbieError(message)
+        total = content.get('numberMatched', content.get('totalFeatures'))
+        return species, total if isinstance(total, six.integer_types) else None
+
+    @classmethod
+    def iter_species(cls, params=None):
+        """
+        Yield the species properties in the order of the service, page by page.
+        The first page gives the number of species, the next pages are then fetched in parallel. If the service doesn't
+        return the number of species the pages are fetched one after the other until a short page.
+        Only the pages being fetched and the page being yielded are in memory.
+        """
+        species, total = cls._query_page(params, 0)
+        for sp in species:
+            yield sp
+        if total is None:
+            # until the first short page
+            start_index = len(species)
+            while species and len(species) >= cls.PAGE_SIZE:
+                species, total = cls._query_page(params, start_index)
+                start_index += len(species)
+                for sp in species:
+                    yield sp
+            return
+        # the service may return less than PAGE_SIZE features per page (server limit)
+        page_size = len(species)
+        if not page_size:
+            return
+        start_indexes = list(range(page_size, total, page_size))
+        if not start_indexes:
+            return
+        max_pending = max(1, min(cls.MAX_PARALLEL_REQUESTS, len(start_indexes)))
+        pool = ThreadPool(processes=max_pending)
+        pending = collections.deque()
+        try:
+            for start_index in start_indexes:
+                pending.append(pool.apply_async(cls._query_page, (params, start_index)))
+                if len(pending) >= max_pending:
+                    for sp in pending.popleft().get()[0]:
+                        yield sp
+            while pending:
+                for sp in pending.popleft().get()[0]:
+                    yield sp
+            pool.close()
+        except BaseException:
+            pool.terminate()
+            raise
+        finally:
+            pool.join()
+
+    @classmethod
+    def _query_species(cls, params=None):
+        return list(cls.iter_species(params))
 
     def name_id_by_species_name(self):
         """
         :return: a dict where key is species_name and the value is name_id
         """
-        species = self.get_all_species([self.PROPERTY_SPECIES_NAME, self.PROPERTY_NAME_ID])
+        species = self.iter_species(
+            self._add_attributes_filter_to_params([self.PROPERTY_SPECIES_NAME, self.PROPERTY_NAME_ID]))
         return dict(
-            [(sp[self.PROPERTY_SPECIES_NAME.herbie_name], sp[self.PROPERTY_NAME_ID.herbie_name]) for sp in species]
+            (sp[self.PROPERTY_SPECIES_NAME.herbie_name], sp[self.PROPERTY_NAME_ID.herbie_name]) for sp in species
         )
 
     def get_all_species(self, properties=None):
@@ -158,4 +439,128 @@ class NoSpeciesFacade(SpeciesFacade):
     def get_all_species(self, properties=None):
         return []
 
-# TODO: implement a cached version of Herbie (memory/disk or db?). Cache renewal policy?
+
+class CachedSpeciesFacade(SpeciesFacade):
+    """
+    A species facade backed by a local copy (the CachedSpecies table) of the species list of a source facade, Herbie
+    by default.
+    Cache policy:
+    - an empty cache is filled from the source facade on first use (blocking).
+    - a cache older than settings.SPECIES_CACHE_TTL (seconds) is still used but refreshed in a background thread
+    (stale-while-revalidate).
+    - the cache can be refreshed with the refresh_species_cache command, e.g. from a cron job.
+    To use it set SPECIES_FACADE_CLASS='main.utils_species.CachedSpeciesFacade'.
+    """
+    source_facade_class = HerbieFacade
+
+    # [refreshed, name_id_by_species_name, SpeciesIndex or None] of the last cache load. Shared by the instances of
+    # the process.
+    _memory = None
+    # only one refresh at a time in a process.
+    _refresh_lock = threading.Lock()
+
+    @staticmethod
+    def get_refreshed():
+        """
+        :return: the datetime of the last refresh or None if the cache is empty
+        """
+        return CachedSpecies.objects.aggregate(refreshed=Max('refreshed'))['refreshed']
+
+    @staticmethod
+    def is_stale(refreshed):
+        return refreshed is None or \
+            timezone.now() - refreshed > datetime.timedelta(seconds=settings.SPECIES_CACHE_TTL)
+
+    @classmethod
+    def refresh(cls):
+        """
+        Replace the cached species list by the list of the source facade.
+        :return: the number of species
+        """
+        species = cls.source_facade_class().name_id_by_species_name()
+        now = timezone.now()
+        with transaction.atomic():
+            CachedSpecies.objects.all().delete()
+            CachedSpecies.objects.bulk_create(
+                [CachedSpecies(species_name=name, name_id=name_id, refreshed=now)
+                 for name, name_id in six.iteritems(species)],
+                batch_size=5000
+            )
+        logger.info("Species cache refreshed: {} species".format(len(species)))
+        return len(species)
+
+    @classmethod
+    def refresh_in_background(cls):
+        """
+        Refresh the cache in a thread, unless a refresh is already running in this process.
+        :return: the thread or None
+        """
+        if not cls._refresh_lock.acquire(False):
+            return None
+
+        def run():
+            try:
+                # another process may have refreshed the cache in the meantime.
+                if cls.is_stale(cls.get_refreshed()):
+                    cls.refresh()
+            except Exception:
+                logger.exception("Error while refreshing the species cache")
+            finally:
+                # the connections opened by this thread
+                connections.close_all()
+                cls._refresh_lock.release()
+
+        thread = threading.Thread(target=run, name='species-cache-refresh')
+        thread.daemon = True
+        thread.start()
+        return thread
+
+    def _get_memory(self):
+        cls = CachedSpeciesFacade
+        refreshed = self.get_refreshed()
+        if refreshed is None or (self.is_stale(refreshed) and not settings.SPECIES_CACHE_BACKGROUND_REFRESH):
+            with cls._refresh_lock:
+                refreshed = self.get_refreshed()
+                if self.is_stale(refreshed):
+                    self.refresh()
+                    refreshed = self.get_refreshed()
+        elif self.is_stale(refreshed):
+            self.refresh_in_background()
+        memory = cls._memory
+        if memory is None or memory[0] != refreshed:
+            memory = [refreshed, dict(CachedSpecies.objects.values_list('species_name', 'name_id')), None]
+            cls._memory = memory
+        return memory
+
+    def _get_name_id_by_species_name(self):
+        return self._get_memory()[1]
+
+    def name_id_by_species_name(self):
+        """
+        :return: a dict where key is species_name and the value is name_id
+        """
+        return dict(self._get_name_id_by_species_name())
+
+    def get_species_index(self):
+        """
+        The index is built once per cache refresh and shared. It must not be modified.
+        """
+        memory = self._get_memory()
+        if memory[2] is None:
+            memory[2] = SpeciesIndex(memory[1])
+        return memory[2]
+
+    def get_all_species(self, properties=None):
+        """
+        Only the species_name and name_id properties are cached.
+        """
+        names = [p.herbie_name for p in properties] if properties else \
+            [self.PROPERTY_SPECIES_NAME.herbie_name, self.PROPERTY_NAME_ID.herbie_name]
+        result = []
+        for species_name, name_id in six.iteritems(self._get_name_id_by_species_name()):
+            sp = {
+                self.PROPERTY_SPECIES_NAME.herbie_name: species_name,
+                self.PROPERTY_NAME_ID.herbie_name: name_id
+            }
+            result.append({name: sp.get(name) for name in names})
+        return result
@@ -249,6 +249,40 @@ BOOTSTRAP3 = {
 # To use the WA Herbarium web service set SPECIES_FACADE_CLASS='main.utils_species.HerbieFacade'
 # in the environment file.
 SPECIES_FACADE_CLASS = env('SPECIES_FACADE_CLASS', None)
+# For SPECIES_FACADE_CLASS='main.utils_species.CachedSpeciesFacade', a local copy of the Herbie species list:
+# age in seconds after which the copy is refreshed, in the background if SPECIES_CACHE_BACKGROUND_REFRESH is True.
+SPECIES_CACHE_TTL = env('SPECIES_CACHE_TTL', 24 * 3600)
+SPECIES_CACHE_BACKGROUND_REFRESH = env('SPECIES_CACHE_BACKGROUND_REFRESH', True)
+# Fuzzy matching of the species names not found in the species list: number of suggestions by name and minimum
+# similarity score (0 to 1) of a suggestion.
+SPECIES_MATCH_SUGGESTIONS = env('SPECIES_MATCH_SUGGESTIONS', 5)
+SPECIES_MATCH_MIN_SCORE = env('SPECIES_MATCH_MIN_SCORE', 0.3)
+
+# Number of records saved per bulk insert when uploading a records file (csv/xlsx).
+# Set it to 0 to save the records one by one.
+RECORD_UPLOAD_BATCH_SIZE = env('RECORD_UPLOAD_BATCH_SIZE', 500)
+# Number of processes used to validate the rows of a records file in the upload jobs (process_upload_jobs command).
+# The uploads done in a web request are always validated in the request process: the pool is forked and the web
+# process can run background threads (species list refresh, data index builder).
+# 0 or 1 means the rows are validated in the upload job process.
+RECORD_UPLOAD_PROCESSES = env('RECORD_UPLOAD_PROCESSES', 0)
+# Background upload jobs (process_upload_jobs command): a running job whose progress hasn't been saved for this number
+# of seconds is considered dead (worker killed) and marked as failed, and the maximum number of row results kept by job.
+# The summary report of a job always covers all the rows.
+UPLOAD_JOB_TIMEOUT = env('UPLOAD_JOB_TIMEOUT', 30 * 60)
+UPLOAD_JOB_MAX_RESULTS = env('UPLOAD_JOB_MAX_RESULTS', 10000)
+# Number of dataset schema objects cached by process (see main.utils_data_package.SchemaCache). 0 disables the cache.
+SCHEMA_CACHE_SIZE = env('SCHEMA_CACHE_SIZE', 256)
+# Build the data indexes declared in the dataset schemas (biosys 'indexed' flag) in a background thread when a dataset
+# is saved. Set to False to build them only with the build_data_indexes command.
+DATA_INDEX_BACKGROUND_BUILD = env('DATA_INDEX_BACKGROUND_BUILD', True)
+# Rebuild the full text search vectors of a dataset in a background thread when its schema fields change. Set to False
+# to rebuild them only with the build_search_vectors command.
+SEARCH_VECTOR_BACKGROUND_BUILD = env('SEARCH_VECTOR_BACKGROUND_BUILD', True)
+# Chunked (resumable) uploads: where the chunks are stored until the upload is finalized and the maximum size of a
+# chunk in bytes.
+CHUNKED_UPLOAD_ROOT = env('CHUNKED_UPLOAD_ROOT', os.path.join(MEDIA_ROOT, 'chunked_uploads'))
+CHUNKED_UPLOAD_MAX_CHUNK_SIZE = env('CHUNKED_UPLOAD_MAX_CHUNK_SIZE', 10 * 1024 * 1024)
 
 # Logging settings
 # Ensure that the logs directory exists: